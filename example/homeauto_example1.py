@@ -11,8 +11,8 @@
 # IP: 192.168.178.1
 # Password: PASSWORD
 # [*] Load all switch plugs currently connected to the Fritz!Box
-# [*] Switch plug "087610520001" is on
-# [*] Switch plug "087610510002" is on
+# [*] Switch plug "087610520001" is on, power 12.5 W
+# [*] Switch plug "087610510002" is off, power 0.0 W
 
 import fritzbox.FBHomeAuto as fha
 import sys
@@ -26,8 +26,12 @@ print(f'Password: {password}')
 fb_ha = fha.FBHomeAuto(ip=ip, password=password)
 
 print('[*] Load all switch plugs currently connected to the Fritz!Box')
-switch_plugs = fb_ha.get_switch_plugs()
+actors = fb_ha.get_device_list_infos()
 
-for switch in switch_plugs:
-    state = 'on' if fb_ha.get_switch_plug_state(switch) else 'off'
-    print(f'[*] Switch plug "{switch}" is {state}')
+for actor in actors:
+    if actor.is_group or not actor.has_function(fha.FUNCTION_SWITCH_PLUG):
+        continue
+
+    state = 'on' if actor.switch_state else 'off'
+    power = (actor.power or 0) / 1000
+    print(f'[*] Switch plug "{actor.ain}" is {state}, power {power} W')
@@ -17,6 +17,7 @@
 # ...
 
 import fritzbox.FBPresence as fp
+import time
 
 ip = '192.168.178.1'
 password = 'PASSWORD'
@@ -32,9 +33,9 @@ def alert_change(device, old_state, new_state):
 fb_p = fp.FBPresence(ip=ip, password=password)
 
 print('[*] Starting device supervision')
-fp.start_device_presence_supervision(fb_p,
-                                     device,
-                                     alert_change)
+handle = fp.start_device_presence_supervision(fb_p,
+                                              device,
+                                              alert_change)
 
 while True:
-    pass
+    time.sleep(1)
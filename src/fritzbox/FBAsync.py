@@ -0,0 +1,1308 @@
+# -*- coding: utf-8 -*-
+"""Module for asynchronous communication with a FritzBox.
+
+This module provides asyncio based counterparts of the classes FritzBox, FBPresence and FBHomeAuto.
+The HTTP requests are sent using aiohttp if it is installed, otherwise a minimal HTTP/1.1 client
+built on asyncio.open_connection is used.
+"""
+
+import fritzbox._info
+
+__author__     = fritzbox._info.__author__
+__copyright__  = fritzbox._info.__copyright__
+__credits__    = fritzbox._info.__credits__
+__license__    = fritzbox._info.__license__
+__maintainer__ = fritzbox._info.__maintainer__
+__email__      = fritzbox._info.__email__
+
+
+#===============================================================================
+# Imports
+#===============================================================================
+import argparse
+import logging
+import asyncio
+import collections
+import http.client
+import os
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import fritzbox.FBCore
+import fritzbox.FBPresence
+import fritzbox.FBHomeAuto
+import fritzbox.FBTR064
+
+
+#===============================================================================
+# Evaluate parameters
+#===============================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="%(prog)s [options]",
+                                     description="In case no option is selected the script will "
+                                     "return the list of all known devices and the list of all switch plugs. "
+                                     "Both lists are loaded concurrently.")
+
+    parser.add_argument('--v1',
+                      help='Debug level INFO',
+                      dest='verbose_INFO',
+                      default=False,
+                      action='store_true')
+    parser.add_argument('--v2',
+                        help='Debug level ERROR',
+                        dest='verbose_ERROR',
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--v3',
+                        help='Debug level DEBUG',
+                        dest='verbose_DEBUG',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('-i',
+                        '--ip',
+                        help='IP adress of the FritzBox, eg. "192.168.0.1"',
+                        dest='ip',
+                        default="192.168.0.1",
+                        action='store',
+                        required=True)
+    parser.add_argument('-p',
+                        '--password',
+                        help='Password for accessing the FritzBox, eg. "mysecret123"',
+                        dest='password',
+                        default="password",
+                        action='store',
+                        required=True)
+
+    args = parser.parse_args()
+
+
+#===============================================================================
+# Setup logger
+#===============================================================================
+if __name__ == '__main__':
+    log_level = logging.CRITICAL
+
+    if args.verbose_INFO:
+        log_level = logging.INFO
+
+    if args.verbose_ERROR:
+        log_level = logging.ERROR
+
+    if args.verbose_DEBUG:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(level=log_level,
+                        format="[{asctime}] - [{levelname}]: {message}",
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        style="{")
+
+logger = logging.getLogger(__name__)
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+STALE_CONNECTION_ERRORS = fritzbox.FBCore.STALE_CONNECTION_ERRORS + (asyncio.IncompleteReadError,)
+
+
+#===============================================================================
+# Class definitions
+#===============================================================================
+class AsyncFBConnectionPool(object):
+    """Bounded pool of keep-alive HTTP connections to a FritzBox for use within an event loop.
+
+    The pool behaves like fritzbox.FBCore.FBConnectionPool. If aiohttp is installed the requests are
+    delegated to an aiohttp session, otherwise the connections are handled by a minimal HTTP/1.1
+    client on top of asyncio streams.
+
+    Waiting for a connection is limited by connect_timeout, every read from a connection by
+    read_timeout seconds.
+    """
+
+    def __init__(self, host, port=fritzbox.FBCore.HTTP_PORT, size=fritzbox.FBCore.POOL_SIZE,
+                 idle_timeout=fritzbox.FBCore.POOL_IDLE_TIMEOUT, connect_timeout=fritzbox.FBCore.CONNECT_TIMEOUT,
+                 read_timeout=fritzbox.FBCore.READ_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self._idle = collections.deque()
+        self._slots = None
+        self._session = None
+
+
+    async def request(self, method, url, headers):
+        """Send a request to the FritzBox using a pooled connection.
+
+        Args:
+            method (str):   HTTP method, e.g. 'GET'
+            url (str):      Path and query of the requested page
+            headers (dict): HTTP headers sent with the request
+
+        Returns:
+            Tuple (status, reason, page) of the response.
+
+        Raises:
+            OSError, http.client.HTTPException: The request could not be completed.
+            asyncio.TimeoutError: The FritzBox did not answer in time.
+        """
+
+        response = await self.open(method, url, headers)
+
+        async with response:
+            page = await response.read()
+
+        return response.status, response.reason, page
+
+
+    async def open(self, method, url, headers):
+        """Send a request to the FritzBox and return the response without reading its body.
+
+        The connection stays assigned to the response until the response is closed. Use the
+        response as asynchronous context manager to make sure it is closed.
+
+        Args:
+            method (str):   HTTP method, e.g. 'GET'
+            url (str):      Path and query of the requested page
+            headers (dict): HTTP headers sent with the request
+
+        Returns:
+            response (AsyncFBStreamResponse): Response of the FritzBox
+
+        Raises:
+            OSError, http.client.HTTPException: The request could not be completed.
+            asyncio.TimeoutError: The FritzBox did not answer in time.
+        """
+
+        if aiohttp is not None:
+            return await self._open_aiohttp(method, url, headers)
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+
+        await asyncio.wait_for(self._slots.acquire(), self.connect_timeout)
+
+        try:
+            conn, reused = await self._acquire()
+
+            try:
+                response = await self._send(conn, method, url, headers)
+            except STALE_CONNECTION_ERRORS:
+                conn[1].close()
+
+                if not reused:
+                    raise
+
+                logger.debug("Reconnect to the FritzBox after stale keep-alive connection")
+
+                conn = await self._connect()
+
+                try:
+                    response = await self._send(conn, method, url, headers)
+                except:
+                    conn[1].close()
+
+                    raise
+            except:
+                conn[1].close()
+
+                raise
+        except:
+            self._slots.release()
+
+            raise
+
+        status, reason, response_headers, will_close = response
+
+        return AsyncFBStreamResponse(self, conn, status, reason, response_headers, will_close)
+
+
+    async def close(self):
+        """Close all connections of the pool.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        while self._idle:
+            conn, ts = self._idle.pop()
+
+            conn[1].close()
+
+        if self._session is not None:
+            await self._session.close()
+
+            self._session = None
+
+
+    async def _open_aiohttp(self, method, url, headers):
+        """Send the request using an aiohttp session."""
+
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.size, keepalive_timeout=self.idle_timeout)
+            timeout = aiohttp.ClientTimeout(connect=self.connect_timeout, sock_read=self.read_timeout)
+
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+        page_url = 'http://%s:%d%s' % (self.host, self.port, url)
+
+        response = await self._session.request(method, page_url, headers=headers)
+
+        return AsyncFBStreamResponse(self, None, response.status, response.reason, response=response)
+
+
+    async def _connect(self):
+        """Open a new connection to the FritzBox."""
+
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.connect_timeout)
+
+
+    async def _acquire(self):
+        """Take the most recently used idle connection or open a new one."""
+
+        now = time.time()
+
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, ts = self._idle.popleft()
+
+            conn[1].close()
+
+        if self._idle:
+            conn, ts = self._idle.pop()
+
+            return conn, True
+
+        return await self._connect(), False
+
+
+    def _release(self, conn, reusable):
+        """Give a connection back to the pool, it is only kept for reuse if reusable is True."""
+
+        if reusable:
+            self._idle.append((conn, time.time()))
+        else:
+            conn[1].close()
+
+        self._slots.release()
+
+
+    async def _send(self, conn, method, url, headers):
+        """Send the request and read the status line and the header of the response."""
+
+        reader, writer = conn
+
+        request = ['%s %s HTTP/1.1' % (method, url), 'Host: %s' % self.host]
+        request += ['%s: %s' % (key, value) for key, value in headers.items()]
+
+        writer.write(('\r\n'.join(request) + '\r\n\r\n').encode('latin-1'))
+
+        await asyncio.wait_for(writer.drain(), self.read_timeout)
+
+        status_line = await asyncio.wait_for(reader.readline(), self.read_timeout)
+
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+
+        try:
+            version, status, reason = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        except ValueError:
+            raise http.client.BadStatusLine(status_line)
+
+        response_headers = {}
+
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.read_timeout)
+
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+            key, _, value = line.decode('latin-1').partition(':')
+
+            response_headers[key.strip().lower()] = value.strip()
+
+        will_close = response_headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0'
+
+        return int(status), reason, response_headers, will_close
+
+
+class AsyncFBStreamResponse(object):
+    """Response of the FritzBox whose body is read on demand within an event loop.
+
+    The response behaves like fritzbox.FBCore.FBStreamResponse. The connection is given back to
+    its pool once the response is closed, it is kept open for reuse if the body was read
+    completely. If response is given, the body is read from this aiohttp response instead of
+    the connection conn.
+    """
+
+    def __init__(self, pool, conn, status, reason, headers=None, will_close=False, response=None):
+        self.status = status
+        self.reason = reason
+        self.size = 0
+
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+        self._will_close = will_close
+        self._complete = False
+
+        # Chunked bodies are read chunk by chunk, others up to their length or the end of the stream
+        headers = headers if headers is not None else {}
+
+        self._chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+        self._remaining = 0 if self._chunked else None
+
+        if not self._chunked:
+            if 'content-length' in headers:
+                self._remaining = int(headers['content-length'])
+                self._complete = self._remaining == 0
+            elif response is None:
+                self._will_close = True
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    async def read(self):
+        """Read the complete body of the response.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Body of the response as bytes.
+        """
+
+        return b''.join([chunk async for chunk in self.iter_chunks()])
+
+
+    async def iter_chunks(self, chunk_size=fritzbox.FBCore.CHUNK_SIZE):
+        """Read the body of the response in chunks as they are received from the FritzBox.
+
+        Args:
+            chunk_size (int): Max. size of a chunk in bytes
+
+        Returns:
+            Asynchronous generator yielding the chunks of the body as bytes.
+        """
+
+        while True:
+            chunk = await self._read_chunk(chunk_size)
+
+            if not chunk:
+                break
+
+            self.size += len(chunk)
+
+            yield chunk
+
+
+    def close(self):
+        """Close the response and give the connection back to the pool.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        if self._response is not None:
+            self._response.release()
+
+            self._response = None
+        elif self._conn is not None:
+            self._pool._release(self._conn, self._complete and not self._will_close)
+
+            self._conn = None
+
+
+    async def _read_chunk(self, chunk_size):
+        """Read the next part of the body, an empty bytes object once the body was read completely."""
+
+        if self._complete:
+            return b''
+
+        if self._response is not None:
+            chunk = await self._response.content.read(chunk_size)
+
+            self._complete = not chunk
+
+            return chunk
+
+        if self._chunked and self._remaining == 0:
+            size = int((await self._read(self._conn[0].readline())).split(b';')[0], 16)
+
+            if size == 0:
+                # Skip the trailer up to the terminating empty line
+                while (await self._read(self._conn[0].readline())) not in (b'\r\n', b'\n', b''):
+                    pass
+
+                self._complete = True
+
+                return b''
+
+            self._remaining = size
+
+        if self._remaining is None:
+            chunk = await self._read(self._conn[0].read(chunk_size))
+
+            self._complete = not chunk
+
+            return chunk
+
+        chunk = await self._read(self._conn[0].read(min(chunk_size, self._remaining)))
+
+        if not chunk:
+            raise asyncio.IncompleteReadError(b'', self._remaining)
+
+        self._remaining -= len(chunk)
+
+        if self._remaining == 0:
+            if self._chunked:
+                await self._read(self._conn[0].readline())
+            else:
+                self._complete = True
+
+        return chunk
+
+
+    async def _read(self, coro):
+        """Wait for a read from the connection, raises asyncio.TimeoutError after the read timeout of the pool."""
+
+        return await asyncio.wait_for(coro, self._pool.read_timeout)
+
+
+class AsyncFritzBox(object):
+    """Asynchronous interface for communication with a FritzBox.
+
+    This class provides the methods of fritzbox.FBCore.FritzBox as coroutines. The session id is
+    cached in the same way as for the blocking interface. Tasks needing a new session id at the
+    same time wait for a single login and use its result.
+    """
+
+    def __init__(self, ip, password, port=fritzbox.FBCore.HTTP_PORT, pool_size=fritzbox.FBCore.POOL_SIZE,
+                 pool_idle_timeout=fritzbox.FBCore.POOL_IDLE_TIMEOUT, user=None,
+                 connect_timeout=fritzbox.FBCore.CONNECT_TIMEOUT, read_timeout=fritzbox.FBCore.READ_TIMEOUT):
+        self.ip = ip
+        self.user = user
+        self.password = password
+        self.sid = ''
+        self.sid_ts = 0
+
+        self.pool = AsyncFBConnectionPool(ip, port, pool_size, pool_idle_timeout, connect_timeout, read_timeout)
+
+        # Serializes the logins, the generation counts the completed ones
+        self._login_lock = None
+        self._login_generation = 0
+        self._login_result = False
+
+        self._refresh_task = None
+
+
+    async def close(self):
+        """Stop the session refresh and close all connections to the FritzBox.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        self.stop_session_refresh()
+
+        await self.pool.close()
+
+
+    def is_session_valid(self):
+        """Check if the cached session id can be used, see fritzbox.FBCore.FritzBox.is_session_valid()."""
+
+        if self.sid in ('', fritzbox.FBCore.INVALID_SID):
+            return False
+
+        return time.time() - self.sid_ts < fritzbox.FBCore.SESSION_TIMEOUT - fritzbox.FBCore.SESSION_REFRESH_MARGIN
+
+
+    def invalidate_session(self):
+        """Drop the cached session id so that the next request authenticates again."""
+
+        logger.debug("Invalidate the cached session id")
+
+        self.sid = ''
+        self.sid_ts = 0
+
+
+    async def load_fritzbox_page(self, url, param):
+        """Coroutine version of fritzbox.FBCore.FritzBox.load_fritzbox_page()."""
+
+        if not self.is_session_valid() and not await self._renew_session():
+            return None
+
+        sid = self.sid
+
+        response = await self._load_page(url, param, sid)
+
+        if response is not None and response[0] == 403:
+            logger.debug("Session id was rejected by the FritzBox")
+
+            if not await self._renew_session(rejected_sid=sid):
+                return None
+
+            response = await self._load_page(url, param, self.sid)
+
+        if response is None:
+            return None
+
+        status, reason, page = response
+
+        if status != 200:
+            logger.error("Unexpected feedback from FritzBox received: %s %s" % (status, reason))
+
+            return None
+        else:
+            self.sid_ts = time.time()
+
+            return page
+
+
+    async def _load_page(self, url, param, sid):
+        """Coroutine version of fritzbox.FBCore.FritzBox._load_page()."""
+
+        page_url = url + '?sid=' + sid + param
+
+        logger.debug("Load the FritzBox page: " + page_url)
+
+        headers = { "Accept" : "application/xml",
+                    "Content-Type" : "text/plain",
+                    "User-Agent" : fritzbox.FBCore.USER_AGENT}
+
+        try:
+            return await self.pool.request('GET', page_url, headers)
+        except:
+            logger.error("Loading of the FritzBox page failed: %s" %(page_url))
+
+            return None
+
+
+    async def open_fritzbox_page(self, url, param):
+        """Coroutine version of fritzbox.FBCore.FritzBox.open_fritzbox_page().
+
+        Returns:
+            response (AsyncFBStreamResponse): Response with status 200 that has to be closed
+                after reading, None otherwise.
+        """
+
+        if not self.is_session_valid() and not await self._renew_session():
+            return None
+
+        sid = self.sid
+
+        response = await self._open_page(url, param, sid)
+
+        if response is not None and response.status == 403:
+            logger.debug("Session id was rejected by the FritzBox")
+
+            async with response:
+                await response.read()
+
+            if not await self._renew_session(rejected_sid=sid):
+                return None
+
+            response = await self._open_page(url, param, self.sid)
+
+        if response is None:
+            return None
+
+        if response.status != 200:
+            logger.error("Unexpected feedback from FritzBox received: %s %s" % (response.status, response.reason))
+
+            async with response:
+                await response.read()
+
+            return None
+        else:
+            self.sid_ts = time.time()
+
+            return response
+
+
+    async def _open_page(self, url, param, sid):
+        """Open a page from the FritzBox using the given session id, None if the request failed."""
+
+        page_url = url + '?sid=' + sid + param
+
+        logger.debug("Open the FritzBox page: " + page_url)
+
+        headers = { "Accept" : "application/xml",
+                    "Content-Type" : "text/plain",
+                    "User-Agent" : fritzbox.FBCore.USER_AGENT}
+
+        try:
+            return await self.pool.open('GET', page_url, headers)
+        except:
+            logger.error("Opening of the FritzBox page failed: %s" %(page_url))
+
+            return None
+
+
+    async def refresh_session(self):
+        """Coroutine version of fritzbox.FBCore.FritzBox.refresh_session()."""
+
+        sid = self.sid
+
+        if sid in ('', fritzbox.FBCore.INVALID_SID):
+            return await self._renew_session()
+
+        logger.debug("Refresh the session id")
+
+        response = await self._load_login_page('/login_sid.lua?sid=' + sid)
+
+        if response is None:
+            return False
+
+        if response[0] == sid:
+            self.sid_ts = time.time()
+
+            return True
+        else:
+            return await self._renew_session(rejected_sid=sid)
+
+
+    def start_session_refresh(self):
+        """Start a task of the running event loop that refreshes the session id before it expires.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_session_periodically())
+
+
+    def stop_session_refresh(self):
+        """Stop the task started by start_session_refresh().
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+
+            self._refresh_task = None
+
+
+    async def _refresh_session_periodically(self):
+        """Task that keeps the cached session id alive."""
+
+        refresh_period = fritzbox.FBCore.SESSION_TIMEOUT - fritzbox.FBCore.SESSION_REFRESH_MARGIN
+
+        while True:
+            if self.sid in ('', fritzbox.FBCore.INVALID_SID):
+                timeout = refresh_period
+            else:
+                timeout = self.sid_ts + refresh_period - time.time()
+
+            if timeout > 0:
+                await asyncio.sleep(timeout)
+            elif not await self.refresh_session():
+                # Do not repeat a failed refresh immediately
+                await asyncio.sleep(fritzbox.FBCore.SESSION_REFRESH_MARGIN)
+
+
+    async def login(self):
+        """Coroutine version of fritzbox.FBCore.FritzBox.login()."""
+
+        logger.debug("Login to the FritzBox")
+
+        response = await self._load_login_page(fritzbox.FBCore.LOGIN_PAGE)
+
+        if response is None:
+            return False
+
+        sid, challenge = response
+
+        if sid == fritzbox.FBCore.INVALID_SID:
+            page_url = fritzbox.FBCore.login_response_url(challenge, self.password, self.user)
+
+            if page_url is None:
+                return False
+
+            response = await self._load_login_page(page_url)
+
+            if response is None:
+                return False
+
+            sid, challenge = response
+
+            if sid == fritzbox.FBCore.INVALID_SID:
+                logger.error("Authentication failed due to invalid password")
+
+                return False
+
+        logger.debug("Authentication succeeded")
+
+        self.sid = sid
+        self.sid_ts = time.time()
+
+        return True
+
+
+    async def _renew_session(self, rejected_sid=None):
+        """Coroutine version of fritzbox.FBCore.FritzBox._renew_session().
+
+        Tasks waiting while another task logs in return the result of that login. A rejected
+        session id is only dropped if no other task replaced it meanwhile.
+        """
+
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+
+        generation = self._login_generation
+
+        async with self._login_lock:
+            if self._login_generation != generation:
+                logger.debug("Use the result of the login of another task")
+
+                return self._login_result
+
+            if rejected_sid is not None and rejected_sid == self.sid:
+                self.invalidate_session()
+
+            if self.is_session_valid():
+                return True
+
+            self._login_result = await self.login()
+            self._login_generation += 1
+
+            return self._login_result
+
+
+    async def _load_login_page(self, page_url):
+        """Load a login_sid.lua page and return the tuple (sid, challenge), None on errors."""
+
+        headers = { "Accept" : "application/xml",
+                    "Content-Type" : "text/plain",
+                    "User-Agent" : fritzbox.FBCore.USER_AGENT}
+
+        try:
+            status, reason, page = await self.pool.request('GET', page_url, headers)
+        except:
+            logger.error("Loading of the FritzBox page failed: %s" %(page_url))
+
+            return None
+
+        if status != 200:
+            logger.error("Unexpected feedback from FritzBox received: %s %s" % (status, reason))
+
+            return None
+
+        return fritzbox.FBCore.parse_session_info(page)
+
+
+class AsyncFBPresenceSupervisor(fritzbox.FBPresence.FBPresenceSupervisor):
+    """Presence supervision running as task of the event loop.
+
+    The registration of devices works as for fritzbox.FBPresence.FBPresenceSupervisor, but the
+    device list is loaded by a task instead of a thread. start() has to be called from within
+    the event loop.
+    """
+
+    def __init__(self, fbpresence, poll_interval=fritzbox.FBPresence.POLL_INTERVAL, debounce_off=0):
+        super().__init__(fbpresence, poll_interval, debounce_off)
+
+        self._task = None
+
+
+    def start(self):
+        """Start the supervision task unless it is already running.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        if self._task is not None and not self._task.done():
+            return
+
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+
+    async def stop(self):
+        """Stop the supervision task.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        task, self._task = self._task, None
+
+        if task is None or task is asyncio.current_task():
+            return
+
+        task.cancel()
+
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+    async def _run(self):
+        """Task method for the presence supervision"""
+
+        while True:
+            try:
+                changed = await self.poll()
+            except Exception:
+                logger.exception("Presence supervision failed to load the device list")
+
+                changed = False
+
+            if self.fbpresence.state_file is not None:
+                self.fbpresence._save_state_periodically()
+
+            if isinstance(self.poll_interval, fritzbox.FBPresence.FBAdaptivePollInterval):
+                interval = self.poll_interval.update(changed)
+            else:
+                interval = self.poll_interval
+
+            await asyncio.sleep(interval)
+
+
+    async def poll(self):
+        """Coroutine version of fritzbox.FBPresence.FBPresenceSupervisor.poll()."""
+
+        delivered = self.fbpresence.events.delivered
+
+        return self._notify(await self.fbpresence.get_wlan_device_information(), delivered)
+
+
+class AsyncFBPresence(object):
+    """Asynchronous interface for the presence detection.
+
+    This class provides the methods of fritzbox.FBPresence.FBPresence as coroutines. The device
+    records, the presence events and the state file are handled by the FBPresence object
+    presence, the device list is loaded with the AsyncFritzBox object fb. The presence
+    supervision runs as task of the event loop.
+
+    The FBPresence object has no transport of its own. Only the TR-064 backend uses a blocking
+    connection pool, its requests are sent from the default executor of the event loop.
+    """
+
+    def __init__(self, ip, password, poll_interval=fritzbox.FBPresence.POLL_INTERVAL,
+                 device_ttl=fritzbox.FBPresence.DEVICE_TTL, max_devices=fritzbox.FBPresence.MAX_DEVICES,
+                 on_evict=None, state_file=None, max_state_age=fritzbox.FBPresence.STATE_MAX_AGE,
+                 port=fritzbox.FBCore.HTTP_PORT, backend=fritzbox.FBPresence.BACKEND_LUA, user=None,
+                 tr064_port=fritzbox.FBTR064.TR064_PORT):
+        self.presence = fritzbox.FBPresence.FBPresence(ip, password, device_ttl=device_ttl, max_devices=max_devices,
+                                                       on_evict=on_evict, port=port, backend=backend, user=user,
+                                                       tr064_port=tr064_port, transport=False)
+
+        self.fb = AsyncFritzBox(ip, password, port=port, user=user)
+
+        self.events = self.presence.events
+
+        self.supervisor = AsyncFBPresenceSupervisor(self, poll_interval)
+
+        # Saved and restored with the state file
+        self.presence.supervisor = self.supervisor
+        self.presence.state_file = state_file
+
+        if state_file is not None and os.path.exists(state_file):
+            self.presence.load_state(state_file, max_state_age)
+
+
+    @property
+    def device_list(self):
+        """Devices keyed by their names, see fritzbox.FBPresence.FBPresence."""
+
+        return self.presence.device_list
+
+
+    @property
+    def devices_by_mac(self):
+        """Devices keyed by their MAC addresses, see fritzbox.FBPresence.FBPresence."""
+
+        return self.presence.devices_by_mac
+
+
+    @property
+    def devices_by_ip(self):
+        """Devices keyed by their IP addresses, see fritzbox.FBPresence.FBPresence."""
+
+        return self.presence.devices_by_ip
+
+
+    @property
+    def chk_ts(self):
+        """Timestamp of the last presence check."""
+
+        return self.presence.chk_ts
+
+
+    @property
+    def state_file(self):
+        """Path of the state file, None if the state is not saved."""
+
+        return self.presence.state_file
+
+
+    def supervise_device(self, device, callback):
+        """Register a callback for presence changes of a device and start the supervision.
+
+        Has to be called from within the event loop. The callback is called by the supervision
+        task, see fritzbox.FBPresence.FBPresenceSupervisor.register() for its signature.
+
+        Args:
+            device (str): Name of a device registered to the Fritz!Box WLAN
+            callback (function): Reference to a function that shall be called
+                everytime the device state changes.
+
+        Returns:
+            handle (fritzbox.FBPresence.FBSupervisionHandle): Handle to unregister
+                the callback again
+        """
+
+        return self.supervisor.register(device, callback)
+
+
+    def subscribe(self, callback, kinds=None, replay=False):
+        """Register a callback for the presence events of all devices and start the supervision.
+
+        Has to be called from within the event loop, see fritzbox.FBPresence.FBPresence.subscribe().
+        """
+
+        subscription = self.events.subscribe(callback, kinds, replay)
+
+        self.supervisor.start()
+
+        return subscription
+
+
+    def iter_events(self, kinds=None, timeout=None):
+        """Start the supervision and iterate asynchronously over the presence events of all devices.
+
+        Has to be called from within the event loop, see fritzbox.FBPresence.FBPresence.iter_events()
+        for the arguments.
+
+        Returns:
+            Asynchronous generator returning fritzbox.FBPresence.FBPresenceEvent objects.
+        """
+
+        events = asyncio.Queue()
+
+        subscription = self.subscribe(events.put_nowait, kinds)
+
+        return self._iter_queue(events, subscription, timeout)
+
+
+    async def _iter_queue(self, events, subscription, timeout):
+        """Asynchronous generator returning the events collected for a subscription."""
+
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    return
+        finally:
+            subscription.unregister()
+
+
+    async def stop_supervision(self):
+        """Coroutine version of fritzbox.FBPresence.FBPresence.stop_supervision()."""
+
+        await self.supervisor.stop()
+
+        if self.state_file is not None:
+            self.save_state()
+
+
+    def save_state(self, path=None):
+        """Write the device records and the presence states to a file, see fritzbox.FBPresence.FBPresence.save_state()."""
+
+        return self.presence.save_state(path)
+
+
+    def load_state(self, path=None, max_age=fritzbox.FBPresence.STATE_MAX_AGE):
+        """Restore the state saved with save_state(), see fritzbox.FBPresence.FBPresence.load_state()."""
+
+        return self.presence.load_state(path, max_age)
+
+
+    def _save_state_periodically(self):
+        """Save the state if the last save is older than STATE_SAVE_INTERVAL seconds."""
+
+        self.presence._save_state_periodically()
+
+
+    def get_device(self, device_name=None, mac=None, ip=None):
+        """Look up a device record, see fritzbox.FBPresence.FBPresence.get_device()."""
+
+        return self.presence.get_device(device_name, mac, ip)
+
+
+    @property
+    def backend(self):
+        """Backend the device list is loaded with, see fritzbox.FBPresence.FBPresence."""
+
+        return self.presence.backend
+
+
+    async def is_device_present(self, device_name=None, debounce_off=0, mac=None, ip=None):
+        """Coroutine version of fritzbox.FBPresence.FBPresence.is_device_present()."""
+
+        if mac is not None and self.presence.tr064 is not None:
+            logger.debug("Check the host entry of the device with MAC address " + mac)
+
+            mac = fritzbox.FBPresence.normalize_mac(mac)
+
+            host = await asyncio.get_running_loop().run_in_executor(None, self.presence.tr064.get_specific_host_entry,
+                                                                    mac)
+
+            return self.presence._evaluate_host_entry(mac, host, debounce_off)
+
+        result = await self.get_wlan_device_information()
+
+        if result is None:
+            logger.error("Device list not available, the presence is evaluated from the known devices")
+
+            return self._check_device_presence(self.device_list, time.time(), device_name, debounce_off, mac, ip)
+
+        devices, chk_ts = result
+
+        return self._check_device_presence(devices, chk_ts, device_name, debounce_off, mac, ip)
+
+
+    def _check_device_presence(self, devices, chk_ts, device_name, debounce_off, mac=None, ip=None):
+        """Evaluate the presence of a device, see fritzbox.FBPresence.FBPresence._check_device_presence()."""
+
+        return self.presence._check_device_presence(devices, chk_ts, device_name, debounce_off, mac, ip)
+
+
+    async def get_wlan_device_information(self):
+        """Coroutine version of fritzbox.FBPresence.FBPresence.get_wlan_device_information()."""
+
+        logger.debug("Load WLAN device information from the FritzBox for all known devices")
+
+        self.presence.chk_ts = time.time()
+
+        if self.presence.tr064 is not None:
+            hosts = await asyncio.get_running_loop().run_in_executor(None, self.presence.tr064.get_host_list)
+
+            if hosts is None:
+                return None
+
+            return self.presence._update_host_list(hosts)
+
+        page = await self.fb.load_fritzbox_page(fritzbox.FBPresence.WLAN_DEVICE_PAGE,
+                                                fritzbox.FBPresence.WLAN_DEVICE_PARAM)
+
+        if page is None:
+            return None
+
+        return self.presence._update_device_list(page)
+
+
+class AsyncFBHomeAuto(object):
+    """Asynchronous interface for the home automation actors.
+
+    This class provides the methods of fritzbox.FBHomeAuto.FBHomeAuto as coroutines.
+    """
+
+    def __init__(self, ip, password, port=fritzbox.FBCore.HTTP_PORT):
+        self.fb = AsyncFritzBox(ip, password, port=port)
+
+        self._groups = None
+        self._groups_ts = 0
+
+
+    async def get_switch_plugs(self):
+        """Coroutine version of fritzbox.FBHomeAuto.FBHomeAuto.get_switch_plugs()."""
+
+        page = await self.fb.load_fritzbox_page(fritzbox.FBHomeAuto.HOMEAUTO_PAGE, '&switchcmd=getswitchlist')
+
+        if page is None:
+            return None
+
+        return page.decode('UTF-8').strip('\n').split(',')
+
+
+    async def get_device_list_infos(self, fields=None):
+        """Coroutine version of fritzbox.FBHomeAuto.FBHomeAuto.get_device_list_infos()."""
+
+        page = await self.fb.load_fritzbox_page(fritzbox.FBHomeAuto.HOMEAUTO_PAGE, '&switchcmd=getdevicelistinfos')
+
+        if page is None:
+            return None
+
+        return list(fritzbox.FBHomeAuto.iter_device_list([page], fields))
+
+
+    async def iter_device_list_infos(self, fields=None):
+        """Coroutine version of fritzbox.FBHomeAuto.FBHomeAuto.iter_device_list_infos().
+
+        Returns:
+            Asynchronous generator yielding a FBActor record for each actor and group.
+        """
+
+        logger.debug("Stream the information of all actors from the FritzBox")
+
+        response = await self.fb.open_fritzbox_page(fritzbox.FBHomeAuto.HOMEAUTO_PAGE, '&switchcmd=getdevicelistinfos')
+
+        if response is None:
+            return
+
+        parser = fritzbox.FBHomeAuto.FBDeviceListParser(fields)
+
+        async with response:
+            async for chunk in response.iter_chunks():
+                for actor in parser.feed(chunk):
+                    yield actor
+
+        parser.close()
+
+
+    async def get_switch_plug_state(self, switch_plug_ain):
+        """Coroutine version of fritzbox.FBHomeAuto.FBHomeAuto.get_switch_plug_state()."""
+
+        page = await self.fb.load_fritzbox_page(fritzbox.FBHomeAuto.HOMEAUTO_PAGE,
+                                                '&switchcmd=getswitchstate&ain=' + switch_plug_ain)
+
+        if page is None:
+            return None
+
+        return page.decode('UTF-8').strip('\n')
+
+
+    async def set_switch_plug_state(self, switch_plug_ain, state):
+        """Coroutine version of fritzbox.FBHomeAuto.FBHomeAuto.set_switch_plug_state()."""
+
+        if state not in fritzbox.FBHomeAuto.SWITCH_COMMANDS:
+            raise fritzbox.FBHomeAuto.InvalidParameterError()
+
+        page = await self.fb.load_fritzbox_page(fritzbox.FBHomeAuto.HOMEAUTO_PAGE,
+                                                '&switchcmd=' + fritzbox.FBHomeAuto.SWITCH_COMMANDS[state] +
+                                                '&ain=' + switch_plug_ain)
+
+        if page is None:
+            return None
+
+        return page.decode('UTF-8').strip('\n')
+
+
+    async def set_switch_plugs_state(self, switch_plug_ains, state,
+                                     max_workers=fritzbox.FBHomeAuto.SWITCH_WORKERS, use_groups=True):
+        """Coroutine version of fritzbox.FBHomeAuto.FBHomeAuto.set_switch_plugs_state()."""
+
+        if state not in fritzbox.FBHomeAuto.SWITCH_COMMANDS:
+            raise fritzbox.FBHomeAuto.InvalidParameterError()
+
+        switch_plug_ains = list(dict.fromkeys(switch_plug_ains))
+
+        if not switch_plug_ains:
+            return {}
+
+        if use_groups:
+            targets = fritzbox.FBHomeAuto.cover_with_groups(switch_plug_ains, await self.get_switch_groups())
+        else:
+            targets = [(ain, [ain]) for ain in switch_plug_ains]
+
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def set_state(ain):
+            async with semaphore:
+                return await self.set_switch_plug_state(ain, state)
+
+        states = await asyncio.gather(*(set_state(ain) for ain, covered in targets), return_exceptions=True)
+
+        results = {}
+
+        for (ain, covered), switch_plug_state in zip(targets, states):
+            if isinstance(switch_plug_state, Exception):
+                logger.error("Switch command failed: %s" % (switch_plug_state))
+
+                switch_plug_state = None
+
+            for covered_ain in covered:
+                results[covered_ain] = switch_plug_state
+
+        return {ain : results[ain] for ain in switch_plug_ains}
+
+
+    async def get_switch_groups(self):
+        """Coroutine version of fritzbox.FBHomeAuto.FBHomeAuto.get_switch_groups()."""
+
+        if self._groups is None or time.time() - self._groups_ts >= fritzbox.FBHomeAuto.GROUP_CACHE_TTL:
+            actors = await self.get_device_list_infos(fields={'members'})
+
+            if actors is None:
+                return {}
+
+            self._groups = fritzbox.FBHomeAuto.get_group_members(actors)
+            self._groups_ts = time.time()
+
+        return self._groups
+
+
+    async def toggle_switch_plug_state(self, switch_plug_ain):
+        """Coroutine version of fritzbox.FBHomeAuto.FBHomeAuto.toggle_switch_plug_state()."""
+
+        page = await self.fb.load_fritzbox_page(fritzbox.FBHomeAuto.HOMEAUTO_PAGE,
+                                                '&switchcmd=setswitchtoggle&ain=' + switch_plug_ain)
+
+        if page is None:
+            return None
+
+        return page.decode('UTF-8').strip('\n')
+
+
+#===============================================================================
+# Main program
+#===============================================================================
+async def main():
+    """Main function for testing purpose"""
+    fb_p = AsyncFBPresence(ip=args.ip, password=args.password)
+    fb_ha = AsyncFBHomeAuto(ip=args.ip, password=args.password)
+
+    result, switch_plugs = await asyncio.gather(fb_p.get_wlan_device_information(), fb_ha.get_switch_plugs())
+
+    print(result[0] if result is not None else "Loading of the device list failed")
+    print(switch_plugs if switch_plugs is not None else "Loading of the switch plugs failed")
+
+    await fb_p.fb.close()
+    await fb_ha.fb.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -19,13 +19,27 @@ __email__      = fritzbox._info.__email__
 #===============================================================================
 import argparse
 import logging
-import urllib.request
+import http.client
 import hashlib
 import re
 import json
 import time
-
-from xml.dom import minidom
+import random
+import threading
+import collections
+import bisect
+import functools
+import contextlib
+import os
+import stat
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from urllib.parse import quote
 
 import xml.etree.ElementTree as ElementTree
 
@@ -105,6 +119,96 @@ logger = logging.getLogger(__name__)
 #===============================================================================
 USER_AGENT = "Mozilla/5.0 (U; Windows NT 5.1; rv:5.0) Gecko/20100101 Firefox/5.0"
 
+INVALID_SID = "0000000000000000"
+
+# The FritzBox invalidates a session id after 20 minutes without any request
+SESSION_TIMEOUT = 20 * 60
+
+# Time before the session timeout at which a session is refreshed
+SESSION_REFRESH_MARGIN = 60
+
+HTTP_PORT = 80
+
+# Max. no. of keep-alive connections held open to a single FritzBox
+POOL_SIZE = 4
+
+# Idle time in seconds after which a pooled connection is closed
+POOL_IDLE_TIMEOUT = 30
+
+# Time in seconds to wait for a connection to the FritzBox
+CONNECT_TIMEOUT = 5
+
+# Time in seconds to wait for data of a response of the FritzBox
+READ_TIMEOUT = 15
+
+# Max. no. of repetitions of a failed request that does not change the state of the FritzBox
+RETRIES = 2
+
+# Base and max. delay in seconds of the exponential back-off between repeated requests
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 5
+
+# Max. size in bytes of the chunks a streamed page is read in
+CHUNK_SIZE = 8192
+
+# Commands of the home automation interface that change the state of an actor
+WRITE_COMMANDS = ('setswitchon', 'setswitchoff', 'setswitchtoggle', 'sethkrtsoll', 'applytemplate')
+
+# No. of cached pages above which expired entries are removed from the response cache
+CACHE_PRUNE_SIZE = 256
+
+# Consecutive failures after which a circuit breaker opens
+BREAKER_FAILURE_THRESHOLD = 3
+
+# Time in seconds after which an open circuit breaker lets a probe request pass
+BREAKER_RESET_TIMEOUT = 60
+
+BREAKER_CLOSED    = 'closed'
+BREAKER_OPEN      = 'open'
+BREAKER_HALF_OPEN = 'half-open'
+
+# Upper bounds in seconds of the buckets of the request latency histograms
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Phases of a request recorded by FBRequestStats, see FBRequestInfo
+REQUEST_PHASES = ('connect', 'ttfb', 'download', 'parse', 'total')
+
+# Kinds of request hooks, see FritzBox.add_hook()
+HOOK_PRE_REQUEST   = 'pre_request'
+HOOK_POST_RESPONSE = 'post_response'
+HOOK_ERROR         = 'error'
+
+HOOKS = (HOOK_PRE_REQUEST, HOOK_POST_RESPONSE, HOOK_ERROR)
+
+# Login page, FRITZ!OS 7.24 and later offer a PBKDF2 instead of a MD5 challenge on it
+LOGIN_PAGE = '/login_sid.lua?version=2'
+
+# Max. no. of cached PBKDF2 hashes and challenge responses
+LOGIN_CACHE_SIZE = 16
+
+# File name of the session store shared by all processes, see FBSessionStore
+SESSION_STORE_NAME = 'fritzbox-sessions.json'
+
+# Private directory of a user in the temporary directory, used without $XDG_RUNTIME_DIR
+RUNTIME_DIR_NAME = 'fritzbox-%d'
+
+# Min. time in seconds between two updates of the expiry of a shared session id
+SESSION_STORE_TOUCH_INTERVAL = 60
+
+# Exceptions indicating that the FritzBox closed a reused keep-alive connection
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected,
+                           http.client.BadStatusLine,
+                           ConnectionResetError,
+                           ConnectionAbortedError,
+                           BrokenPipeError)
+
+
+#===============================================================================
+# Global variables
+#===============================================================================
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+
 
 #===============================================================================
 # Exceptions
@@ -114,74 +218,378 @@ class InvalidParameterError(Exception):
     pass
 
 
+class FritzBoxUnavailableError(Exception):
+    """Request rejected by the open circuit breaker of a FritzBox"""
+    pass
+
+
+#===============================================================================
+# Method definitions
+#===============================================================================
+def _find_tag(page, tag):
+    """Return the text of the first element with the given tag, None if it is missing."""
+
+    start = page.find(b'<' + tag + b'>')
+
+    if start < 0:
+        return None
+
+    start += len(tag) + 2
+
+    end = page.find(b'</', start)
+
+    if end < 0:
+        return None
+
+    return page[start:end].decode('utf-8')
+
+
+def parse_session_info(page):
+    """Read out the session id and the challenge from a login_sid.lua page.
+
+    The SessionInfo page is small and flat, so the two elements are searched directly instead
+    of parsing the complete XML document.
+
+    Args:
+        page (bytes): SessionInfo XML page returned by the FritzBox
+
+    Returns:
+        Tuple (sid, challenge) as strings, the sid is INVALID_SID if the page contains none.
+    """
+
+    if isinstance(page, str):
+        page = page.encode('utf-8')
+
+    sid = _find_tag(page, b'SID')
+
+    challenge = _find_tag(page, b'Challenge')
+
+    return sid or INVALID_SID, challenge or ''
+
+
+def calculate_challenge_response(challenge, password):
+    """Calculate the response for the challenge-response authentication.
+
+    Challenges starting with "2$" are answered using PBKDF2, all others using MD5.
+
+    Args:
+        challenge (str): Challenge read out from the login_sid.lua page
+        password (str):  Password for accessing the FritzBox
+
+    Returns:
+        Response that has to be passed to the login_sid.lua page.
+
+    Raises:
+        ValueError: The PBKDF2 challenge is malformed
+    """
+
+    if challenge.startswith('2$'):
+        return calculate_pbkdf2_response(challenge, password)
+
+    challenge_bf = (challenge + '-' + password).encode( 'utf-16le' )
+
+    m = hashlib.md5()
+
+    m.update(challenge_bf)
+
+    return challenge + '-' + m.hexdigest().lower()
+
+
+@functools.lru_cache(maxsize=LOGIN_CACHE_SIZE)
+def calculate_pbkdf2_response(challenge, password):
+    """Calculate the response for a PBKDF2 challenge "2$<iter1>$<salt1>$<iter2>$<salt2>".
+
+    The response is cached per challenge. The first hash only depends on the static salt of
+    the FritzBox and is cached separately, so a new challenge only costs the second hash.
+
+    Args:
+        challenge (str): Challenge read out from the login_sid.lua page
+        password (str):  Password for accessing the FritzBox
+
+    Returns:
+        Response "<salt2>$<hash>" that has to be passed to the login_sid.lua page.
+
+    Raises:
+        ValueError: The challenge is malformed
+    """
+
+    version, iter1, salt1, iter2, salt2 = challenge.split('$')
+
+    hash1 = _pbkdf2_static_hash(password, salt1, int(iter1))
+
+    hash2 = hashlib.pbkdf2_hmac('sha256', hash1, bytes.fromhex(salt2), int(iter2))
+
+    return salt2 + '$' + hash2.hex()
+
+
+@functools.lru_cache(maxsize=LOGIN_CACHE_SIZE)
+def _pbkdf2_static_hash(password, salt, iterations):
+    """Return the first PBKDF2 hash of the password, see calculate_pbkdf2_response()."""
+
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), iterations)
+
+
+def login_response_url(challenge, password, user=None):
+    """Return the URL of the login_sid.lua page answering the given challenge.
+
+    Args:
+        challenge (str): Challenge read out from the login_sid.lua page
+        password (str):  Password for accessing the FritzBox
+        user (str):      User name, None if the FritzBox has no user accounts
+
+    Returns:
+        URL of the login_sid.lua page, None if the challenge is malformed.
+    """
+
+    try:
+        response_bf = calculate_challenge_response(challenge, password)
+    except ValueError:
+        logger.error("Unsupported challenge received from FritzBox: %s" % (challenge))
+
+        return None
+
+    page_url = LOGIN_PAGE + '&response=' + response_bf
+
+    if user is not None:
+        page_url += '&username=' + quote(user)
+
+    return page_url
+
+
+def get_runtime_dir():
+    """Return the directory for sockets and files shared by the processes of a user.
+
+    Without $XDG_RUNTIME_DIR a directory only accessible by the user is created in the
+    temporary directory, which is shared with all other users.
+
+    Args:
+        Does not require any arguments.
+
+    Returns:
+        $XDG_RUNTIME_DIR, the private directory in the temporary directory if it is not set.
+
+    Raises:
+        PermissionError: The private directory exists but belongs to another user or is
+            accessible by others.
+    """
+
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+
+    if runtime_dir:
+        return runtime_dir
+
+    if not hasattr(os, 'getuid'):
+        return tempfile.gettempdir()
+
+    runtime_dir = os.path.join(tempfile.gettempdir(), RUNTIME_DIR_NAME % (os.getuid()))
+
+    try:
+        os.mkdir(runtime_dir, 0o700)
+    except FileExistsError:
+        pass
+
+    # Another user may have created the directory or a symbolic link before
+    st = os.lstat(runtime_dir)
+
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError("Runtime directory %s is not private to the user" % (runtime_dir))
+
+    return runtime_dir
+
+
+def get_connection_pool(host, port=HTTP_PORT, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                        connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+    """Return the connection pool shared by all users of the given FritzBox.
+
+    The pool is created with the given parameters on the first request for a host and port
+    combination. Subsequent requests for the same FritzBox return the existing pool, a warning is
+    logged if they ask for other settings than the ones the pool was created with.
+
+    Args:
+        host (str):           IP address or host name of the FritzBox
+        port (int):           HTTP port of the FritzBox
+        size (int):           Max. no. of keep-alive connections to the FritzBox
+        idle_timeout (float): Idle time in seconds after which a connection is closed
+        connect_timeout (float): Time in seconds to wait for a connection to the FritzBox
+        read_timeout (float): Time in seconds to wait for data of a response
+
+    Returns:
+        pool (fritzbox.FBCore.FBConnectionPool): Connection pool for the FritzBox
+    """
+
+    with connection_pools_lock:
+        pool = connection_pools.get((host, port))
+
+        if pool is None:
+            pool = FBConnectionPool(host, port, size, idle_timeout, connect_timeout, read_timeout)
+
+            connection_pools[(host, port)] = pool
+        else:
+            requested = {'size' : size,
+                         'idle_timeout' : idle_timeout,
+                         'connect_timeout' : connect_timeout,
+                         'read_timeout' : read_timeout}
+
+            ignored = ['%s=%s (pool uses %s)' % (name, value, getattr(pool, name))
+                       for name, value in requested.items() if getattr(pool, name) != value]
+
+            if ignored:
+                logger.warning("Connection pool for %s:%d is shared, ignoring the settings: %s"
+                               % (host, port, ', '.join(ignored)))
+
+        return pool
+
+
 #===============================================================================
 # Class definitions
 #===============================================================================
-class FritzBox(object):
-    """Interface for communication with a FritzBox.
+class FBConnectionPool(object):
+    """Bounded pool of keep-alive HTTP connections to a FritzBox.
 
-    This class provides an interface for communication with a FritzBox using LUA pages.
+    The pool hands out at most size connections at the same time. Connections are returned to the
+    pool after the response was read completely and are closed after being idle for idle_timeout
+    seconds. A request on a reused connection that was closed by the FritzBox in the meantime is
+    repeated once on a new connection.
+
+    All requests to the FritzBox pass the circuit breaker of the pool. While the FritzBox does not
+    answer, requests fail immediately instead of blocking a thread until the timeouts expire.
     """
 
-    def __init__(self, ip, password):
-        self.ip = ip
-        self.password = password
-        self.sid = ''
+    def __init__(self, host, port=HTTP_PORT, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = FBCircuitBreaker()
+
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
 
 
     def __del__(self):
-        pass
+        self.close()
 
 
-    def load_fritzbox_page(self, url, param):
-        """Method to read out a page from the FritzBox.
+    def request(self, method, url, headers, timings=None, body=None):
+        """Send a request to the FritzBox using a pooled connection.
+
+        Args:
+            method (str):   HTTP method, e.g. 'GET'
+            url (str):      Path and query of the requested page
+            headers (dict): HTTP headers sent with the request
+            timings (dict): Dictionary updated with the durations of the request phases, see
+                            FBStreamResponse
+            body (bytes):   Body sent with the request, None for no body
+
+        Returns:
+            Tuple (status, reason, page) of the response.
+
+        Raises:
+            FritzBoxUnavailableError: The circuit breaker of the FritzBox is open.
+            OSError, http.client.HTTPException: The request could not be completed.
+        """
+
+        with self.open(method, url, headers, body) as response:
+            page = response.read()
+
+        if timings is not None:
+            timings.update(response.timings)
+
+        return response.status, response.reason, page
 
-        The method reads out the given page from the FritzBox. It automatically includes a session id
-        between url and param.
+
+    def open(self, method, url, headers, body=None):
+        """Send a request to the FritzBox and return the response without reading its body.
+
+        The connection stays assigned to the response until the response is closed. Use the
+        response as context manager to make sure it is closed.
 
         Args:
-            url (str):   URL of the page that shall be read out from the FritzBox.
-            param (str): Additional parameters that shall be added to the URL.
+            method (str):   HTTP method, e.g. 'GET'
+            url (str):      Path and query of the requested page
+            headers (dict): HTTP headers sent with the request
+            body (bytes):   Body sent with the request, None for no body
 
         Returns:
-            Requested page as string, None otherwise.
+            response (fritzbox.FBCore.FBStreamResponse): Response of the FritzBox
+
+        Raises:
+            FritzBoxUnavailableError: The circuit breaker of the FritzBox is open.
+            OSError, http.client.HTTPException: The request could not be completed.
         """
 
-        if self.login():
-            page_url = 'http://' + self.ip + ':80' + url + '?sid=' + self.sid.decode('utf-8') + param
+        if not self.breaker.allow_request():
+            raise FritzBoxUnavailableError("FritzBox %s is not reachable" % (self.host))
+
+        try:
+            response = self._open(method, url, headers, body)
+        except:
+            self.breaker.record_failure()
+
+            raise
+
+        self.breaker.record_success()
+
+        return response
 
-            logger.debug("Load the FritzBox page: " + page_url)
 
-            headers = { "Accept" : "application/xml",
-                        "Content-Type" : "text/plain",
-                        "User-Agent" : USER_AGENT}
+    def _open(self, method, url, headers, body=None):
+        """Send a request using a pooled connection and return the unread response."""
 
-            request = urllib.request.Request(page_url, headers = headers)
+        # Like a connection attempt, waiting for a free connection is limited by connect_timeout
+        if not self._slots.acquire(timeout=self.connect_timeout):
+            raise TimeoutError("No connection to the FritzBox %s available within %s seconds"
+                               % (self.host, self.connect_timeout))
+
+        try:
+            start = time.monotonic()
+
+            conn, reused = self._acquire()
+
+            sent = time.monotonic()
 
             try:
-                response = urllib.request.urlopen(request)
-            except:
-                logger.error("Loading of the FritzBox page failed: %s" %(page_url))
+                response = self._send(conn, method, url, headers, body)
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
 
-                return None
+                if not reused:
+                    raise
 
-            page = response.read()
+                logger.debug("Reconnect to the FritzBox after stale keep-alive connection")
 
-            if response.status != 200:
-                logger.error("Unexpected feedback from FritzBox received: %s %s" % (response.status, response.reason))
+                conn = self._connect()
 
-                return None
-            else:
-                return page
-        else:
-            return None
+                sent = time.monotonic()
 
+                try:
+                    response = self._send(conn, method, url, headers, body)
+                except:
+                    conn.close()
 
-    def login(self):
-        """Authenticate with the FritzBox to access private pages.
+                    raise
+            except:
+                conn.close()
 
-        The method authenticates with a FritzBox using the authentication credentials
-        read out from the configuration file during the class object instantiation.
+                raise
+        except:
+            self._slots.release()
+
+            raise
+
+        received = time.monotonic()
+
+        return FBStreamResponse(self, conn, response, {'connect' : sent - start,
+                                                       'ttfb' : received - sent,
+                                                       'download' : 0.0})
+
+
+    def close(self):
+        """Close all idle connections of the pool.
 
         Args:
             Does not require any arguments.
@@ -190,85 +598,1625 @@ class FritzBox(object):
             Does not return any value.
         """
 
-        logger.debug("Login to the FritzBox")
+        with self._lock:
+            while self._idle:
+                conn, ts = self._idle.pop()
 
-        headers = { "Accept" : "application/xml",
-                    "Content-Type" : "text/plain",
-                    "User-Agent" : USER_AGENT}
+                conn.close()
+
+
+    def _connect(self):
+        """Create a new connection to the FritzBox.
 
-        page_url = 'http://' + self.ip + ':80/login_sid.lua'
+        The connect timeout is only applied while the connection is established, afterwards the
+        socket waits at most read_timeout seconds for data of the FritzBox.
+        """
 
-        request = urllib.request.Request (page_url, headers = headers)
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
 
         try:
-            response = urllib.request.urlopen(request)
+            conn.connect()
+
+            conn.sock.settimeout(self.read_timeout)
         except:
-            logger.error("Loading of the FritzBox page failed: %s" %(page_url))
+            conn.close()
+            raise
 
-            return False
+        return conn
 
-        page = response.read()
 
-        if response.status != 200:
-            logger.error("Unexpected feedback from FritzBox received: %s %s" % (response.status, response.reason))
+    def _send(self, conn, method, url, headers, body=None):
+        """Send the request and read the status and headers of the response."""
 
-            return False
+        conn.request(method, url, body=body, headers=headers)
+
+        return conn.getresponse()
+
+
+    def _acquire(self):
+        """Take the most recently used idle connection or create a new one."""
+
+        now = time.time()
+
+        with self._lock:
+            while self._idle and now - self._idle[0][1] > self.idle_timeout:
+                conn, ts = self._idle.popleft()
+
+                conn.close()
+
+            if self._idle:
+                conn, ts = self._idle.pop()
+
+                return conn, True
+
+        return self._connect(), False
+
+
+    def _release(self, conn, reusable):
+        """Give back the connection slot and keep the connection for reuse if possible."""
+
+        if reusable:
+            with self._lock:
+                self._idle.append((conn, time.time()))
         else:
-            page_xml = minidom.parseString(page)
+            conn.close()
 
-            sid_info = page_xml.getElementsByTagName('SID')
+        self._slots.release()
 
-            sid = sid_info[0].firstChild.data
 
-            if sid == "0000000000000000":
-                challenge_info = page_xml.getElementsByTagName('Challenge')
+class FBStreamResponse(object):
+    """Response of the FritzBox whose body is read on demand.
 
-                challenge = challenge_info[0].firstChild.data
+    The connection is given back to its pool once the response is closed. It is kept open
+    for reuse if the body was read completely. The function on_close(response) is called
+    after the response was closed.
 
-                challenge_bf = (challenge + '-' + self.password).encode( 'utf-16le' )
+    The dictionary timings holds the durations in seconds of the phases of the request:
+        connect:  Time to get a connection, close to zero for a reused connection
+        ttfb:     Time from sending the request until the response header was received
+        download: Time spent reading the body
+    size is the no. of body bytes read so far.
+    """
 
-                m = hashlib.md5()
+    def __init__(self, pool, conn, response, timings=None):
+        self.status = response.status
+        self.reason = response.reason
+        self.timings = timings if timings is not None else {'connect' : 0.0, 'ttfb' : 0.0, 'download' : 0.0}
+        self.size = 0
+        self.on_close = None
 
-                m.update(challenge_bf)
+        self.opened_ts = time.monotonic()
 
-                response_bf = challenge + '-' + m.hexdigest().lower()
+        self._pool = pool
+        self._conn = conn
+        self._response = response
 
-            else:
-                logger.debug("Authentication succeeded")
 
-                self.sid = sid
+    def __enter__(self):
+        return self
 
-                return True
 
-        headers = { "Accept" : "text/html,application/xhtml+xml,application/xml",
-                    "Content-Type" : "application/x-www-form-urlencoded",
-                    "User-Agent" : USER_AGENT}
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-        page_url = 'http://' + self.ip + ':80/login_sid.lua?&response=' + response_bf
 
-        request = urllib.request.Request(page_url, headers = headers)
+    def getheader(self, name, default=None):
+        """Return the value of a header of the response.
 
-        response = urllib.request.urlopen(request)
+        Args:
+            name (str):    Name of the header, e.g. 'WWW-Authenticate'
+            default (str): Value returned if the header is missing
 
-        page = response.read()
+        Returns:
+            Value of the header.
+        """
 
-        if response.status != 200:
-            logger.error("Unexpected feedback from FritzBox received: %s %s" % (response.status, response.reason))
+        return self._response.getheader(name, default)
 
-            return False
-        else:
-            sid = re.search(b'<SID>(.*?)</SID>', page).group(1)
 
-            if sid == "0000000000000000":
-                logger.error("Authentication failed due to invalid password")
+    def read(self):
+        """Read the complete body of the response.
 
-                return False
-            else:
-                logger.debug("Authentication succeeded")
+        Args:
+            Does not require any arguments.
 
-                self.sid = sid
+        Returns:
+            Body of the response as bytes.
+        """
 
-                return True
+        start = time.monotonic()
+
+        page = self._response.read()
+
+        self.timings['download'] += time.monotonic() - start
+        self.size += len(page)
+
+        return page
+
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """Read the body of the response in chunks as they are received from the FritzBox.
+
+        Args:
+            chunk_size (int): Max. size of a chunk in bytes
+
+        Returns:
+            Generator yielding the chunks of the body as bytes.
+        """
+
+        while True:
+            start = time.monotonic()
+
+            chunk = self._response.read1(chunk_size)
+
+            if not chunk:
+                # Mark the response as completely read so the connection can be reused
+                self._response.read()
+
+            self.timings['download'] += time.monotonic() - start
+            self.size += len(chunk)
+
+            if not chunk:
+                break
+
+            yield chunk
+
+
+    def close(self):
+        """Close the response and give the connection back to the pool.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        if self._conn is None:
+            return
+
+        reusable = self._response.isclosed() and not self._response.will_close
+
+        self._pool._release(self._conn, reusable)
+
+        self._conn = None
+
+        if self.on_close is not None:
+            self.on_close(self)
+
+
+class FBCircuitBreaker(object):
+    """Circuit breaker to fail fast while a FritzBox is not reachable.
+
+    The breaker opens after failure_threshold consecutive failures. While it is open all
+    requests are rejected. After reset_timeout seconds a single probe request is let through
+    (half-open state). Its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened_ts = 0
+
+        self._lock = threading.Lock()
+
+
+    def allow_request(self):
+        """Check if a request may be sent.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            True if the request may be sent, False if it shall fail immediately.
+        """
+
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+
+            if self.state == BREAKER_OPEN and time.time() - self.opened_ts >= self.reset_timeout:
+                logger.debug("Circuit breaker lets a probe request pass")
+
+                self.state = BREAKER_HALF_OPEN
+
+                return True
+
+            return False
+
+
+    def record_success(self):
+        """Report a successful request, closes the breaker.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        with self._lock:
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+
+
+    def record_failure(self):
+        """Report a failed request, opens the breaker if the threshold is reached.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        with self._lock:
+            self.failures += 1
+
+            if self.state == BREAKER_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != BREAKER_OPEN:
+                    logger.error("Circuit breaker opened after %d failures" % (self.failures))
+
+                self.state = BREAKER_OPEN
+                self.opened_ts = time.time()
+
+
+class FBLatencyHistogram(object):
+    """Histogram of request latencies with fixed bucket bounds.
+
+    counts holds the no. of observations per bucket, the last entry counts the observations
+    above the largest bound.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+
+    def observe(self, value):
+        """Add an observation to the histogram.
+
+        Args:
+            value (float): Observed latency in seconds
+
+        Returns:
+            Does not return any value.
+        """
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def merge(self, other):
+        """Add the observations of another histogram with the same bucket bounds.
+
+        Args:
+            other (fritzbox.FBCore.FBLatencyHistogram): Histogram that is added
+
+        Returns:
+            Does not return any value.
+        """
+
+        if other.buckets != self.buckets:
+            raise InvalidParameterError()
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+
+    def copy(self):
+        """Return an independent copy of the histogram."""
+
+        histogram = FBLatencyHistogram(self.buckets)
+        histogram.merge(self)
+
+        return histogram
+
+
+class FBRequestInfo(object):
+    """Information about a single HTTP exchange with a FritzBox passed to the request hooks.
+
+    Durations are given in seconds and are None for phases the exchange did not reach.
+
+    Attributes:
+        box (str):         IP address of the FritzBox
+        url (str):         URL of the requested page without query, e.g. '/data.lua'
+        attempt (int):     No. of the attempt, 0 for the first one
+        relogin (bool):    True if a login was necessary before the request
+        status (int):      HTTP status of the response
+        size (int):        Size of the response body in bytes
+        connect (float):   Time to get a connection, close to zero for a reused connection
+        ttfb (float):      Time from sending the request until the response header was received
+        download (float):  Time spent reading the response body
+        parse (float):     Time spent processing the response body, None if not measured
+        error (Exception): Error that terminated the exchange
+        ts (float):        Timestamp of the start of the exchange
+    """
+
+    __slots__ = ('box', 'url', 'attempt', 'relogin', 'status', 'size', 'connect', 'ttfb', 'download',
+                 'parse', 'error', 'ts')
+
+    def __init__(self, box, url, attempt=0, relogin=False):
+        self.box = box
+        self.url = url
+        self.attempt = attempt
+        self.relogin = relogin
+        self.status = None
+        self.size = 0
+        self.connect = None
+        self.ttfb = None
+        self.download = None
+        self.parse = None
+        self.error = None
+        self.ts = time.time()
+
+
+    @property
+    def total(self):
+        """Sum of the durations of all measured phases."""
+
+        return sum(value for value in (self.connect, self.ttfb, self.download, self.parse) if value is not None)
+
+
+    def __repr__(self):
+        return "FBRequestInfo(%s)" % ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__)
+
+
+class FBRequestStats(object):
+    """In-memory collector of request statistics fed by the request hooks of a FritzBox.
+
+    Each FritzBox object attaches its own collector, available as attribute stats. The
+    following counters are maintained:
+        requests:          HTTP exchanges completed with any status
+        response_bytes:    Size of the received response bodies
+        errors:            HTTP exchanges that failed, e.g. due to a timeout
+        rejected:          Requests rejected by the open circuit breaker
+        retries:           Repetitions of failed requests
+        logins:            Successful logins
+        login_failures:    Failed logins
+        sessions_rejected: Requests rejected by the FritzBox due to an expired session id
+
+    The durations of the phases in REQUEST_PHASES are recorded per URL in histograms.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters = collections.Counter()
+        self.latencies = {}
+
+        self._lock = threading.Lock()
+
+
+    def attach(self, fb):
+        """Collect the statistics of the requests of a FritzBox.
+
+        Args:
+            fb (fritzbox.FBCore.FritzBox): FritzBox object
+
+        Returns:
+            Does not return any value.
+        """
+
+        fb.add_hook(HOOK_POST_RESPONSE, self.on_response)
+        fb.add_hook(HOOK_ERROR, self.on_error)
+
+
+    def detach(self, fb):
+        """Stop collecting the statistics of the requests of a FritzBox.
+
+        Args:
+            fb (fritzbox.FBCore.FritzBox): FritzBox object
+
+        Returns:
+            Does not return any value.
+        """
+
+        fb.remove_hook(HOOK_POST_RESPONSE, self.on_response)
+        fb.remove_hook(HOOK_ERROR, self.on_error)
+
+
+    def on_response(self, info):
+        """Post-response hook recording a completed exchange."""
+
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['response_bytes'] += info.size
+
+            for phase in REQUEST_PHASES:
+                value = getattr(info, phase)
+
+                if value is not None:
+                    self._observe(info.url, phase, value)
+
+
+    def on_error(self, info):
+        """Error hook recording a failed exchange."""
+
+        if isinstance(info.error, FritzBoxUnavailableError):
+            self.count('rejected')
+        else:
+            self.count('errors')
+
+
+    def count(self, name, value=1):
+        """Increment a counter.
+
+        Args:
+            name (str):  Name of the counter
+            value (int): Increment
+
+        Returns:
+            Does not return any value.
+        """
+
+        with self._lock:
+            self.counters[name] += value
+
+
+    def observe(self, url, phase, latency):
+        """Record the duration of a request phase.
+
+        Args:
+            url (str):       URL of the requested page without query
+            phase (str):     Phase of the request, see REQUEST_PHASES
+            latency (float): Duration of the phase in seconds
+
+        Returns:
+            Does not return any value.
+        """
+
+        with self._lock:
+            self._observe(url, phase, latency)
+
+
+    def _observe(self, url, phase, latency):
+        """Record the duration of a request phase while holding the lock."""
+
+        histogram = self.latencies.get((url, phase))
+
+        if histogram is None:
+            histogram = self.latencies[(url, phase)] = FBLatencyHistogram(self.buckets)
+
+        histogram.observe(latency)
+
+
+    def snapshot(self):
+        """Return a consistent copy of all counters and histograms.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Tuple (counters, latencies) with a dictionary of all counters and a dictionary of the
+            latency histograms keyed by tuples (url, phase).
+        """
+
+        with self._lock:
+            return (dict(self.counters),
+                    {key : histogram.copy() for key, histogram in self.latencies.items()})
+
+
+class FBResponseCache(object):
+    """Cache for pages loaded from the FritzBox with a time to live per URL.
+
+    Only URLs with a configured time to live are cached. Concurrent requests for a page that
+    is not cached are coalesced into a single request whose result is shared by all callers.
+    A time to live of 0 only coalesces concurrent requests without caching the result.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = dict(ttl) if ttl is not None else {}
+        self.stats = collections.Counter()
+
+        self._entries = {}
+        self._flights = {}
+        self._generations = collections.Counter()
+        self._lock = threading.Lock()
+
+
+    def load(self, url, param, loader):
+        """Return the cached page or load it using the given function.
+
+        Args:
+            url (str):           URL of the page
+            param (str):         Additional parameters of the URL
+            loader (function):   Function loader(url, param) returning the page, None on errors
+
+        Returns:
+            Requested page as returned by the loader.
+        """
+
+        ttl = self.ttl.get(url)
+
+        if ttl is None:
+            return loader(url, param)
+
+        key = (url, param)
+        leader = False
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and time.time() - entry[0] < ttl:
+                self.stats['hits'] += 1
+
+                return entry[1]
+
+            flight = self._flights.get(key)
+
+            if flight is not None:
+                self.stats['coalesced'] += 1
+            else:
+                self.stats['misses'] += 1
+
+                flight = self._flights[key] = {'done' : threading.Event(), 'page' : None}
+
+                generation = self._generations[url]
+
+                leader = True
+
+        if not leader:
+            flight['done'].wait()
+
+            return flight['page']
+
+        page = None
+
+        try:
+            page = loader(url, param)
+        finally:
+            with self._lock:
+                if page is not None and ttl > 0 and generation == self._generations[url]:
+                    self._entries[key] = (time.time(), page)
+
+                    if len(self._entries) > CACHE_PRUNE_SIZE:
+                        self._prune()
+
+                del self._flights[key]
+
+            flight['page'] = page
+            flight['done'].set()
+
+        return page
+
+
+    def invalidate(self, url):
+        """Remove all cached pages of the given URL.
+
+        Args:
+            url (str): URL of the pages
+
+        Returns:
+            Does not return any value.
+        """
+
+        with self._lock:
+            self._generations[url] += 1
+
+            for key in [key for key in self._entries if key[0] == url]:
+                del self._entries[key]
+
+
+    def _prune(self):
+        """Remove expired entries, the lock has to be held by the caller."""
+
+        now = time.time()
+
+        for key, (ts, page) in list(self._entries.items()):
+            if now - ts >= self.ttl.get(key[0], 0):
+                del self._entries[key]
+
+
+class FBSessionStore(object):
+    """Session ids shared by all processes of a user talking to the same FritzBoxes.
+
+    The store is a JSON file holding the session id and its expiry per FritzBox and user. It is
+    protected by fcntl locks, so all processes see consistent content. Logins are serialized by
+    lock(), so only one process re-authenticates when a session expired and the others reuse
+    its session id. Without fcntl the locks only serialize the threads of one process.
+
+    The file is only readable by its owner. Every process with access to it uses the stored
+    sessions without knowing the password.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else os.path.join(get_runtime_dir(), SESSION_STORE_NAME)
+
+        self._data_lock = threading.Lock()
+        self._login_lock = threading.Lock()
+
+
+    def _open_locked(self, path, exclusive):
+        """Open a file and lock it, the lock is released when the file is closed.
+
+        Files of other users or accessible by others are refused with a PermissionError, their
+        sessions could have been planted or read by someone else.
+        """
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+
+        if hasattr(os, 'getuid'):
+            st = os.fstat(fd)
+
+            if st.st_uid != os.getuid() or st.st_mode & 0o077:
+                os.close(fd)
+
+                raise PermissionError("Session store %s is not private to the user" % (path))
+
+        f = open(fd, 'r+')
+
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+        return f
+
+
+    def _read(self, f):
+        """Return the sessions of the locked file, empty if it is empty or corrupted."""
+
+        f.seek(0)
+
+        try:
+            return json.loads(f.read() or '{}')
+        except ValueError:
+            return {}
+
+
+    def _modify(self, modify):
+        """Apply modify(sessions) to the content of the file and drop expired sessions."""
+
+        try:
+            with self._data_lock, self._open_locked(self.path, exclusive=True) as f:
+                now = time.time()
+
+                sessions = {k : v for k, v in self._read(f).items() if v.get('expires', 0) > now}
+
+                modify(sessions)
+
+                f.seek(0)
+                f.truncate()
+                json.dump(sessions, f)
+        except OSError as e:
+            logger.error("Writing of the session store failed: %s" % (e))
+
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Context manager serializing the logins of all processes.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Context manager holding the lock.
+        """
+
+        with self._login_lock:
+            try:
+                f = self._open_locked(self.path + '.lock', exclusive=True)
+            except OSError as e:
+                logger.error("Locking of the session store failed: %s" % (e))
+
+                f = None
+
+            try:
+                yield
+            finally:
+                if f is not None:
+                    f.close()
+
+
+    def get(self, key):
+        """Return the stored session id for a FritzBox and user.
+
+        Args:
+            key (str): FritzBox and user, see FritzBox.session_key
+
+        Returns:
+            Tuple (sid, sid_ts) with the session id and the time it was used, None if no session
+            id is stored or it is about to expire.
+        """
+
+        try:
+            with self._data_lock, self._open_locked(self.path, exclusive=False) as f:
+                session = self._read(f).get(key)
+        except OSError as e:
+            logger.error("Reading of the session store failed: %s" % (e))
+
+            return None
+
+        if session is None or session['expires'] - SESSION_REFRESH_MARGIN <= time.time():
+            return None
+
+        return session['sid'], session['expires'] - SESSION_TIMEOUT
+
+
+    def put(self, key, sid, sid_ts):
+        """Store the session id for a FritzBox and user.
+
+        Args:
+            key (str):      FritzBox and user, see FritzBox.session_key
+            sid (str):      Session id
+            sid_ts (float): Time the session id was used
+
+        Returns:
+            Does not return any value.
+        """
+
+        def modify(sessions):
+            sessions[key] = {'sid' : sid, 'expires' : sid_ts + SESSION_TIMEOUT}
+
+        self._modify(modify)
+
+
+    def remove(self, key, sid):
+        """Remove the session id for a FritzBox and user if it was not replaced meanwhile.
+
+        Args:
+            key (str): FritzBox and user, see FritzBox.session_key
+            sid (str): Session id that became invalid
+
+        Returns:
+            Does not return any value.
+        """
+
+        def modify(sessions):
+            if sessions.get(key, {}).get('sid') == sid:
+                del sessions[key]
+
+        self._modify(modify)
+
+
+class FritzBox(object):
+    """Interface for communication with a FritzBox.
+
+    This class provides an interface for communication with a FritzBox using LUA pages.
+
+    The login answers the PBKDF2 challenge of current FRITZ!OS versions and falls back to the
+    MD5 challenge of older ones. A user is only required if the FritzBox has user accounts.
+
+    With a FBSessionStore all FritzBox objects of the same FritzBox and user share one session
+    id, also across processes. login() then reuses a stored session id before authenticating.
+
+    A FritzBox object can be shared by threads. Requests run in parallel, only the renewal of
+    the session id is serialized: threads needing a new session id at the same time wait for
+    a single login and use its result.
+    """
+
+    def __init__(self, ip, password, session_refresh=False, port=HTTP_PORT, pool_size=POOL_SIZE,
+                 pool_idle_timeout=POOL_IDLE_TIMEOUT, cache_ttl=None, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, retries=RETRIES, user=None, session_store=None):
+        self.ip = ip
+        self.user = user
+        self.password = password
+        self.sid = ''
+        self.sid_ts = 0
+
+        self.session_store = session_store
+        self.session_key = '%s:%d/%s' % (ip, port, user or '')
+        self._shared_ts = 0
+
+        # Serializes the logins, the generation counts the completed ones
+        self._session_lock = threading.RLock()
+        self._login_generation = 0
+        self._login_result = False
+        self.retries = retries
+
+        self.pool = get_connection_pool(ip, port, pool_size, pool_idle_timeout, connect_timeout, read_timeout)
+        self.cache = FBResponseCache(cache_ttl)
+
+        self._hooks = {kind : [] for kind in HOOKS}
+        self._local = threading.local()
+
+        self.stats = FBRequestStats()
+        self.stats.attach(self)
+
+        self._refresh_stop = threading.Event()
+        self._refresh_thread = None
+
+        if session_refresh:
+            self.start_session_refresh()
+
+
+    def __del__(self):
+        self.stop_session_refresh()
+
+
+    def is_session_valid(self):
+        """Check if the cached session id can be used for the next request.
+
+        The session id is considered valid until shortly before the idle timeout of the FritzBox
+        expires. The FritzBox restarts the idle timeout with every request using the session id.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            True if the cached session id can be reused, False otherwise.
+        """
+
+        if self.sid in ('', INVALID_SID):
+            return False
+
+        return time.time() - self.sid_ts < SESSION_TIMEOUT - SESSION_REFRESH_MARGIN
+
+
+    def invalidate_session(self):
+        """Drop the cached session id so that the next request authenticates again.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        logger.debug("Invalidate the cached session id")
+
+        if self.session_store is not None and self.sid not in ('', INVALID_SID):
+            self.session_store.remove(self.session_key, self.sid)
+
+        self.sid = ''
+        self.sid_ts = 0
+
+
+    def set_cache_ttl(self, url, ttl):
+        """Configure the time to live of cached pages loaded from the given URL.
+
+        Pages are only cached for URLs with a configured time to live. Concurrent requests for
+        the same page are coalesced into a single request to the FritzBox. Commands changing the
+        state of an actor bypass the cache and remove all cached pages of their URL.
+
+        Args:
+            url (str):   URL of the page, e.g. '/data.lua'
+            ttl (float): Time to live in seconds, 0 to only coalesce concurrent requests, None
+                         to disable the cache for the URL
+
+        Returns:
+            Does not return any value.
+        """
+
+        if ttl is None:
+            self.cache.ttl.pop(url, None)
+
+            self.cache.invalidate(url)
+        else:
+            self.cache.ttl[url] = ttl
+
+
+    def add_hook(self, kind, callback):
+        """Register a function that is called for every HTTP exchange with the FritzBox.
+
+        The callback function needs to implement the following signature:
+            callback(info):
+                info (fritzbox.FBCore.FBRequestInfo): Information about the exchange
+
+        Hooks of the kind HOOK_PRE_REQUEST are called before a request is sent, HOOK_POST_RESPONSE
+        after its response was processed and HOOK_ERROR after the request failed. Hooks are
+        called by the thread sending the request and should return quickly.
+
+        Args:
+            kind (str):          Kind of the hook, see HOOKS
+            callback (function): Reference to the function that shall be called
+
+        Returns:
+            Does not return any value.
+        """
+
+        if kind not in self._hooks:
+            raise InvalidParameterError()
+
+        self._hooks[kind].append(callback)
+
+
+    def remove_hook(self, kind, callback):
+        """Remove a function registered with add_hook().
+
+        Args:
+            kind (str):          Kind of the hook, see HOOKS
+            callback (function): Reference to the registered function
+
+        Returns:
+            Does not return any value.
+        """
+
+        if callback in self._hooks.get(kind, []):
+            self._hooks[kind].remove(callback)
+
+
+    def _call_hooks(self, kind, info):
+        """Call all hooks of the given kind, errors of the hooks are logged only."""
+
+        for callback in list(self._hooks[kind]):
+            try:
+                callback(info)
+            except Exception:
+                logger.exception("Request hook " + kind + " failed")
+
+
+    def _complete_request(self, info):
+        """Call the post-response hooks unless the current page load defers them until parsing."""
+
+        deferred = getattr(self._local, 'deferred', None)
+
+        if deferred is not None:
+            deferred.append(info)
+        else:
+            self._call_hooks(HOOK_POST_RESPONSE, info)
+
+
+    def load_fritzbox_page(self, url, param, parse=None):
+        """Method to read out a page from the FritzBox.
+
+        The method reads out the given page from the FritzBox. It automatically includes a session id
+        between url and param. The session id is cached and only renewed if it expired or the FritzBox
+        rejected it. Pages of URLs configured with set_cache_ttl() are served from the cache.
+
+        If a parse function is given, the page is passed to it and its result is returned. The time
+        spent in the function is reported to the request hooks as parse duration of the exchange.
+
+        Args:
+            url (str):           URL of the page that shall be read out from the FritzBox.
+            param (str):         Additional parameters that shall be added to the URL.
+            parse (function):    Function parse(page) that processes the page
+
+        Returns:
+            Requested page as string or the result of parse, None otherwise.
+        """
+
+        if parse is None:
+            return self._load_cached_page(url, param)
+
+        self._local.deferred = deferred = []
+
+        try:
+            page = self._load_cached_page(url, param)
+        finally:
+            self._local.deferred = None
+
+        start = time.monotonic()
+
+        try:
+            return parse(page) if page is not None else None
+        finally:
+            if deferred:
+                deferred[-1].parse = time.monotonic() - start
+
+            for info in deferred:
+                self._call_hooks(HOOK_POST_RESPONSE, info)
+
+
+    def _load_cached_page(self, url, param):
+        """Load a page from the FritzBox or the cache, see load_fritzbox_page()."""
+
+        match = re.search('switchcmd=([^&]*)', param)
+
+        if match is not None and match.group(1) in WRITE_COMMANDS:
+            page = self._load_fritzbox_page(url, param, idempotent=False)
+
+            # Drop pages cached or loaded while the command was sent
+            self.cache.invalidate(url)
+
+            return page
+
+        return self.cache.load(url, param, self._load_fritzbox_page)
+
+
+    def _load_fritzbox_page(self, url, param, idempotent=True):
+        """Load a page from the FritzBox bypassing the cache.
+
+        Args:
+            url (str):         URL of the page that shall be read out from the FritzBox.
+            param (str):       Additional parameters that shall be added to the URL.
+            idempotent (bool): False if the request changes the state of the FritzBox and must
+                               not be repeated after a failure
+
+        Returns:
+            Requested page as string, None otherwise.
+        """
+
+        relogin = False
+
+        if not self.is_session_valid():
+            if not self._renew_session():
+                return None
+
+            relogin = True
+
+        sid = self.sid
+
+        response = self._load_page(url, param, sid, idempotent, relogin)
+
+        if response is not None and response[0] == 403:
+            logger.debug("Session id was rejected by the FritzBox")
+
+            self.stats.count('sessions_rejected')
+
+            if not self._renew_session(rejected_sid=sid):
+                return None
+
+            response = self._load_page(url, param, self.sid, idempotent, relogin=True)
+
+        if response is None:
+            return None
+
+        status, reason, page = response
+
+        if status != 200:
+            logger.error("Unexpected feedback from FritzBox received: %s %s" % (status, reason))
+
+            return None
+        else:
+            self._session_used()
+
+            return page
+
+
+    def open_fritzbox_page(self, url, param):
+        """Method to open a page from the FritzBox for reading its content on demand.
+
+        The method works like load_fritzbox_page() but returns the response before its content
+        is read. This allows to process large pages while they are received.
+
+        Args:
+            url (str):   URL of the page that shall be read out from the FritzBox.
+            param (str): Additional parameters that shall be added to the URL.
+
+        Returns:
+            response (fritzbox.FBCore.FBStreamResponse): Response with status 200 that has to be
+                closed after reading, None otherwise.
+        """
+
+        relogin = False
+
+        if not self.is_session_valid():
+            if not self._renew_session():
+                return None
+
+            relogin = True
+
+        sid = self.sid
+
+        response = self._open_page(url, param, sid, relogin)
+
+        if response is not None and response.status == 403:
+            logger.debug("Session id was rejected by the FritzBox")
+
+            self.stats.count('sessions_rejected')
+
+            with response:
+                response.read()
+
+            if not self._renew_session(rejected_sid=sid):
+                return None
+
+            response = self._open_page(url, param, self.sid, relogin=True)
+
+        if response is None:
+            return None
+
+        if response.status != 200:
+            logger.error("Unexpected feedback from FritzBox received: %s %s" % (response.status, response.reason))
+
+            with response:
+                response.read()
+
+            return None
+        else:
+            self._session_used()
+
+            return response
+
+
+    def open_url(self, url, headers, method='GET', body=None, pool=None, idempotent=True):
+        """Send a request without session id to the FritzBox and return the unread response.
+
+        The request is sent like the pages of the FritzBox: on a keep-alive connection of a pool,
+        limited by its timeouts and circuit breaker, repeated after failures and reported to the
+        request hooks. This allows other interfaces of the FritzBox with their own port and
+        authentication, e.g. TR-064, to share the transport.
+
+        Args:
+            url (str):         Path and query of the requested URL
+            headers (dict):    HTTP headers sent with the request
+            method (str):      HTTP method, e.g. 'POST'
+            body (bytes):      Body sent with the request, None for no body
+            pool (fritzbox.FBCore.FBConnectionPool): Pool of the port of the interface, see
+                               get_connection_pool(), the pool of the FritzBox object if None
+            idempotent (bool): False if the request must not be repeated after a failure
+
+        Returns:
+            response (fritzbox.FBCore.FBStreamResponse): Response of the FritzBox with any status,
+                it has to be closed after reading.
+
+        Raises:
+            FritzBoxUnavailableError: The circuit breaker of the FritzBox is open.
+            OSError, http.client.HTTPException: The request failed on every attempt.
+        """
+
+        logger.debug("Open the URL of the FritzBox: " + url)
+
+        return self._request(url, headers, idempotent, stream=True, method=method, body=body, pool=pool)
+
+
+    def _open_page(self, url, param, sid, relogin=False):
+        """Open a page from the FritzBox using the given session id.
+
+        Args:
+            url (str):      URL of the page that shall be read out from the FritzBox.
+            param (str):    Additional parameters that shall be added to the URL.
+            sid (str):      Session id
+            relogin (bool): True if a login was necessary before the request
+
+        Returns:
+            response (fritzbox.FBCore.FBStreamResponse): Response of the FritzBox, None if the
+                page could not be opened.
+        """
+
+        page_url = url + '?sid=' + sid + param
+
+        logger.debug("Open the FritzBox page: " + page_url)
+
+        headers = { "Accept" : "application/xml",
+                    "Content-Type" : "text/plain",
+                    "User-Agent" : USER_AGENT}
+
+        try:
+            return self._request(page_url, headers, stream=True, relogin=relogin)
+        except FritzBoxUnavailableError as e:
+            logger.error("Loading of the FritzBox page skipped: %s" %(e))
+
+            return None
+        except:
+            logger.error("Loading of the FritzBox page failed: %s" %(page_url))
+
+            return None
+
+
+    def _load_page(self, url, param, sid, idempotent=True, relogin=False):
+        """Load a page from the FritzBox using the given session id.
+
+        Args:
+            url (str):         URL of the page that shall be read out from the FritzBox.
+            param (str):       Additional parameters that shall be added to the URL.
+            sid (str):         Session id
+            idempotent (bool): False if the request must not be repeated after a failure
+            relogin (bool):    True if a login was necessary before the request
+
+        Returns:
+            Tuple (status, reason, page) of the response, None if the page could not be loaded.
+        """
+
+        page_url = url + '?sid=' + sid + param
+
+        logger.debug("Load the FritzBox page: " + page_url)
+
+        headers = { "Accept" : "application/xml",
+                    "Content-Type" : "text/plain",
+                    "User-Agent" : USER_AGENT}
+
+        try:
+            return self._request(page_url, headers, idempotent, relogin=relogin)
+        except FritzBoxUnavailableError as e:
+            logger.error("Loading of the FritzBox page skipped: %s" %(e))
+
+            return None
+        except:
+            logger.error("Loading of the FritzBox page failed: %s" %(page_url))
+
+            return None
+
+
+    def _request(self, page_url, headers, idempotent=True, stream=False, relogin=False, method='GET', body=None,
+                 pool=None):
+        """Send a request to the FritzBox and repeat it after failures.
+
+        Idempotent requests are repeated up to retries times with an exponential back-off. The
+        delay before each repetition is chosen randomly up to the back-off, which keeps clients
+        polling the same FritzBox from retrying in lockstep. Requests rejected by the open circuit
+        breaker are not repeated.
+
+        Every attempt is reported to the request hooks. For streamed responses the post-response
+        hooks are called when the response is closed, the time between receiving the header and
+        closing the response that was not spent reading is reported as parse duration.
+
+        Args:
+            page_url (str):    Path and query of the requested page
+            headers (dict):    HTTP headers sent with the request
+            idempotent (bool): False if the request must not be repeated after a failure
+            stream (bool):     True to return the response before its content is read
+            relogin (bool):    True if a login was necessary before the request
+            method (str):      HTTP method, e.g. 'GET'
+            body (bytes):      Body sent with the request, None for no body
+            pool (fritzbox.FBCore.FBConnectionPool): Pool used for the request, the pool of the
+                               FritzBox object if None
+
+        Returns:
+            Tuple (status, reason, page) of the response, or the unread response
+            (fritzbox.FBCore.FBStreamResponse) if stream is True.
+
+        Raises:
+            FritzBoxUnavailableError: The circuit breaker of the FritzBox is open.
+            OSError, http.client.HTTPException: The request failed on every attempt.
+        """
+
+        attempts = self.retries + 1 if idempotent else 1
+
+        url = page_url.split('?', 1)[0]
+
+        if pool is None:
+            pool = self.pool
+
+        for attempt in range(attempts):
+            if attempt > 0:
+                delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** (attempt - 1)))
+
+                logger.debug("Repeat the request in %.2f seconds" % (delay))
+
+                self.stats.count('retries')
+
+                time.sleep(delay)
+
+            info = FBRequestInfo(self.ip, url, attempt, relogin)
+
+            self._call_hooks(HOOK_PRE_REQUEST, info)
+
+            timings = {}
+
+            try:
+                if stream:
+                    response = pool.open(method, page_url, headers, body)
+                else:
+                    status, reason, page = pool.request(method, page_url, headers, timings, body)
+            except FritzBoxUnavailableError as e:
+                info.error = e
+
+                self._call_hooks(HOOK_ERROR, info)
+
+                raise
+            except Exception as e:
+                info.error = e
+
+                self._call_hooks(HOOK_ERROR, info)
+
+                if attempt == attempts - 1:
+                    raise
+
+                logger.debug("Request to the FritzBox failed: %s" % (e))
+            else:
+                if stream:
+                    info.status = response.status
+
+                    response.on_close = lambda response: self._complete_stream(info, response)
+
+                    return response
+
+                info.status = status
+                info.size = len(page)
+                info.connect = timings.get('connect')
+                info.ttfb = timings.get('ttfb')
+                info.download = timings.get('download')
+
+                self._complete_request(info)
+
+                return status, reason, page
+
+
+    def _complete_stream(self, info, response):
+        """Fill in the timings of a closed streamed response and call the post-response hooks."""
+
+        info.size = response.size
+        info.connect = response.timings['connect']
+        info.ttfb = response.timings['ttfb']
+        info.download = response.timings['download']
+        info.parse = time.monotonic() - response.opened_ts - info.download
+
+        self._complete_request(info)
+
+
+    def ensure_session(self):
+        """Provide a valid session id, log in only if the cached one is not valid anymore.
+
+        Threads calling this method at the same time share a single login. Use it to log in once
+        before sending many requests in parallel.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            True if a valid session id is available afterwards, False otherwise.
+        """
+
+        if self.is_session_valid():
+            return True
+
+        return self._renew_session()
+
+
+    def refresh_session(self):
+        """Renew the idle timeout of the cached session id.
+
+        The method presents the cached session id to the FritzBox which restarts its idle timeout. In
+        case the FritzBox does not accept the session id anymore a new login is performed.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            True if a valid session id is available afterwards, False otherwise.
+        """
+
+        sid = self.sid
+
+        if sid in ('', INVALID_SID):
+            return self._renew_session()
+
+        logger.debug("Refresh the session id")
+
+        headers = { "Accept" : "application/xml",
+                    "Content-Type" : "text/plain",
+                    "User-Agent" : USER_AGENT}
+
+        page_url = '/login_sid.lua?sid=' + sid
+
+        try:
+            status, reason, page = self._request(page_url, headers)
+        except:
+            logger.error("Loading of the FritzBox page failed: %s" %(page_url))
+
+            return False
+
+        if status != 200:
+            logger.error("Unexpected feedback from FritzBox received: %s %s" % (status, reason))
+
+            return False
+
+        new_sid, challenge = parse_session_info(page)
+
+        if new_sid == sid:
+            self._session_used()
+
+            return True
+        else:
+            return self._renew_session(rejected_sid=sid)
+
+
+    def start_session_refresh(self):
+        """Start a background thread that refreshes the session id before it expires.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._refresh_stop.clear()
+
+        self._refresh_thread = threading.Thread(target=self._refresh_session_periodically,
+                                                daemon=True)
+
+        self._refresh_thread.start()
+
+
+    def stop_session_refresh(self):
+        """Stop the background thread started by start_session_refresh().
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        self._refresh_stop.set()
+
+
+    def _refresh_session_periodically(self):
+        """Thread method that keeps the cached session id alive."""
+
+        while not self._refresh_stop.is_set():
+            if self.sid in ('', INVALID_SID):
+                timeout = SESSION_TIMEOUT - SESSION_REFRESH_MARGIN
+            else:
+                timeout = self.sid_ts + SESSION_TIMEOUT - SESSION_REFRESH_MARGIN - time.time()
+
+            if timeout > 0:
+                self._refresh_stop.wait(timeout)
+            elif self.sid not in ('', INVALID_SID) and not self.refresh_session():
+                # Do not repeat a failed refresh immediately
+                self._refresh_stop.wait(SESSION_REFRESH_MARGIN)
+
+
+    def login(self):
+        """Authenticate with the FritzBox to access private pages.
+
+        The method authenticates with a FritzBox using the authentication credentials
+        read out from the configuration file during the class object instantiation.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            True if the authentication succeeded, False otherwise.
+        """
+
+        if self.session_store is None:
+            with self._session_lock:
+                return self._authenticate()
+
+        # Only one process authenticates, the others wait and reuse its session id
+        with self._session_lock, self.session_store.lock():
+            session = self.session_store.get(self.session_key)
+
+            if session is not None:
+                logger.debug("Reuse the shared session id")
+
+                self.sid, self.sid_ts = session
+                self._shared_ts = self.sid_ts
+
+                return True
+
+            if not self._authenticate():
+                return False
+
+            self.session_store.put(self.session_key, self.sid, self.sid_ts)
+            self._shared_ts = self.sid_ts
+
+            return True
+
+
+    def _renew_session(self, rejected_sid=None):
+        """Provide a valid session id, concurrent callers share a single login.
+
+        Threads waiting while another thread logs in return the result of that login. A rejected
+        session id is only dropped if no other thread replaced it meanwhile.
+
+        Args:
+            rejected_sid (str): Session id rejected by the FritzBox, None if it expired
+
+        Returns:
+            True if a valid session id is available afterwards, False otherwise.
+        """
+
+        generation = self._login_generation
+
+        with self._session_lock:
+            if self._login_generation != generation:
+                logger.debug("Use the result of the login of another thread")
+
+                return self._login_result
+
+            if rejected_sid is not None and rejected_sid == self.sid:
+                self.invalidate_session()
+
+            if self.is_session_valid():
+                return True
+
+            self._login_result = self.login()
+            self._login_generation += 1
+
+            return self._login_result
+
+
+    def _authenticate(self):
+        """Authenticate and count the result, see login()."""
+
+        if self._login():
+            self.stats.count('logins')
+
+            return True
+        else:
+            self.stats.count('login_failures')
+
+            return False
+
+
+    def _login(self):
+        """Perform the challenge-response authentication, see login()."""
+
+        logger.debug("Login to the FritzBox")
+
+        headers = { "Accept" : "application/xml",
+                    "Content-Type" : "text/plain",
+                    "User-Agent" : USER_AGENT}
+
+        page_url = LOGIN_PAGE
+
+        try:
+            status, reason, page = self._request(page_url, headers)
+        except:
+            logger.error("Loading of the FritzBox page failed: %s" %(page_url))
+
+            return False
+
+        if status != 200:
+            logger.error("Unexpected feedback from FritzBox received: %s %s" % (status, reason))
+
+            return False
+        else:
+            sid, challenge = parse_session_info(page)
+
+            if sid == INVALID_SID:
+                page_url = self._login_response_url(challenge)
+
+                if page_url is None:
+                    return False
+            else:
+                logger.debug("Authentication succeeded")
+
+                self.sid = sid
+                self.sid_ts = time.time()
+
+                return True
+
+        headers = { "Accept" : "text/html,application/xhtml+xml,application/xml",
+                    "Content-Type" : "application/x-www-form-urlencoded",
+                    "User-Agent" : USER_AGENT}
+
+        # A repeated response could count as additional failed login attempt
+        try:
+            status, reason, page = self._request(page_url, headers, idempotent=False)
+        except:
+            logger.error("Loading of the FritzBox page failed: %s" %(page_url))
+
+            return False
+
+        if status != 200:
+            logger.error("Unexpected feedback from FritzBox received: %s %s" % (status, reason))
+
+            return False
+        else:
+            sid, challenge = parse_session_info(page)
+
+            if sid == INVALID_SID:
+                logger.error("Authentication failed due to invalid password")
+
+                return False
+            else:
+                logger.debug("Authentication succeeded")
+
+                self.sid = sid
+                self.sid_ts = time.time()
+
+                return True
+
+
+    def _session_used(self):
+        """Restart the idle timeout of the session id after it was accepted by the FritzBox.
+
+        The expiry of a shared session id is updated at most every SESSION_STORE_TOUCH_INTERVAL
+        seconds.
+        """
+
+        self.sid_ts = time.time()
+
+        if self.session_store is not None and self.sid_ts - self._shared_ts >= SESSION_STORE_TOUCH_INTERVAL:
+            self.session_store.put(self.session_key, self.sid, self.sid_ts)
+            self._shared_ts = self.sid_ts
+
+
+    def _login_response_url(self, challenge):
+        """Return the URL of the login_sid.lua page answering the given challenge.
+
+        Args:
+            challenge (str): Challenge read out from the login_sid.lua page
+
+        Returns:
+            URL of the login_sid.lua page, None if the challenge is malformed.
+        """
+
+        return login_response_url(challenge, self.password, self.user)
 
 
 #===============================================================================
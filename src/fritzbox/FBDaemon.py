@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""Module for serving FritzBox queries from a long-running process.
+
+This module provides a daemon that keeps an authenticated session and a continuously refreshed
+table of devices and switch plugs in memory and answers queries over a Unix domain socket. The
+command line tools of FBPresence and FBHomeAuto use it if it is running.
+"""
+
+import fritzbox._info
+
+__author__     = fritzbox._info.__author__
+__copyright__  = fritzbox._info.__copyright__
+__credits__    = fritzbox._info.__credits__
+__license__    = fritzbox._info.__license__
+__maintainer__ = fritzbox._info.__maintainer__
+__email__      = fritzbox._info.__email__
+
+
+#===============================================================================
+# Imports
+#===============================================================================
+import argparse
+import logging
+import os
+import json
+import time
+import socket
+import threading
+import socketserver
+
+import fritzbox.FBCore
+import fritzbox.FBPresence
+import fritzbox.FBHomeAuto
+
+
+#===============================================================================
+# Evaluate parameters
+#===============================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="%(prog)s [options]",
+                                     description="Serve the devices and switch plugs of the FritzBox on a "
+                                     "Unix domain socket. The command line tools of FBPresence and FBHomeAuto "
+                                     "use the daemon while it is running.")
+
+    parser.add_argument('--v1',
+                      help='Debug level INFO',
+                      dest='verbose_INFO',
+                      default=False,
+                      action='store_true')
+    parser.add_argument('--v2',
+                        help='Debug level ERROR',
+                        dest='verbose_ERROR',
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--v3',
+                        help='Debug level DEBUG',
+                        dest='verbose_DEBUG',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('-i',
+                        '--ip',
+                        help='IP adress of the FritzBox, eg. "192.168.0.1"',
+                        dest='ip',
+                        default="192.168.0.1",
+                        action='store',
+                        required=True)
+    parser.add_argument('-p',
+                        '--password',
+                        help='Password for accessing the FritzBox, eg. "mysecret123"',
+                        dest='password',
+                        default="password",
+                        action='store',
+                        required=True)
+    parser.add_argument('-s',
+                        '--socket',
+                        help='Path of the Unix domain socket, defaults to a socket per FritzBox in the runtime directory',
+                        dest='socket',
+                        default=None,
+                        action='store')
+    parser.add_argument('-r',
+                        '--refresh',
+                        help='Interval in seconds between two refreshes of the devices and switch plugs',
+                        dest='refresh_interval',
+                        default=10,
+                        type=float,
+                        action='store')
+
+    args = parser.parse_args()
+
+
+#===============================================================================
+# Setup logger
+#===============================================================================
+if __name__ == '__main__':
+    log_level = logging.CRITICAL
+
+    if args.verbose_INFO:
+        log_level = logging.INFO
+
+    if args.verbose_ERROR:
+        log_level = logging.ERROR
+
+    if args.verbose_DEBUG:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(level=log_level,
+                        format="[{asctime}] - [{levelname}]: {message}",
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        style="{")
+
+logger = logging.getLogger(__name__)
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+# Default interval in seconds between two refreshes of the devices and switch plugs
+REFRESH_INTERVAL = 10
+
+# Max. time in seconds a client waits for the answer of the daemon
+CLIENT_TIMEOUT = 2
+
+SOCKET_NAME = 'fritzbox-%s.sock'
+
+
+#===============================================================================
+# Exceptions
+#===============================================================================
+class FBDaemonError(Exception):
+    """Query rejected by the daemon"""
+    pass
+
+
+#===============================================================================
+# Method definitions
+#===============================================================================
+def default_socket_path(ip):
+    """Return the default path of the socket of the daemon for the given FritzBox.
+
+    Args:
+        ip (str): IP address of the FritzBox
+
+    Returns:
+        Path of the Unix domain socket in the runtime directory, see fritzbox.FBCore.get_runtime_dir().
+    """
+
+    return os.path.join(fritzbox.FBCore.get_runtime_dir(), SOCKET_NAME % (ip))
+
+
+def query_daemon(path, command, timeout=CLIENT_TIMEOUT, **param):
+    """Send a query to the daemon.
+
+    A query is a single line with a JSON object holding the command and its parameters. The
+    daemon answers with a single line holding a JSON object with the key 'result' or 'error'.
+
+    Args:
+        path (str):      Path of the Unix domain socket of the daemon
+        command (str):   Command, see FBDaemon.COMMANDS
+        timeout (float): Max. time in seconds to wait for the answer
+        param:           Parameters of the command
+
+    Returns:
+        Result of the command.
+
+    Raises:
+        OSError:       The daemon is not running or did not answer in time
+        FBDaemonError: The daemon rejected the query
+    """
+
+    request = dict(param, command=command)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode('utf-8') + b'\n')
+            stream.flush()
+
+            line = stream.readline()
+
+    if not line:
+        raise FBDaemonError("Connection closed by the daemon")
+
+    response = json.loads(line.decode('utf-8'))
+
+    if 'error' in response:
+        raise FBDaemonError(response['error'])
+
+    return response['result']
+
+
+def try_query_daemon(path, command, **param):
+    """Send a query to the daemon if it is running.
+
+    Args:
+        path (str):    Path of the Unix domain socket of the daemon
+        command (str): Command, see FBDaemon.COMMANDS
+        param:         Parameters of the command
+
+    Returns:
+        Tuple (answered, result), answered is False if the daemon is not running or failed
+        to answer the query.
+    """
+
+    if not os.path.exists(path):
+        return False, None
+
+    try:
+        return True, query_daemon(path, command, **param)
+    except (OSError, ValueError, FBDaemonError) as e:
+        logger.debug("Query of the daemon failed, fall back to the FritzBox: %s" % (e))
+
+        return False, None
+
+
+#===============================================================================
+# Class definitions
+#===============================================================================
+class FBDaemon(object):
+    """Daemon answering queries about a FritzBox from memory.
+
+    A background thread loads the device list of the FBPresence object and the actors of the
+    FBHomeAuto object every refresh_interval seconds using the same session. Queries received
+    on the Unix domain socket are answered from the last loaded state, only switch commands are
+    forwarded to the FritzBox. Either interface can be None to disable its commands.
+
+    The socket is only accessible by the user running the daemon.
+    """
+
+    COMMANDS = ('ping', 'devices', 'present', 'switch_plugs', 'switch_state', 'set_switch', 'toggle_switch')
+
+    def __init__(self, fbpresence=None, fbhomeauto=None, path=None, refresh_interval=REFRESH_INTERVAL):
+        self.fbpresence = fbpresence
+        self.fbhomeauto = fbhomeauto
+        self.refresh_interval = refresh_interval
+
+        if path is None:
+            fb = fbpresence.fb if fbpresence is not None else fbhomeauto.fb
+
+            path = default_socket_path(fb.ip)
+
+        self.path = path
+
+        # Snapshots (devices, devices_by_mac, devices_by_ip, chk_ts) and {ain : actor}, replaced as a whole
+        self._devices = None
+        self._actors = None
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+
+    def start(self):
+        """Load the state once, then start the refresh thread and listen on the socket.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        daemon = self
+
+        class FBDaemonRequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    self.wfile.write(json.dumps(daemon.handle_request(line)).encode('utf-8') + b'\n')
+
+        self.refresh()
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        # The socket file is created by bind(), the umask keeps it private from the start
+        umask = os.umask(0o077)
+
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.path, FBDaemonRequestHandler)
+        finally:
+            os.umask(umask)
+
+        self._server.daemon_threads = True
+
+        os.chmod(self.path, 0o600)
+
+        self._stop.clear()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        logger.info("Serving queries on %s" % (self.path))
+
+
+    def stop(self):
+        """Stop the refresh thread, close the socket and remove its file.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        self._stop.set()
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+    def _run(self):
+        """Thread method refreshing the state"""
+
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Refresh of the daemon state failed")
+
+
+    def refresh(self):
+        """Load the devices and switch plugs from the FritzBox.
+
+        The previous state is kept if loading fails.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        if self.fbpresence is not None:
+            result = self.fbpresence.get_wlan_device_information()
+
+            if result is not None:
+                devices, chk_ts = result
+
+                records = [{'name' : device.name, 'mac' : device.mac, 'ip' : device.ip,
+                            'conn_type' : device.conn_type, 'on_ts' : device.on_ts}
+                           for device in devices.values()]
+
+                self._devices = ({record['name'] : record for record in records},
+                                 {record['mac'] : record for record in records if record['mac']},
+                                 {record['ip'] : record for record in records if record['ip']},
+                                 chk_ts)
+
+        if self.fbhomeauto is not None:
+            actors = self.fbhomeauto.get_device_list_infos(fields={'name', 'functionbitmask', 'present',
+                                                                  'switch_state'})
+
+            # Only the switch plugs, like getswitchlist
+            if actors is not None:
+                self._actors = {actor.ain : actor for actor in actors
+                                if not actor.is_group and actor.has_function(fritzbox.FBHomeAuto.FUNCTION_SWITCH_PLUG)}
+
+
+    def handle_request(self, line):
+        """Answer a single query.
+
+        Args:
+            line (bytes): Query as JSON object, see query_daemon()
+
+        Returns:
+            response (dict): Answer with the key 'result' or 'error'
+        """
+
+        try:
+            request = json.loads(line.decode('utf-8'))
+            command = request.pop('command')
+        except (ValueError, KeyError, AttributeError):
+            return {'error' : "Invalid query"}
+
+        if command not in self.COMMANDS:
+            return {'error' : "Unknown command: %s" % (command)}
+
+        try:
+            return {'result' : getattr(self, '_command_' + command)(**request)}
+        except FBDaemonError as e:
+            return {'error' : str(e)}
+        except (TypeError, fritzbox.FBPresence.InvalidParameterError, fritzbox.FBHomeAuto.InvalidParameterError):
+            return {'error' : "Invalid parameters for command: %s" % (command)}
+        except Exception as e:
+            logger.exception("Query failed: %s" % (command))
+
+            return {'error' : str(e)}
+
+
+    def _get_devices(self):
+        """Return the snapshot of the devices, see refresh()."""
+
+        if self._devices is None:
+            raise FBDaemonError("Device list not available")
+
+        return self._devices
+
+
+    def _get_actors(self):
+        """Return the snapshot of the switch plugs, see refresh()."""
+
+        if self._actors is None:
+            raise FBDaemonError("Switch plugs not available")
+
+        return self._actors
+
+
+    def _command_ping(self):
+        return True
+
+
+    def _command_devices(self):
+        devices, devices_by_mac, devices_by_ip, chk_ts = self._get_devices()
+
+        return {'devices' : list(devices.values()), 'chk_ts' : chk_ts}
+
+
+    def _command_present(self, name=None, mac=None, ip=None, debounce_off=0):
+        devices, devices_by_mac, devices_by_ip, chk_ts = self._get_devices()
+
+        if mac is not None:
+            device = devices_by_mac.get(fritzbox.FBPresence.normalize_mac(mac))
+        elif ip is not None:
+            device = devices_by_ip.get(ip)
+        elif name is not None:
+            device = devices.get(name)
+        else:
+            raise fritzbox.FBPresence.InvalidParameterError()
+
+        return device is not None and chk_ts - device['on_ts'] <= 60 * debounce_off
+
+
+    def _command_switch_plugs(self):
+        return list(self._get_actors())
+
+
+    def _command_switch_state(self, ain):
+        actor = self._get_actors().get(ain)
+
+        if actor is None or actor.switch_state is None:
+            raise FBDaemonError("Unknown switch plug: %s" % (ain))
+
+        return '1' if actor.switch_state else '0'
+
+
+    def _command_set_switch(self, ain, state):
+        return self._switch(ain, self.fbhomeauto.set_switch_plug_state(ain, state))
+
+
+    def _command_toggle_switch(self, ain):
+        return self._switch(ain, self.fbhomeauto.toggle_switch_plug_state(ain))
+
+
+    def _switch(self, ain, switch_plug_state):
+        """Apply the state returned by a switch command to the snapshot of the switch plugs."""
+
+        if switch_plug_state is None:
+            raise FBDaemonError("Switch command failed: %s" % (ain))
+
+        actor = self._get_actors().get(ain)
+
+        if actor is not None:
+            actor.switch_state = switch_plug_state == '1'
+
+        return switch_plug_state
+
+
+#===============================================================================
+# Main program
+#===============================================================================
+def main():
+    """Main function for testing purpose"""
+    # Both interfaces share the session id
+    session_store = fritzbox.FBCore.FBSessionStore()
+
+    daemon = FBDaemon(fritzbox.FBPresence.FBPresence(ip=args.ip, password=args.password,
+                                                     session_store=session_store),
+                      fritzbox.FBHomeAuto.FBHomeAuto(ip=args.ip, password=args.password,
+                                                     session_store=session_store),
+                      path=args.socket,
+                      refresh_interval=args.refresh_interval)
+
+    daemon.start()
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""Module for exporting FritzBox metrics to Prometheus.
+
+This module provides a HTTP endpoint serving the device presence, the state of the switch plugs
+and the request statistics of a FritzBox in the Prometheus text format.
+"""
+
+import fritzbox._info
+
+__author__     = fritzbox._info.__author__
+__copyright__  = fritzbox._info.__copyright__
+__credits__    = fritzbox._info.__credits__
+__license__    = fritzbox._info.__license__
+__maintainer__ = fritzbox._info.__maintainer__
+__email__      = fritzbox._info.__email__
+
+
+#===============================================================================
+# Imports
+#===============================================================================
+import argparse
+import logging
+import time
+import threading
+import collections
+import http.server
+
+import fritzbox.FBCore
+import fritzbox.FBPresence
+import fritzbox.FBHomeAuto
+
+
+#===============================================================================
+# Evaluate parameters
+#===============================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="%(prog)s [options]",
+                                     description="Serve the metrics of the FritzBox on http://<address>:<port>/metrics "
+                                     "for scraping by Prometheus.")
+
+    parser.add_argument('--v1',
+                      help='Debug level INFO',
+                      dest='verbose_INFO',
+                      default=False,
+                      action='store_true')
+    parser.add_argument('--v2',
+                        help='Debug level ERROR',
+                        dest='verbose_ERROR',
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--v3',
+                        help='Debug level DEBUG',
+                        dest='verbose_DEBUG',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('-i',
+                        '--ip',
+                        help='IP adress of the FritzBox, eg. "192.168.0.1"',
+                        dest='ip',
+                        default="192.168.0.1",
+                        action='store',
+                        required=True)
+    parser.add_argument('-p',
+                        '--password',
+                        help='Password for accessing the FritzBox, eg. "mysecret123"',
+                        dest='password',
+                        default="password",
+                        action='store',
+                        required=True)
+    parser.add_argument('-a',
+                        '--address',
+                        help='Address the HTTP endpoint listens on',
+                        dest='address',
+                        default='',
+                        action='store')
+    parser.add_argument('-l',
+                        '--port',
+                        help='Port the HTTP endpoint listens on',
+                        dest='port',
+                        default=9689,
+                        type=int,
+                        action='store')
+    parser.add_argument('-r',
+                        '--refresh',
+                        help='Interval in seconds between two refreshes of the metrics',
+                        dest='refresh_interval',
+                        default=30,
+                        type=float,
+                        action='store')
+
+    args = parser.parse_args()
+
+
+#===============================================================================
+# Setup logger
+#===============================================================================
+if __name__ == '__main__':
+    log_level = logging.CRITICAL
+
+    if args.verbose_INFO:
+        log_level = logging.INFO
+
+    if args.verbose_ERROR:
+        log_level = logging.ERROR
+
+    if args.verbose_DEBUG:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(level=log_level,
+                        format="[{asctime}] - [{levelname}]: {message}",
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        style="{")
+
+logger = logging.getLogger(__name__)
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+EXPORTER_PORT = 9689
+
+# Default interval in seconds between two refreshes of the metrics
+REFRESH_INTERVAL = 30
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Counters of fritzbox.FBCore.FBRequestStats exported as metrics
+REQUEST_COUNTERS = (('requests', 'fritzbox_requests_total', 'HTTP exchanges with the FritzBox'),
+                    ('response_bytes', 'fritzbox_response_bytes_total', 'Size of the received response bodies'),
+                    ('errors', 'fritzbox_request_errors_total', 'Failed HTTP exchanges with the FritzBox'),
+                    ('rejected', 'fritzbox_requests_rejected_total', 'Requests rejected by the circuit breaker'),
+                    ('retries', 'fritzbox_request_retries_total', 'Repetitions of failed requests'),
+                    ('logins', 'fritzbox_logins_total', 'Successful logins'),
+                    ('login_failures', 'fritzbox_login_failures_total', 'Failed logins'),
+                    ('sessions_rejected', 'fritzbox_sessions_rejected_total', 'Requests rejected due to an expired session id'))
+
+
+#===============================================================================
+# Method definitions
+#===============================================================================
+def escape_label(value):
+    """Escape a label value for the Prometheus text format.
+
+    Args:
+        value (str): Label value
+
+    Returns:
+        Escaped label value.
+    """
+
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    """Format a dictionary of labels for the Prometheus text format, e.g. '{box="192.168.0.1"}'.
+
+    Args:
+        labels (dict): Label names and values
+
+    Returns:
+        Formatted labels, '' if there are no labels.
+    """
+
+    if not labels:
+        return ''
+
+    return '{' + ','.join('%s="%s"' % (name, escape_label(value)) for name, value in labels.items()) + '}'
+
+
+#===============================================================================
+# Class definitions
+#===============================================================================
+class FBMetrics(object):
+    """Builder for a page in the Prometheus text format.
+
+    The samples are grouped by metric, independent of the order they were added in.
+    """
+
+    def __init__(self):
+        self.families = collections.OrderedDict()
+
+
+    def add(self, name, metric_type, description, value, labels=None):
+        """Add a sample of a metric.
+
+        Args:
+            name (str):        Name of the metric
+            metric_type (str): Type of the metric, e.g. 'gauge' or 'counter'
+            description (str): Help text of the metric
+            value (float):     Value of the sample
+            labels (dict):     Labels of the sample
+
+        Returns:
+            Does not return any value.
+        """
+
+        self.declare(name, metric_type, description).append('%s%s %s' % (name,
+                                                                        format_labels(labels),
+                                                                        repr(float(value))))
+
+
+    def add_histogram(self, name, description, histogram, labels=None):
+        """Add a histogram as cumulative buckets together with its sum and count.
+
+        Args:
+            name (str):        Name of the metric
+            description (str): Help text of the metric
+            histogram (fritzbox.FBCore.FBLatencyHistogram): Histogram of the sample
+            labels (dict):     Labels of the sample
+
+        Returns:
+            Does not return any value.
+        """
+
+        lines = self.declare(name, 'histogram', description)
+
+        labels = dict(labels or {})
+        cumulative = 0
+
+        for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+            cumulative += count
+
+            lines.append('%s_bucket%s %d' % (name,
+                                                  format_labels(dict(labels, le='+Inf' if bound == float('inf') else repr(float(bound)))),
+                                                  cumulative))
+
+        lines.append('%s_sum%s %s' % (name, format_labels(labels), repr(float(histogram.sum))))
+        lines.append('%s_count%s %d' % (name, format_labels(labels), histogram.count))
+
+
+    def declare(self, name, metric_type, description):
+        """Return the list of sample lines of a metric, starting with its HELP and TYPE lines."""
+
+        lines = self.families.get(name)
+
+        if lines is None:
+            lines = self.families[name] = ['# HELP %s %s' % (name, description),
+                                           '# TYPE %s %s' % (name, metric_type)]
+
+        return lines
+
+
+    def render(self):
+        """Return the page as bytes."""
+
+        return ''.join(line + '\n' for lines in self.families.values() for line in lines).encode('utf-8')
+
+
+class FBExporter(object):
+    """Prometheus exporter for a FritzBox.
+
+    A background thread loads the device list of the FBPresence object and the actors of the
+    FBHomeAuto object every refresh_interval seconds and renders the metrics page. Scrapes are
+    answered from the last rendered page and never send requests to the FritzBox. Either
+    interface can be None to skip its metrics.
+    """
+
+    def __init__(self, fbpresence=None, fbhomeauto=None, address='', port=EXPORTER_PORT,
+                 refresh_interval=REFRESH_INTERVAL):
+        self.fbpresence = fbpresence
+        self.fbhomeauto = fbhomeauto
+        self.address = address
+        self.port = port
+        self.refresh_interval = refresh_interval
+
+        self.page = FBMetrics().render()
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+
+    def start(self):
+        """Start the refresh thread and the HTTP endpoint.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        exporter = self
+
+        class FBExporterRequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+
+                    return
+
+                page = exporter.page
+
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(page)))
+                self.end_headers()
+
+                self.wfile.write(page)
+
+
+            def log_message(self, format, *args):
+                logger.debug("Exporter request: " + format % args)
+
+        self._server = http.server.ThreadingHTTPServer((self.address, self.port), FBExporterRequestHandler)
+        self._server.daemon_threads = True
+
+        # Report the bound port in case port 0 was requested
+        self.port = self._server.server_address[1]
+
+        self._stop.clear()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+
+    def stop(self):
+        """Stop the refresh thread and the HTTP endpoint.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        self._stop.set()
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+    def _run(self):
+        """Thread method refreshing the metrics page"""
+
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Refresh of the metrics failed")
+
+            self._stop.wait(self.refresh_interval)
+
+
+    def refresh(self):
+        """Load the current state from the FritzBox and render the metrics page.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        metrics = FBMetrics()
+
+        start = time.monotonic()
+
+        if self.fbpresence is not None:
+            self._collect_presence(metrics)
+
+        if self.fbhomeauto is not None:
+            self._collect_homeauto(metrics)
+
+        metrics.add('fritzbox_exporter_refresh_duration_seconds', 'gauge',
+                    'Duration of the last refresh of the metrics', time.monotonic() - start)
+        metrics.add('fritzbox_exporter_refresh_timestamp_seconds', 'gauge',
+                    'Time of the last refresh of the metrics', time.time())
+
+        self._collect_requests(metrics)
+
+        self.page = metrics.render()
+
+
+    def _collect_presence(self, metrics):
+        """Add the presence of all devices known to the FritzBox."""
+
+        box = self.fbpresence.fb.ip
+
+        try:
+            result = self.fbpresence.get_wlan_device_information()
+        except Exception as e:
+            logger.error("Loading of the device list failed: %s" % (e))
+
+            result = None
+
+        if result is None:
+            metrics.add('fritzbox_presence_up', 'gauge', 'Device list was loaded by the last refresh',
+                        0, {'box' : box})
+
+            return
+
+        devices, chk_ts = result
+
+        metrics.add('fritzbox_presence_up', 'gauge', 'Device list was loaded by the last refresh',
+                    1, {'box' : box})
+
+        for device in devices.values():
+            labels = {'box' : box, 'mac' : device.mac, 'name' : device.name}
+
+            metrics.add('fritzbox_device_present', 'gauge', 'Device is connected to the FritzBox',
+                        1 if device.on_ts == chk_ts else 0, labels)
+            metrics.add('fritzbox_device_last_seen_timestamp_seconds', 'gauge',
+                        'Time the device was connected for the last time', device.on_ts, labels)
+
+
+    def _collect_homeauto(self, metrics):
+        """Add the state of all switch plugs and groups."""
+
+        box = self.fbhomeauto.fb.ip
+
+        actors = self.fbhomeauto.get_device_list_infos()
+
+        metrics.add('fritzbox_homeauto_up', 'gauge', 'Actor list was loaded by the last refresh',
+                    0 if actors is None else 1, {'box' : box})
+
+        for actor in actors or []:
+            labels = {'box' : box, 'ain' : actor.ain, 'name' : actor.name}
+
+            if actor.present is not None:
+                metrics.add('fritzbox_actor_present', 'gauge', 'Actor is connected to the FritzBox',
+                            actor.present, labels)
+
+            if actor.switch_state is not None:
+                metrics.add('fritzbox_switch_state', 'gauge', 'Switch is on',
+                            actor.switch_state, labels)
+
+            if actor.power is not None:
+                metrics.add('fritzbox_switch_power_watts', 'gauge', 'Current power',
+                            actor.power / 1000, labels)
+
+            if actor.energy is not None:
+                metrics.add('fritzbox_switch_energy_watthours_total', 'counter',
+                            'Energy consumed since commissioning', actor.energy, labels)
+
+            if actor.voltage is not None:
+                metrics.add('fritzbox_switch_voltage_volts', 'gauge', 'Current voltage',
+                            actor.voltage / 1000, labels)
+
+            if actor.temperature is not None:
+                metrics.add('fritzbox_actor_temperature_celsius', 'gauge', 'Temperature',
+                            actor.temperature, labels)
+
+
+    def _collect_requests(self, metrics):
+        """Add the request statistics collected by the request hooks, summed up per FritzBox."""
+
+        counters = {}
+        latencies = {}
+
+        for fb in set(interface.fb for interface in (self.fbpresence, self.fbhomeauto) if interface is not None):
+            fb_counters, fb_latencies = fb.stats.snapshot()
+
+            for name, value in fb_counters.items():
+                counters[(fb.ip, name)] = counters.get((fb.ip, name), 0) + value
+
+            for (url, phase), histogram in fb_latencies.items():
+                if (fb.ip, url, phase) in latencies:
+                    latencies[(fb.ip, url, phase)].merge(histogram)
+                else:
+                    latencies[(fb.ip, url, phase)] = histogram
+
+        for counter, name, description in REQUEST_COUNTERS:
+            for (box, counter_name), value in sorted(counters.items()):
+                if counter_name == counter:
+                    metrics.add(name, 'counter', description, value, {'box' : box})
+
+        for (box, url, phase), histogram in sorted(latencies.items()):
+            metrics.add_histogram('fritzbox_request_duration_seconds', 'Duration of the phases of the requests to the FritzBox',
+                                  histogram, {'box' : box, 'url' : url, 'phase' : phase})
+
+
+#===============================================================================
+# Main program
+#===============================================================================
+def main():
+    """Main function for testing purpose"""
+    exporter = FBExporter(fritzbox.FBPresence.FBPresence(ip=args.ip, password=args.password),
+                          fritzbox.FBHomeAuto.FBHomeAuto(ip=args.ip, password=args.password),
+                          address=args.address,
+                          port=args.port,
+                          refresh_interval=args.refresh_interval)
+
+    exporter.start()
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        exporter.stop()
+
+
+if __name__ == '__main__':
+    main()
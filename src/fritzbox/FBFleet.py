@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""Module for polling a fleet of FritzBoxes.
+
+This module provides an interface for polling the device presence and the home automation actors
+of many FritzBoxes in parallel.
+"""
+
+import fritzbox._info
+
+__author__     = fritzbox._info.__author__
+__copyright__  = fritzbox._info.__copyright__
+__credits__    = fritzbox._info.__credits__
+__license__    = fritzbox._info.__license__
+__maintainer__ = fritzbox._info.__maintainer__
+__email__      = fritzbox._info.__email__
+
+
+#===============================================================================
+# Imports
+#===============================================================================
+import argparse
+import logging
+import json
+import time
+import concurrent.futures
+
+import fritzbox.FBCore
+import fritzbox.FBPresence
+import fritzbox.FBHomeAuto
+
+
+#===============================================================================
+# Evaluate parameters
+#===============================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="%(prog)s [options]",
+                                     description="Poll all given FritzBoxes in parallel and return the "
+                                     "merged list of devices and switch plugs as JSON.")
+
+    parser.add_argument('--v1',
+                      help='Debug level INFO',
+                      dest='verbose_INFO',
+                      default=False,
+                      action='store_true')
+    parser.add_argument('--v2',
+                        help='Debug level ERROR',
+                        dest='verbose_ERROR',
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--v3',
+                        help='Debug level DEBUG',
+                        dest='verbose_DEBUG',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('-b',
+                        '--box',
+                        help='IP address and password of a FritzBox, eg. "192.168.0.1:mysecret123". '
+                        'The option can be given multiple times.',
+                        dest='boxes',
+                        default=[],
+                        action='append',
+                        required=True)
+    parser.add_argument('-t',
+                        '--timeout',
+                        help='Max. time in seconds to wait for a FritzBox',
+                        dest='timeout',
+                        default=10,
+                        type=float,
+                        action='store')
+
+    args = parser.parse_args()
+
+
+#===============================================================================
+# Setup logger
+#===============================================================================
+if __name__ == '__main__':
+    log_level = logging.CRITICAL
+
+    if args.verbose_INFO:
+        log_level = logging.INFO
+
+    if args.verbose_ERROR:
+        log_level = logging.ERROR
+
+    if args.verbose_DEBUG:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(level=log_level,
+                        format="[{asctime}] - [{levelname}]: {message}",
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        style="{")
+
+logger = logging.getLogger(__name__)
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+# Default no. of FritzBoxes polled at the same time
+FLEET_WORKERS = 8
+
+# Default max. time in seconds to wait for a FritzBox during a sweep, counted from the start of its poll
+FLEET_TIMEOUT = 10
+
+
+#===============================================================================
+# Exceptions
+#===============================================================================
+class FleetPollError(Exception):
+    """Error while polling a FritzBox of the fleet"""
+    pass
+
+
+#===============================================================================
+# Class definitions
+#===============================================================================
+class FBFleetMember(object):
+    """FritzBox of the fleet together with its interfaces and circuit breaker."""
+
+    def __init__(self, ip, password, presence=True, homeauto=True):
+        self.ip = ip
+
+        self.presence = fritzbox.FBPresence.FBPresence(ip, password) if presence else None
+        self.homeauto = fritzbox.FBHomeAuto.FBHomeAuto(ip, password) if homeauto else None
+
+        self.breaker = fritzbox.FBCore.FBCircuitBreaker()
+        self.pending = None
+
+        # Start of the pending poll on a worker thread, None while it is queued
+        self.started_ts = None
+
+
+    def poll(self):
+        """Load the devices and actors of the FritzBox.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Tuple (devices, switches) with the box-tagged dictionaries of the snapshot.
+
+        Raises:
+            FleetPollError: The FritzBox did not deliver the requested information.
+        """
+
+        devices = []
+        switches = []
+
+        if self.presence is not None:
+            try:
+                result = self.presence.get_wlan_device_information()
+            except Exception as e:
+                raise FleetPollError("Loading of the device list failed: %s" % (e))
+
+            if result is None:
+                raise FleetPollError("Loading of the device list failed")
+
+            device_list, chk_ts = result
+
+            for device in device_list.values():
+                devices.append({'box' : self.ip,
+                                'name' : device.name,
+                                'mac' : device.mac,
+                                'ip' : device.ip,
+                                'present' : device.on_ts == chk_ts})
+
+        if self.homeauto is not None:
+            actors = self.homeauto.get_device_list_infos()
+
+            if actors is None:
+                raise FleetPollError("Loading of the actor list failed")
+
+            for actor in actors:
+                if actor.switch_state is None and not actor.has_function(fritzbox.FBHomeAuto.FUNCTION_SWITCH_PLUG):
+                    continue
+
+                switches.append({'box' : self.ip,
+                                 'ain' : actor.ain,
+                                 'name' : actor.name,
+                                 'is_group' : actor.is_group,
+                                 'present' : actor.present,
+                                 'switch_state' : actor.switch_state,
+                                 'power' : actor.power,
+                                 'energy' : actor.energy,
+                                 'temperature' : actor.temperature})
+
+        return devices, switches
+
+
+class FBFleet(object):
+    """Interface for polling many FritzBoxes in parallel.
+
+    Each sweep polls all FritzBoxes concurrently using a bounded pool of worker threads. The poll
+    of a FritzBox may take at most timeout seconds from the moment a worker starts it, FritzBoxes
+    that do not answer in time are reported as failed. Polls waiting for a worker are not limited,
+    they are only dropped if all workers are blocked by FritzBoxes that did not answer.
+
+    Every FritzBox has its own circuit breaker, FritzBoxes that failed repeatedly are skipped until
+    the breaker lets a probe pass again.
+    """
+
+    def __init__(self, boxes, max_workers=FLEET_WORKERS, timeout=FLEET_TIMEOUT, presence=True, homeauto=True):
+        self.timeout = timeout
+        self.max_workers = max_workers
+
+        self.members = [FBFleetMember(ip, password, presence, homeauto) for ip, password in boxes]
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+
+    def __del__(self):
+        self.close()
+
+
+    def close(self):
+        """Stop the worker threads.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        self._executor.shutdown(wait=False)
+
+
+    def poll(self):
+        """Poll all FritzBoxes of the fleet once.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            snapshot (dict): Merged snapshot with the keys
+                ts (float):      Timestamp of the sweep
+                devices (list):  Devices of all FritzBoxes, tagged with the key 'box'
+                switches (list): Switch plugs and groups of all FritzBoxes, tagged with the key 'box'
+                errors (dict):   Error message for every FritzBox that failed
+        """
+
+        snapshot = {'ts' : time.time(),
+                    'devices' : [],
+                    'switches' : [],
+                    'errors' : {}}
+
+        futures = {}
+
+        for member in self.members:
+            if member.pending is not None and not member.pending.done():
+                snapshot['errors'][member.ip] = "Previous poll still in progress"
+            elif not member.breaker.allow_request():
+                snapshot['errors'][member.ip] = "Circuit breaker open"
+            else:
+                member.started_ts = None
+                member.pending = self._executor.submit(self._poll_member, member)
+
+                futures[member.pending] = member
+
+        waiting = set(futures)
+
+        while waiting:
+            now = time.monotonic()
+
+            deadlines = []
+
+            for future in list(waiting):
+                member = futures[future]
+
+                if member.started_ts is None:
+                    continue
+
+                if now - member.started_ts < self.timeout:
+                    deadlines.append(member.started_ts + self.timeout)
+
+                    continue
+
+                logger.error("FritzBox %s did not answer within %s seconds" % (member.ip, self.timeout))
+
+                member.breaker.record_failure()
+
+                snapshot['errors'][member.ip] = "Timeout"
+
+                waiting.discard(future)
+
+            # Workers still blocked by FritzBoxes that did not answer in this or a previous sweep
+            blocked = sum(1 for member in self.members
+                          if member.pending is not None and not member.pending.done() and member.pending not in waiting)
+
+            if blocked >= self.max_workers:
+                for future in list(waiting):
+                    if future.cancel():
+                        member = futures[future]
+
+                        logger.error("FritzBox %s was not polled, no free worker" % (member.ip))
+
+                        snapshot['errors'][member.ip] = "No free worker"
+
+                        waiting.discard(future)
+
+            if not waiting:
+                break
+
+            # Wake up at the next deadline, queued polls get their deadline once they started
+            timeout = min(deadlines) - now if deadlines else self.timeout
+
+            done, not_done = concurrent.futures.wait(waiting, timeout=max(timeout, 0),
+                                                     return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                waiting.discard(future)
+
+                member = futures[future]
+
+                try:
+                    devices, switches = future.result()
+                except Exception as e:
+                    logger.error("Polling of FritzBox %s failed: %s" % (member.ip, e))
+
+                    member.breaker.record_failure()
+
+                    snapshot['errors'][member.ip] = str(e)
+                else:
+                    member.breaker.record_success()
+
+                    snapshot['devices'].extend(devices)
+                    snapshot['switches'].extend(switches)
+
+        return snapshot
+
+
+    def _poll_member(self, member):
+        """Worker method polling a FritzBox, records the start of the poll for its timeout."""
+
+        member.started_ts = time.monotonic()
+
+        return member.poll()
+
+
+#===============================================================================
+# Main program
+#===============================================================================
+def main():
+    """Main function for testing purpose"""
+    boxes = [box.split(':', 1) for box in args.boxes]
+
+    fleet = FBFleet(boxes, timeout=args.timeout)
+
+    print(json.dumps(fleet.poll(), indent=4))
+
+    fleet.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+"""Module for recording the presence history of devices.
+
+This module provides a persistent store for the presence transitions of the devices known to a
+FritzBox together with methods for querying the history.
+"""
+
+import fritzbox._info
+
+__author__     = fritzbox._info.__author__
+__copyright__  = fritzbox._info.__copyright__
+__credits__    = fritzbox._info.__credits__
+__license__    = fritzbox._info.__license__
+__maintainer__ = fritzbox._info.__maintainer__
+__email__      = fritzbox._info.__email__
+
+
+#===============================================================================
+# Imports
+#===============================================================================
+import argparse
+import logging
+import sqlite3
+import time
+import threading
+
+import fritzbox.FBPresence
+
+
+#===============================================================================
+# Evaluate parameters
+#===============================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="%(prog)s [options]",
+                                     description="In case no option is selected the script will "
+                                     "return the last transition of all devices recorded in the history file. "
+                                     "If --mac is specified it will return the transitions of the device "
+                                     "together with its last presence and occupancy.")
+
+    parser.add_argument('--v1',
+                      help='Debug level INFO',
+                      dest='verbose_INFO',
+                      default=False,
+                      action='store_true')
+    parser.add_argument('--v2',
+                        help='Debug level ERROR',
+                        dest='verbose_ERROR',
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--v3',
+                        help='Debug level DEBUG',
+                        dest='verbose_DEBUG',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('-f',
+                        '--file',
+                        help='History file, eg. "presence.db"',
+                        dest='path',
+                        action='store',
+                        required=True)
+    parser.add_argument('-m',
+                        '--mac',
+                        help='MAC address of the device, eg. "AA:BB:CC:DD:EE:FF"',
+                        dest='mac',
+                        default=None,
+                        action='store')
+    parser.add_argument('-d',
+                        '--days',
+                        help='No. of days the transitions and the occupancy are evaluated for',
+                        dest='days',
+                        default=30,
+                        type=float,
+                        action='store')
+
+    args = parser.parse_args()
+
+
+#===============================================================================
+# Setup logger
+#===============================================================================
+if __name__ == '__main__':
+    log_level = logging.CRITICAL
+
+    if args.verbose_INFO:
+        log_level = logging.INFO
+
+    if args.verbose_ERROR:
+        log_level = logging.ERROR
+
+    if args.verbose_DEBUG:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(level=log_level,
+                        format="[{asctime}] - [{levelname}]: {message}",
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        style="{")
+
+logger = logging.getLogger(__name__)
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+# Max. no. of buffered transitions before they are written to the history file
+FLUSH_SIZE = 500
+
+# Max. time in seconds a transition is buffered before it is written to the history file
+FLUSH_INTERVAL = 30
+
+# Interval in seconds between two compactions of the history file
+COMPACT_INTERVAL = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    device TEXT PRIMARY KEY,
+    name   TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS transitions (
+    device  TEXT NOT NULL,
+    ts      REAL NOT NULL,
+    present INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS transitions_device_ts ON transitions (device, ts);
+CREATE INDEX IF NOT EXISTS transitions_ts ON transitions (ts);
+"""
+
+
+#===============================================================================
+# Method definitions
+#===============================================================================
+def device_key(mac):
+    """Return the key a device is recorded with in the history.
+
+    Args:
+        mac (str): MAC address of the device, or 'name:' followed by the name for devices
+                   without MAC address
+
+    Returns:
+        Key of the device.
+    """
+
+    if mac.startswith('name:'):
+        return mac
+
+    return fritzbox.FBPresence.normalize_mac(mac)
+
+
+#===============================================================================
+# Class definitions
+#===============================================================================
+class FBPresenceHistory(object):
+    """Persistent history of the presence transitions of devices.
+
+    The history is an append-only SQLite table holding one row per transition of a device
+    between present and absent. Devices are identified by their MAC address. Transitions are
+    buffered and written in a single transaction once flush_size transitions were collected or
+    flush_interval seconds passed.
+
+    With a retention in seconds the history is compacted every compact_interval seconds.
+    Compaction removes all transitions older than the retention except the last one of every
+    device, so that the state of a device at the start of the retention stays known.
+
+    Closing the history records all present devices as absent, because their presence cannot
+    be observed until the history is fed again. Attaching it again records the devices as
+    present that the FBPresence object already knows as present, e.g. after a restart with a
+    state file.
+    """
+
+    def __init__(self, path, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, retention=None,
+                 compact_interval=COMPACT_INTERVAL):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.compact_interval = compact_interval
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA)
+
+        self._lock = threading.RLock()
+        self._pending = []
+        self._names = {}
+        self._timer = None
+        self._compact_ts = time.time()
+
+        # Last recorded state of every device, used to drop transitions not changing it
+        self._states = dict(self._db.execute("SELECT device, present FROM transitions "
+                                             "WHERE rowid IN (SELECT MAX(rowid) FROM transitions GROUP BY device)"))
+
+
+    def attach(self, fbpresence):
+        """Record the presence transitions detected by a FBPresence object.
+
+        The presence supervision of the FBPresence object is started. Devices that are already
+        present are recorded as joined, they do not join again with the next poll.
+
+        Args:
+            fbpresence (fritzbox.FBPresence.FBPresence): FBPresence object
+
+        Returns:
+            subscription (fritzbox.FBPresence.FBEventSubscription): Handle to stop recording
+        """
+
+        return fbpresence.subscribe(self.record, (fritzbox.FBPresence.EVENT_JOINED,
+                                                  fritzbox.FBPresence.EVENT_LEFT), replay=True)
+
+
+    def record(self, event):
+        """Add the transition of a device to the history.
+
+        Args:
+            event (fritzbox.FBPresence.FBPresenceEvent): Joined or left event of the device
+
+        Returns:
+            Does not return any value.
+        """
+
+        if event.kind == fritzbox.FBPresence.EVENT_JOINED:
+            present = 1
+        elif event.kind == fritzbox.FBPresence.EVENT_LEFT:
+            present = 0
+        else:
+            return
+
+        device = event.mac if event.mac else 'name:' + event.name
+
+        with self._lock:
+            if self._states.get(device) == present:
+                return
+
+            self._states[device] = present
+            self._names[device] = event.name
+            self._pending.append((device, event.ts, present))
+
+            if len(self._pending) >= self.flush_size:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+
+    def flush(self):
+        """Write all buffered transitions to the history file.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if self._db is None:
+                return
+
+            if self._pending:
+                logger.debug("Write %d transitions to the presence history" % (len(self._pending)))
+
+                with self._db:
+                    self._db.executemany("INSERT OR REPLACE INTO devices (device, name) VALUES (?, ?)",
+                                         self._names.items())
+                    self._db.executemany("INSERT INTO transitions (device, ts, present) VALUES (?, ?, ?)",
+                                         self._pending)
+
+                self._pending = []
+                self._names = {}
+
+            if self.retention is not None and time.time() - self._compact_ts >= self.compact_interval:
+                self.compact(time.time() - self.retention)
+
+
+    def compact(self, before):
+        """Remove transitions that are older than the given timestamp.
+
+        The last transition of every device before the timestamp is kept.
+
+        Args:
+            before (float): Timestamp of the oldest transition that is kept completely
+
+        Returns:
+            removed (int): No. of removed transitions
+        """
+
+        with self._lock:
+            self._compact_ts = time.time()
+
+            with self._db:
+                cursor = self._db.execute("DELETE FROM transitions WHERE ts < ? AND rowid NOT IN "
+                                          "(SELECT MAX(rowid) FROM transitions WHERE ts < ? GROUP BY device)",
+                                          (before, before))
+
+            self._db.execute("PRAGMA incremental_vacuum")
+
+            logger.debug("Removed %d transitions from the presence history" % (cursor.rowcount))
+
+            return cursor.rowcount
+
+
+    def close(self, ts=None):
+        """Record all present devices as absent and close the history file.
+
+        Args:
+            ts (float): Timestamp of the recorded transitions, defaults to the current time
+
+        Returns:
+            Does not return any value.
+        """
+
+        if ts is None:
+            ts = time.time()
+
+        with self._lock:
+            for device, present in self._states.items():
+                if present:
+                    self._pending.append((device, ts, 0))
+
+            self.flush()
+
+            self._db.close()
+            self._db = None
+
+
+    def devices(self):
+        """Return all devices of the history.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            devices (dict): Last known name of every device, keyed by its MAC address
+        """
+
+        with self._lock:
+            self.flush()
+
+            return dict(self._db.execute("SELECT device, name FROM devices"))
+
+
+    def transitions(self, mac=None, start=None, end=None):
+        """Return the recorded transitions within a time range.
+
+        Args:
+            mac (str):     MAC address of the device, None for all devices
+            start (float): Timestamp of the start of the range, None for no limit
+            end (float):   Timestamp of the end of the range, None for no limit
+
+        Returns:
+            transitions (list): Tuples (mac, ts, present) ordered by their timestamp
+        """
+
+        query = "SELECT device, ts, present FROM transitions WHERE ts >= ? AND ts <= ?"
+        param = [start if start is not None else float('-inf'),
+                 end if end is not None else float('inf')]
+
+        if mac is not None:
+            query += " AND device = ?"
+            param.append(device_key(mac))
+
+        with self._lock:
+            self.flush()
+
+            return [(device, ts, bool(present))
+                    for device, ts, present in self._db.execute(query + " ORDER BY ts, rowid", param)]
+
+
+    def last_seen(self, mac, now=None):
+        """Return the time the device was present for the last time.
+
+        Args:
+            mac (str):   MAC address of the device
+            now (float): Timestamp returned if the device is present, defaults to the current time
+
+        Returns:
+            ts (float): Timestamp the device left, now if it is present, None if it is unknown
+        """
+
+        with self._lock:
+            self.flush()
+
+            row = self._db.execute("SELECT ts, present FROM transitions WHERE device = ? "
+                                   "ORDER BY ts DESC, rowid DESC LIMIT 1",
+                                   (device_key(mac),)).fetchone()
+
+        if row is None:
+            return None
+        elif row[1]:
+            return now if now is not None else time.time()
+        else:
+            return row[0]
+
+
+    def occupancy(self, start, end, macs=None):
+        """Calculate the time at least one of the devices was present within a time range.
+
+        Args:
+            start (float): Timestamp of the start of the range
+            end (float):   Timestamp of the end of the range
+            macs (list):   MAC addresses of the devices, None for all devices
+
+        Returns:
+            occupancy (float): Time in seconds at least one device was present
+        """
+
+        if macs is not None:
+            macs = set(device_key(mac) for mac in macs)
+
+        with self._lock:
+            self.flush()
+
+            # State of every device at the start of the range
+            initial = self._db.execute("SELECT device, present FROM transitions WHERE rowid IN "
+                                       "(SELECT MAX(rowid) FROM transitions WHERE ts < ? GROUP BY device)",
+                                       (start,)).fetchall()
+
+            changes = self._db.execute("SELECT device, ts, present FROM transitions "
+                                       "WHERE ts >= ? AND ts < ? ORDER BY ts, rowid",
+                                       (start, end)).fetchall()
+
+        states = {device : present for device, present in initial if macs is None or device in macs}
+
+        count = sum(states.values())
+        occupancy = 0
+        last_ts = start
+
+        for device, ts, present in changes:
+            if macs is not None and device not in macs:
+                continue
+
+            if count > 0:
+                occupancy += ts - last_ts
+
+            count += present - states.get(device, 0)
+            states[device] = present
+            last_ts = ts
+
+        if count > 0:
+            occupancy += end - last_ts
+
+        return occupancy
+
+
+#===============================================================================
+# Main program
+#===============================================================================
+def main():
+    """Main function for testing purpose"""
+    history = FBPresenceHistory(args.path)
+
+    end = time.time()
+    start = end - args.days * 24 * 60 * 60
+
+    if args.mac == None:
+        for device, name in history.devices().items():
+            print(device, name, history.last_seen(device, end))
+    else:
+        for transition in history.transitions(args.mac, start, end):
+            print(transition)
+
+        print("Last seen:", history.last_seen(args.mac, end))
+        print("Occupancy:", history.occupancy(start, end, [args.mac]) / (end - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,7 @@ import hashlib
 import re
 import json
 import time
+import concurrent.futures
 from xml.dom import minidom
 import xml.etree.ElementTree as ElementTree
 
@@ -71,6 +72,12 @@ if __name__ == '__main__':
                         default="password",
                         action='store',
                         required=True)
+    parser.add_argument('-s',
+                        '--socket',
+                        help='Path of the socket of a running FBDaemon, defaults to the socket of the FritzBox in the runtime directory',
+                        dest='socket',
+                        default=None,
+                        action='store')
 
     args = parser.parse_args()
 
@@ -106,6 +113,29 @@ logger = logging.getLogger(__name__)
 #===============================================================================
 # Constant declarations
 #===============================================================================
+HOMEAUTO_PAGE = '/webservices/homeautoswitch.lua'
+
+# Bits of the functionbitmask reported by getdevicelistinfos
+FUNCTION_ALARM_SENSOR       = 1 << 4
+FUNCTION_RADIATOR_REGULATOR = 1 << 6
+FUNCTION_ENERGY_METER       = 1 << 7
+FUNCTION_TEMPERATURE_SENSOR = 1 << 8
+FUNCTION_SWITCH_PLUG        = 1 << 9
+FUNCTION_DECT_REPEATER      = 1 << 10
+
+# Switch commands for the target states of set_switch_plug_state()
+SWITCH_COMMANDS = {'on' : 'setswitchon',
+                   'off' : 'setswitchoff'}
+
+# Default no. of switch commands sent to the FritzBox at the same time
+SWITCH_WORKERS = 4
+
+# Time in seconds the group memberships are cached by get_switch_groups()
+GROUP_CACHE_TTL = 5 * 60
+
+# Attributes of FBActor that can be selected when loading the device list
+ACTOR_FIELDS = frozenset(('name', 'productname', 'functionbitmask', 'members', 'present', 'switch_state',
+                          'power', 'energy', 'voltage', 'temperature'))
 
 
 #===============================================================================
@@ -116,17 +146,286 @@ class InvalidParameterError(Exception):
     pass
 
 
+#===============================================================================
+# Method definitions
+#===============================================================================
+def _parse_int(text):
+    """Convert the text of an XML element to int, None for empty or invalid values."""
+
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_group_members(actors):
+    """Map the groups of a device list to the AINs of their members.
+
+    Args:
+        actors (list): FBActor records as returned by FBHomeAuto.get_device_list_infos()
+
+    Returns:
+        groups (dict): AINs of the members keyed by the AIN of the group
+    """
+
+    ains = {actor.id : actor.ain for actor in actors if not actor.is_group}
+
+    return {actor.ain : [ains[member] for member in actor.members if member in ains]
+            for actor in actors if actor.is_group}
+
+
+def cover_with_groups(switch_plug_ains, groups):
+    """Select the AINs the switch commands for the given switch plugs are sent to.
+
+    Groups whose members are all part of the requested switch plugs replace their members,
+    larger groups first. Groups containing any other switch plug are never used.
+
+    Args:
+        switch_plug_ains (list): AINs of the switch plugs
+        groups (dict):           AINs of the members keyed by the AIN of the group
+
+    Returns:
+        targets (list): Tuples (ain, switch_plug_ains) of the AIN a command is sent to and
+                        the requested switch plugs covered by it
+    """
+
+    remaining = set(switch_plug_ains)
+    targets = []
+
+    for group_ain, members in sorted(groups.items(), key=lambda item: len(item[1]), reverse=True):
+        members = set(members)
+
+        if len(members) > 1 and members <= remaining:
+            targets.append((group_ain, [ain for ain in switch_plug_ains if ain in members]))
+
+            remaining -= members
+
+    targets.extend((ain, [ain]) for ain in switch_plug_ains if ain in remaining)
+
+    return targets
+
+
+def iter_device_list(chunks, fields=None):
+    """Parse the XML device list incrementally and yield the records of the actors.
+
+    The elements of an actor are discarded as soon as its record was created.
+
+    Args:
+        chunks (iterable): Parts of the <devicelist> XML page as bytes
+        fields (set):      Names of the FBActor attributes that shall be read out, all if None.
+
+    Returns:
+        Generator yielding a FBActor record for each actor and group.
+    """
+
+    parser = FBDeviceListParser(fields)
+
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+    parser.close()
+
+
 #===============================================================================
 # Class definitions
 #===============================================================================
+class FBDeviceListParser(object):
+    """Incremental parser of the XML device list returned by getdevicelistinfos.
+
+    The parts of the page are passed to feed() as they are received, it returns the records of
+    the actors completed by the part. This allows to parse the device list without a generator
+    reading the page, e.g. within an event loop.
+
+    Args:
+        fields (set): Names of the FBActor attributes that shall be read out, all if None.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = fields
+
+        self._parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        self._root = None
+        self._depth = 0
+
+
+    def feed(self, chunk):
+        """Parse the next part of the device list.
+
+        Args:
+            chunk (bytes): Part of the <devicelist> XML page
+
+        Returns:
+            List with a FBActor record for each actor and group completed by the part.
+        """
+
+        self._parser.feed(chunk)
+
+        actors = []
+
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                if self._root is None:
+                    self._root = element
+
+                self._depth += 1
+            else:
+                self._depth -= 1
+
+                if self._depth == 1 and element.tag in ('device', 'group'):
+                    actors.append(FBActor.from_element(element, self.fields))
+
+                    self._root.clear()
+
+        return actors
+
+
+    def close(self):
+        """Finish parsing, raises ElementTree.ParseError if the device list is incomplete.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        self._parser.close()
+
+
+class FBActor(object):
+    """Record of a home automation actor or group as reported by getdevicelistinfos.
+
+    Values the FritzBox reports as unknown or the actor does not support are None.
+
+    Attributes:
+        ain (str):             AIN of the actor without blanks, usable for the switch commands
+        id (int):              Internal id of the actor
+        name (str):            Name of the actor
+        productname (str):     Product name, e.g. 'FRITZ!DECT 200'
+        functionbitmask (int): Function classes of the actor, see the FUNCTION_* constants
+        is_group (bool):       True if the record describes a group of actors
+        members (list):        Internal ids of the group members
+        present (bool):        True if the actor is connected to the FritzBox
+        switch_state (bool):   True if the switch is on
+        power (int):           Current power in mW
+        energy (int):          Energy consumed since commissioning in Wh
+        voltage (int):         Current voltage in mV
+        temperature (float):   Temperature in degree Celsius
+    """
+
+    __slots__ = ('ain', 'id', 'name', 'productname', 'functionbitmask', 'is_group', 'members',
+                 'present', 'switch_state', 'power', 'energy', 'voltage', 'temperature')
+
+    def __init__(self, ain, id, name='', productname='', functionbitmask=0, is_group=False, members=None,
+                 present=None, switch_state=None, power=None, energy=None, voltage=None, temperature=None):
+        self.ain = ain
+        self.id = id
+        self.name = name
+        self.productname = productname
+        self.functionbitmask = functionbitmask
+        self.is_group = is_group
+        self.members = members if members is not None else []
+        self.present = present
+        self.switch_state = switch_state
+        self.power = power
+        self.energy = energy
+        self.voltage = voltage
+        self.temperature = temperature
+
+
+    def __repr__(self):
+        return "FBActor(%s)" % ', '.join('%s=%r' % (key, getattr(self, key)) for key in self.__slots__)
+
+
+    def has_function(self, function):
+        """Check if the actor supports the given function class.
+
+        Args:
+            function (int): One of the FUNCTION_* constants
+
+        Returns:
+            True if the function class is supported, False otherwise.
+        """
+
+        return bool(self.functionbitmask & function)
+
+
+    @classmethod
+    def from_element(cls, element, fields=None):
+        """Create the record from a <device> or <group> element of the device list.
+
+        Args:
+            element (xml.etree.ElementTree.Element): <device> or <group> element
+            fields (set): Names of the attributes that shall be read out of the element, all
+                          attributes if None. ain, id and is_group are always read out.
+
+        Returns:
+            actor (fritzbox.FBHomeAuto.FBActor): Record of the actor
+        """
+
+        actor = cls(ain=element.get('identifier', '').replace(' ', ''),
+                    id=_parse_int(element.get('id')),
+                    is_group=element.tag == 'group')
+
+        if fields is None:
+            fields = ACTOR_FIELDS
+
+        if 'name' in fields:
+            actor.name = element.findtext('name', '')
+
+        if 'productname' in fields:
+            actor.productname = element.get('productname', '')
+
+        if 'functionbitmask' in fields:
+            actor.functionbitmask = _parse_int(element.get('functionbitmask')) or 0
+
+        if 'present' in fields:
+            present = _parse_int(element.findtext('present'))
+
+            if present is not None:
+                actor.present = present == 1
+
+        if 'switch_state' in fields:
+            switch_state = _parse_int(element.findtext('switch/state'))
+
+            if switch_state is not None:
+                actor.switch_state = switch_state == 1
+
+        if 'power' in fields:
+            actor.power = _parse_int(element.findtext('powermeter/power'))
+
+        if 'energy' in fields:
+            actor.energy = _parse_int(element.findtext('powermeter/energy'))
+
+        if 'voltage' in fields:
+            actor.voltage = _parse_int(element.findtext('powermeter/voltage'))
+
+        if 'temperature' in fields:
+            celsius = _parse_int(element.findtext('temperature/celsius'))
+
+            if celsius is not None:
+                actor.temperature = celsius / 10
+
+        if 'members' in fields:
+            members = element.findtext('groupinfo/members')
+
+            if members:
+                actor.members = [_parse_int(member) for member in members.split(',')]
+
+        return actor
+
+
 class FBHomeAuto(object):
     """Interface for communication with a FritzBox.
 
     This class provides an interface for communication with a FritzBox using LUA pages.
     """
 
-    def __init__(self, ip, password):
-        self.fb = fritzbox.FBCore.FritzBox(ip, password)
+    def __init__(self, ip, password, port=fritzbox.FBCore.HTTP_PORT, session_store=None):
+        self.fb = fritzbox.FBCore.FritzBox(ip, password, port=port, session_store=session_store)
+
+        self._groups = None
+        self._groups_ts = 0
 
 
     def __del__(self):
@@ -143,18 +442,94 @@ class FBHomeAuto(object):
             Does not require any arguments.
 
         Returns:
-            Returns a list with all AINs of registered switch plugs
+            Returns a list with all AINs of registered switch plugs, None if the list could not
+            be loaded
         """
 
         logger.debug("Load the AINs of all available switch plugs from the FritzBox")
 
-        page = self.fb.load_fritzbox_page('/webservices/homeautoswitch.lua', '&switchcmd=getswitchlist')
+        page = self.fb.load_fritzbox_page(HOMEAUTO_PAGE, '&switchcmd=getswitchlist')
+
+        if page is None:
+            return None
 
         switch_plugs = page.decode('UTF-8').strip('\n').split(',')
 
         return switch_plugs
 
 
+    def get_device_list_infos(self, fields=None):
+        """Load the state of all home automation actors and groups with a single request.
+
+        This method uses the command getdevicelistinfos which reports switch state, power, energy,
+        temperature and presence of all actors at once.
+
+        Args:
+            fields (set): Names of the FBActor attributes that shall be read out, all if None.
+                          See ACTOR_FIELDS for the available attributes.
+
+        Returns:
+            Returns a list of FBActor records, one for each actor and group. None if the device
+            list could not be loaded.
+        """
+
+        logger.debug("Load the information of all actors from the FritzBox")
+
+        response = self.fb.open_fritzbox_page(HOMEAUTO_PAGE, '&switchcmd=getdevicelistinfos')
+
+        if response is None:
+            return None
+
+        with response:
+            return list(self._iter_device_list(response.iter_chunks(), fields))
+
+
+    def iter_device_list_infos(self, fields=None):
+        """Load the state of all home automation actors and groups while the list is received.
+
+        This method works like get_device_list_infos() but yields each record as soon as its
+        XML element was received from the FritzBox. The device list is never held in memory
+        completely.
+
+        Args:
+            fields (set): Names of the FBActor attributes that shall be read out, all if None.
+                          See ACTOR_FIELDS for the available attributes.
+
+        Returns:
+            Generator yielding a FBActor record for each actor and group.
+        """
+
+        logger.debug("Stream the information of all actors from the FritzBox")
+
+        response = self.fb.open_fritzbox_page(HOMEAUTO_PAGE, '&switchcmd=getdevicelistinfos')
+
+        if response is None:
+            return
+
+        with response:
+            yield from self._iter_device_list(response.iter_chunks(), fields)
+
+
+    def _parse_device_list(self, page, fields=None):
+        """Create the FBActor records from the XML device list returned by getdevicelistinfos.
+
+        Args:
+            page (bytes): <devicelist> XML page
+            fields (set): Names of the FBActor attributes that shall be read out, all if None.
+
+        Returns:
+            Returns a list of FBActor records, one for each actor and group
+        """
+
+        return list(self._iter_device_list([page], fields))
+
+
+    def _iter_device_list(self, chunks, fields=None):
+        """Parse the XML device list incrementally, see iter_device_list()."""
+
+        return iter_device_list(chunks, fields)
+
+
     def get_switch_plug_state(self, switch_plug_ain):
         """Load the switch state of the given switch plug from the FritzBox.
 
@@ -164,14 +539,17 @@ class FBHomeAuto(object):
             switch_plug_ain (str):    The AIN of the switch plug that should be checked
 
         Returns:
-            Returns the state of the switch plug
+            Returns the state of the switch plug, None if the state could not be loaded
         """
 
         logger.debug("Load the switch state of the given switch plug from the FritzBox")
 
-        page = self.fb.load_fritzbox_page('/webservices/homeautoswitch.lua', '&switchcmd=getswitchstate&ain=' +
+        page = self.fb.load_fritzbox_page(HOMEAUTO_PAGE, '&switchcmd=getswitchstate&ain=' +
                                         switch_plug_ain)
 
+        if page is None:
+            return None
+
         switch_plug_state = page.decode('UTF-8').strip('\n')
 
         return switch_plug_state
@@ -183,29 +561,118 @@ class FBHomeAuto(object):
         This method sets the switch state of the requested switch plug.
 
         Args:
-            switch_plug_ain (str): The AIN of the switch plug that should be set
+            switch_plug_ain (str): The AIN of the switch plug or group that should be set
             state (str):           Target state 'on' or 'off'
 
         Returns:
-            Does not return any value.
+            Returns the new state of the switch plug, None if the command failed
+
+        Raises:
+            InvalidParameterError: The target state is neither 'on' nor 'off'
         """
 
         logger.debug("Set the switch state for a given switch plug using the FritzBox")
 
-        if state == 'on':
-            page = self.fb.loadFritzBoxPage('/webservices/homeautoswitch.lua', '&switchcmd=setswitchon&ain=' +
-                                            switch_plug_ain)
-        elif state == 'off':
-            page = self.fb.loadFritzBoxPage('/webservices/homeautoswitch.lua', '&switchcmd=setswitchoff&ain=' +
-                                            switch_plug_ain)
-        else:
-            pass
+        if state not in SWITCH_COMMANDS:
+            raise InvalidParameterError()
+
+        page = self.fb.load_fritzbox_page(HOMEAUTO_PAGE, '&switchcmd=' + SWITCH_COMMANDS[state] + '&ain=' +
+                                          switch_plug_ain)
+
+        if page is None:
+            return None
 
         switch_plug_state = page.decode('UTF-8').strip('\n')
 
         return switch_plug_state
 
 
+    def set_switch_plugs_state(self, switch_plug_ains, state, max_workers=SWITCH_WORKERS, use_groups=True):
+        """Set the switch state of many switch plugs at once.
+
+        The commands are sent concurrently, but never more than max_workers at the same time.
+        If use_groups is set, switch plugs forming a complete group are switched with a single
+        command for the group, see cover_with_groups().
+
+        Args:
+            switch_plug_ains (list): The AINs of the switch plugs that should be set
+            state (str):             Target state 'on' or 'off'
+            max_workers (int):       Max. no. of commands sent at the same time
+            use_groups (bool):       Switch complete groups with a single command
+
+        Returns:
+            results (dict): New state of every switch plug as returned by set_switch_plug_state(),
+                            keyed by its AIN
+
+        Raises:
+            InvalidParameterError: The target state is neither 'on' nor 'off'
+        """
+
+        if state not in SWITCH_COMMANDS:
+            raise InvalidParameterError()
+
+        switch_plug_ains = list(dict.fromkeys(switch_plug_ains))
+
+        if not switch_plug_ains:
+            return {}
+
+        if use_groups:
+            targets = cover_with_groups(switch_plug_ains, self.get_switch_groups())
+        else:
+            targets = [(ain, [ain]) for ain in switch_plug_ains]
+
+        logger.debug("Set the switch state of %d switch plugs with %d commands" % (len(switch_plug_ains),
+                                                                                 len(targets)))
+
+        # Login once instead of letting every worker discover the missing session, a login of
+        # another thread using the same FritzBox object is shared
+        self.fb.ensure_session()
+
+        results = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as executor:
+            futures = {executor.submit(self.set_switch_plug_state, ain, state) : covered
+                       for ain, covered in targets}
+
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    switch_plug_state = future.result()
+                except Exception as e:
+                    logger.error("Switch command failed: %s" % (e))
+
+                    switch_plug_state = None
+
+                for ain in futures[future]:
+                    results[ain] = switch_plug_state
+
+        return {ain : results[ain] for ain in switch_plug_ains}
+
+
+    def get_switch_groups(self):
+        """Load the groups of switch plugs from the FritzBox.
+
+        The groups are cached for GROUP_CACHE_TTL seconds.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            groups (dict): AINs of the members keyed by the AIN of the group, empty if the
+                           device list could not be loaded
+        """
+
+        if self._groups is None or time.time() - self._groups_ts >= GROUP_CACHE_TTL:
+            actors = self.get_device_list_infos(fields={'members'})
+
+            if actors is None:
+                return {}
+
+            self._groups = get_group_members(actors)
+            self._groups_ts = time.time()
+
+        return self._groups
+
+
     def toggle_switch_plug_state(self, switch_plug_ain):
         """Toggle the state of the given switch plug.
 
@@ -215,13 +682,16 @@ class FBHomeAuto(object):
             switch_plug_ain (str): The AIN of the switch plug that should be set
 
         Returns:
-            Does not return any value.
+            Returns the new state of the switch plug, None if the command failed
         """
 
         logger.debug("Toggle the switch state for a given switch plug using the FritzBox")
 
-        page = self.fb.loadFritzBoxPage('/webservices/homeautoswitch.lua', '&switchcmd=setswitchtoggle&ain=' +
-                                        switch_plug_ain)
+        page = self.fb.load_fritzbox_page(HOMEAUTO_PAGE, '&switchcmd=setswitchtoggle&ain=' +
+                                          switch_plug_ain)
+
+        if page is None:
+            return None
 
         switch_plug_state = page.decode('UTF-8').strip('\n')
 
@@ -233,9 +703,20 @@ class FBHomeAuto(object):
 #===============================================================================
 def main():
     """Main function for testing purpose"""
-    fb_ha = FBHomeAuto(ip=args.ip, password=args.password)
+    # Imported here as FBDaemon depends on this module
+    import fritzbox.FBDaemon
+
+    path = args.socket or fritzbox.FBDaemon.default_socket_path(args.ip)
+
+    # Answer from a running daemon, otherwise ask the FritzBox directly
+    answered, switch_plugs = fritzbox.FBDaemon.try_query_daemon(path, 'switch_plugs')
+
+    if not answered:
+        fb_ha = FBHomeAuto(ip=args.ip, password=args.password,
+                           session_store=fritzbox.FBCore.FBSessionStore())
+
+        switch_plugs = fb_ha.get_switch_plugs()
 
-    switch_plugs = fb_ha.get_switch_plugs()
     print(switch_plugs)
 
 
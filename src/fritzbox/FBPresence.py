@@ -19,17 +19,21 @@ __email__      = fritzbox._info.__email__
 #===============================================================================
 import argparse
 import logging
+import sys
 import urllib.request
 import hashlib
 import re
 import json
+import os
 import time
 from xml.dom import minidom
 import xml.etree.ElementTree as ElementTree
 import collections
 import threading
+import queue
 
 import fritzbox.FBCore
+import fritzbox.FBTR064
 
 
 #===============================================================================
@@ -79,6 +83,28 @@ if __name__ == '__main__':
                         help='Check presence of device identified by its name registered on the FritzBox',
                         dest='name',
                         action='store')
+    parser.add_argument('-m',
+                        '--mac',
+                        help='Check presence of device identified by its MAC address, eg. "AA:BB:CC:DD:EE:FF"',
+                        dest='mac',
+                        action='store')
+    parser.add_argument('--ip-address',
+                        help='Check presence of device identified by its IP address, eg. "192.168.0.20"',
+                        dest='device_ip',
+                        action='store')
+    parser.add_argument('-s',
+                        '--socket',
+                        help='Path of the socket of a running FBDaemon, defaults to the socket of the FritzBox in the runtime directory',
+                        dest='socket',
+                        default=None,
+                        action='store')
+    parser.add_argument('-b',
+                        '--backend',
+                        help='Interface for loading the device list, "lua" or "tr064"',
+                        dest='backend',
+                        default='lua',
+                        choices=['lua', 'tr064'],
+                        action='store')
 
     args = parser.parse_args()
 
@@ -114,12 +140,47 @@ logger = logging.getLogger(__name__)
 #===============================================================================
 # Constant declarations
 #===============================================================================
+WLAN_DEVICE_PAGE  = '/data.lua'
+WLAN_DEVICE_PARAM = '&lang=de&no_sidrenew=&page=wSet'
 
+# Backends for loading the device list, see FBPresence
+BACKEND_LUA   = 'lua'
+BACKEND_TR064 = 'tr064'
 
-#===============================================================================
-# Global variables
-#===============================================================================
-device_states = collections.defaultdict(dict)
+# Connection type of WLAN devices as reported by data.lua
+CONN_TYPE_WLAN = 'wlan'
+
+# Size in bytes of the fingerprint of the WLAN page used to detect unchanged device lists
+PAGE_DIGEST_SIZE = 16
+
+# Default interval in seconds between two polls of the presence supervision
+POLL_INTERVAL = 10
+
+# Defaults of the adaptive poll interval, see FBAdaptivePollInterval
+POLL_INTERVAL_MIN = 2
+POLL_INTERVAL_MAX = 120
+POLL_BACKOFF_FACTOR = 2
+POLL_FAST_PERIOD = 60
+
+# Default retention of device records, see FBPresence
+DEVICE_TTL = 7 * 24 * 60 * 60
+MAX_DEVICES = 1024
+
+# Max. age in seconds of a state file that is loaded at startup, see FBPresence
+STATE_MAX_AGE = 15 * 60
+
+# Interval in seconds between two saves of the state file by the presence supervision
+STATE_SAVE_INTERVAL = 60
+
+STATE_VERSION = 1
+
+# Kinds of events emitted by FBPresenceDiff
+EVENT_JOINED  = 'joined'
+EVENT_LEFT    = 'left'
+EVENT_CHANGED = 'changed'
+
+# Device attributes compared by FBPresenceDiff to detect changed devices
+DIFF_ATTRIBUTES = ('name', 'ip', 'conn_type')
 
 
 #===============================================================================
@@ -133,46 +194,25 @@ class InvalidParameterError(Exception):
 #===============================================================================
 # Method definitions
 #===============================================================================
-def _supervise_device_presence_changes(fbpresence, device, callback):
-    """Thread method for the presence supervision
-
-    The callback function needs to implement the following signature:
-        callback(device, old_state, new_state):
-            device (str): Device name
-            old_state (bool): True=present, False=absent
-            new_state (bool): True=present, False=absent
+def normalize_mac(mac):
+    """Bring a MAC address into the format used as lookup key, e.g. 'AA:BB:CC:DD:EE:FF'.
 
     Args:
-        fbpresence (fritzbox.FBPresence.FBPresence): FBPresence object
-        device (str): Name of a device registered to the Fritz!Box WLAN
-        callback (function): Reference to a function that shall be called
-            everytime the device state changes.
-    """
-
-    global device_states
-
-    if device not in device_states.keys():
-        old_state = fbpresence.is_device_present(device_name=device)
-    else:
-        old_state = device_states[device]
-
-    while True:
-        new_state = fbpresence.is_device_present(device_name=device)
+        mac (str): MAC address using ':' or '-' as separator
 
-        if new_state != old_state:
-            callback(device,
-                     old_state,
-                     new_state)
+    Returns:
+        Normalized MAC address.
+    """
 
-        old_state = new_state
-        device_states[device] = new_state
+    return mac.replace('-', ':').upper()
 
 
 def start_device_presence_supervision(fbpresence, device, callback):
     """Start a presence supervision for a device
 
     Registers a callback that will be called everytime the presence state
-    of a device changes.
+    of a device changes. All devices of a FBPresence object are supervised
+    by its single supervisor thread, see FBPresenceSupervisor.
 
     The callback function needs to implement the following signature:
         callback(device, old_state, new_state):
@@ -187,129 +227,1268 @@ def start_device_presence_supervision(fbpresence, device, callback):
             everytime the device state changes.
 
     Returns:
-        thread (threading.Thread): Thread created for the supervision
+        handle (fritzbox.FBPresence.FBSupervisionHandle): Handle to unregister
+            the callback again
 
     Examples:
+        handle = start_device_presence_supervision(fb_p, 'iphone', alert_change)
         ...
+        handle.unregister()
     """
 
-    t = threading.Thread(target=_supervise_device_presence_changes,
-                         args=(fbpresence, device, callback),
-                         daemon=True)
-
-    t.start()
+    return fbpresence.supervise_device(device, callback)
 
 
 #===============================================================================
 # Class definitions
 #===============================================================================
-class FBPresence(object):
-    """Interface for communication with a FritzBox.
+class FBDevice(object):
+    """Record of a device known to the FritzBox.
 
-    This class provides an interface for communication with a FritzBox using LUA pages.
+    The attributes can also be read using the dictionary notation, e.g. device['on_ts'].
     """
 
-    def __init__(self, ip, password):
-        self.fb = fritzbox.FBCore.FritzBox(ip, password)
+    __slots__ = ('name', 'mac', 'ip', 'conn_type', 'on_ts')
 
-        self.device_list = {}
-        self.chk_ts = 0
+    def __init__(self, name, mac, ip, conn_type, on_ts):
+        self.name = name
+        self.mac = mac
+        self.ip = ip
+        self.conn_type = conn_type
+        self.on_ts = on_ts
 
 
-    def __del__(self):
-        pass
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
 
 
-    def is_device_present(self, device_name=None, debounce_off=0):
-        """Check if the given device is currently in WLAN access range -> device is present.
+    def __repr__(self):
+        return "FBDevice(name=%r, mac=%r, ip=%r, conn_type=%r, on_ts=%r)" % (self.name,
+                                                                           self.mac,
+                                                                           self.ip,
+                                                                           self.conn_type,
+                                                                           self.on_ts)
 
-        The method checks if the specified device is currently in WLAN access range of the FritzBox
-        to determine if it is present or not. You can optionally specify a debounce time for the transition
-        to the absent state. This is helpful if you observe sporadic absent detections e.g. for iPhone
-        devices.
+
+class FBSupervisionHandle(object):
+    """Registration of a callback with the presence supervision."""
+
+    def __init__(self, supervisor, device, callback):
+        self.supervisor = supervisor
+        self.device = device
+        self.callback = callback
+
+
+    def unregister(self):
+        """Stop calling the callback for presence changes of the device.
 
         Args:
-            device_name (str): Device that shall be checked.
-            debounce_off (int):  Debounce transition to absent by this no. of minutes
+            Does not require any arguments.
 
         Returns:
-            If the device is registered with the FritzBox the method will return True if the device is present,
-            False otherwise.
+            Does not return any value.
         """
 
-        devices, chk_ts = self.get_wlan_device_information()
+        self.supervisor.unregister(self)
 
-        if device_name is not None:
-            logger.debug("Check if the device " + device_name + " is present")
 
-            if device_name in devices:
-                if chk_ts - devices[device_name]['on_ts'] == 0:
-                    # Device is present
-                    return True
-                elif chk_ts - devices[device_name]['on_ts'] <= 60 * debounce_off:
-                    # Device is absent less than the defined debounce time
-                    return True
-                else:
-                    # Device is absent for more than the defined debounce time
-                    return False
-            else:
-                # Device is not listed and therefore not present
-                return False
+class FBPresenceEvent(object):
+    """Presence change of a device detected by FBPresenceDiff.
+
+    The event holds the attributes of the device at the time of the poll. For changed events
+    the dictionary changes maps every changed attribute to a tuple (old value, new value).
+    """
+
+    __slots__ = ('kind', 'mac', 'name', 'ip', 'conn_type', 'ts', 'changes')
+
+    def __init__(self, kind, mac, name, ip, conn_type, ts, changes=None):
+        self.kind = kind
+        self.mac = mac
+        self.name = name
+        self.ip = ip
+        self.conn_type = conn_type
+        self.ts = ts
+        self.changes = changes if changes is not None else {}
+
+
+    def __repr__(self):
+        return "FBPresenceEvent(kind=%r, mac=%r, name=%r, ip=%r, conn_type=%r, ts=%r, changes=%r)" % (self.kind,
+                                                                                                   self.mac,
+                                                                                                   self.name,
+                                                                                                   self.ip,
+                                                                                                   self.conn_type,
+                                                                                                   self.ts,
+                                                                                                   self.changes)
+
+
+class FBEventSubscription(object):
+    """Registration of a subscriber with FBPresenceDiff."""
+
+    def __init__(self, diff, callback, kinds=None):
+        self.diff = diff
+        self.callback = callback
+        self.kinds = kinds
+
+
+    def unregister(self):
+        """Stop calling the callback for presence events.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        self.diff.unsubscribe(self)
+
+
+class FBPresenceDiff(object):
+    """Engine detecting presence changes between two successive device lists.
+
+    The engine keeps the attributes of all present devices keyed by their MAC address and
+    compares them with every new device list in O(n). A device is present if it was seen by the
+    last poll or is absent for less than its debounce time. The debounce time in minutes is
+    debounce_off unless set_debounce() configured a different one for the device.
+
+    The first device list emits a joined event for every present device.
+    """
+
+    def __init__(self, debounce_off=0):
+        self.debounce_off = debounce_off
+        self.delivered = 0
+
+        self.present = {}
+
+        self._debounce = {}
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+
+    def set_debounce(self, mac, debounce_off):
+        """Configure the debounce time of a single device.
+
+        Args:
+            mac (str):          MAC address of the device
+            debounce_off (int): Debounce transition to absent by this no. of minutes, None to
+                                use the default of the engine
+
+        Returns:
+            Does not return any value.
+        """
+
+        if debounce_off is None:
+            self._debounce.pop(normalize_mac(mac), None)
         else:
+            self._debounce[normalize_mac(mac)] = debounce_off
+
+
+    def subscribe(self, callback, kinds=None, replay=False):
+        """Register a callback for presence events.
+
+        The callback function needs to implement the following signature:
+            callback(event):
+                event (fritzbox.FBPresence.FBPresenceEvent): Detected presence change
+
+        With replay the callback first receives a joined event for every device that is already
+        present, e.g. after the presence states were restored from a state file. These devices
+        do not join again with the next poll.
+
+        Args:
+            callback (function): Reference to a function that shall be called for every event
+            kinds (tuple):       Kinds of events passed to the callback, None for all kinds
+            replay (bool):       Report the devices that are already present as joined
+
+        Returns:
+            subscription (fritzbox.FBPresence.FBEventSubscription): Handle to unregister the
+                callback again
+        """
+
+        subscription = FBEventSubscription(self, callback, kinds)
+
+        with self._lock:
+            self._subscriptions.append(subscription)
+
+            if replay and (kinds is None or EVENT_JOINED in kinds):
+                ts = time.time()
+
+                # Delivered under the lock, so no event of a later poll can overtake them
+                for old in self.present.values():
+                    self.delivered += 1
+
+                    try:
+                        callback(FBPresenceEvent(EVENT_JOINED, *old, ts=ts))
+                    except Exception:
+                        logger.exception("Presence event callback for device " + old[1] + " failed")
+
+        return subscription
+
+
+    def unsubscribe(self, subscription):
+        """Remove a callback registered with subscribe().
+
+        Args:
+            subscription (fritzbox.FBPresence.FBEventSubscription): Handle returned by subscribe()
+
+        Returns:
+            Does not return any value.
+        """
+
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+
+    def has_subscribers(self):
+        """Check if any callback is subscribed to the engine.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            True if at least one subscription exists, False otherwise.
+        """
+
+        with self._lock:
+            return len(self._subscriptions) > 0
+
+
+    def iter_events(self, kinds=None, timeout=None):
+        """Iterate over the presence events emitted by subsequent polls.
+
+        Args:
+            kinds (tuple):   Kinds of events returned, None for all kinds
+            timeout (float): Max. time in seconds to wait for the next event, None to wait forever
+
+        Returns:
+            Generator returning fritzbox.FBPresence.FBPresenceEvent objects. The generator ends
+            if no event was emitted within timeout seconds. Events are collected from the call
+            on, close the generator to stop collecting them.
+        """
+
+        events = queue.Queue()
+
+        subscription = self.subscribe(events.put, kinds)
+
+        return self._iter_queue(events, subscription, timeout)
+
+
+    def _iter_queue(self, events, subscription, timeout):
+        """Generator returning the events collected for a subscription."""
+
+        try:
+            while True:
+                try:
+                    yield events.get(timeout=timeout)
+                except queue.Empty:
+                    return
+        finally:
+            subscription.unregister()
+
+
+    def update(self, devices, chk_ts):
+        """Compare the device list with the previous one and notify the subscribers.
+
+        Args:
+            devices (iterable): Tuples (key, device) of all known devices, the key being the MAC
+                                address of the device or any other unique identifier
+            chk_ts (float):     Timestamp of the poll the device list belongs to
+
+        Returns:
+            events (list): fritzbox.FBPresence.FBPresenceEvent objects emitted by the poll
+        """
+
+        events = []
+
+        with self._lock:
+            present = {}
+
+            for key, device in devices:
+                debounce_off = self._debounce.get(device.mac, self.debounce_off)
+
+                if chk_ts - device.on_ts > 60 * debounce_off:
+                    continue
+
+                attributes = (device.name, device.ip, device.conn_type)
+
+                present[key] = (device.mac,) + attributes
+
+                old = self.present.pop(key, None)
+
+                if old is None:
+                    events.append(FBPresenceEvent(EVENT_JOINED, device.mac, *attributes, ts=chk_ts))
+                elif old[1:] != attributes:
+                    changes = {name : (old_value, new_value)
+                               for name, old_value, new_value in zip(DIFF_ATTRIBUTES, old[1:], attributes)
+                               if old_value != new_value}
+
+                    events.append(FBPresenceEvent(EVENT_CHANGED, device.mac, *attributes, ts=chk_ts,
+                                                  changes=changes))
+
+            # Devices remaining from the previous poll are absent or were evicted
+            for old in self.present.values():
+                events.append(FBPresenceEvent(EVENT_LEFT, *old, ts=chk_ts))
+
+            self.present = present
+
+            subscriptions = list(self._subscriptions)
+
+            # Counted under the lock, update() may run concurrently in several threads
+            self.delivered += sum(1 for event in events for subscription in subscriptions
+                                  if subscription.kinds is None or event.kind in subscription.kinds)
+
+        for event in events:
+            for subscription in subscriptions:
+                if subscription.kinds is not None and event.kind not in subscription.kinds:
+                    continue
+
+                try:
+                    subscription.callback(event)
+                except Exception:
+                    logger.exception("Presence event callback for device " + event.name + " failed")
+
+        return events
+
+
+class FBAdaptivePollInterval(object):
+    """Poll interval of the presence supervision that adapts to the observed changes.
+
+    While no device changes its presence state the interval grows by backoff_factor after
+    every poll up to max_interval. After a presence change the interval drops to min_interval
+    and stays there for fast_period seconds.
+    """
+
+    def __init__(self, min_interval=POLL_INTERVAL_MIN, max_interval=POLL_INTERVAL_MAX,
+                 backoff_factor=POLL_BACKOFF_FACTOR, fast_period=POLL_FAST_PERIOD):
+        if min_interval <= 0 or max_interval < min_interval or backoff_factor < 1:
             raise InvalidParameterError()
 
-        return False
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.fast_period = fast_period
 
+        self.interval = min_interval
+        self.fast_until = 0
+        self.polls = 0
+        self.changes = 0
 
-    def get_wlan_device_information(self):
-        """Query WLAN information for all FritzBox known devices.
 
-        The method queries all WLAN related information for all devices known to the FritzBox.
+    def update(self, changed, now=None):
+        """Calculate the interval until the next poll.
 
         Args:
-            None
+            changed (bool): True if the last poll detected a presence change
+            now (float):    Timestamp of the last poll, defaults to the current time
 
         Returns:
-            device_list (List): List with all devices and information as two-dimensional matrix. The
-                                parameters for each device are accessible using the index
-                                FB_WLAN_DEV_INFO elements.
+            interval (float): Time in seconds until the next poll
+        """
 
-            chk_ts (float):    Timestamp of the last presence check
+        if now is None:
+            now = time.time()
+
+        self.polls += 1
+
+        if changed:
+            self.changes += 1
+            self.fast_until = now + self.fast_period
+
+        if now < self.fast_until:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff_factor, self.max_interval)
+
+        return self.interval
+
+
+    def get_metrics(self):
+        """Return the current state of the poll interval.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            metrics (dict): Current interval, its limits and the no. of polls and changes seen
         """
 
-        logger.debug("Load WLAN device information from the FritzBox for all known devices")
+        return {'interval' : self.interval,
+                'min_interval' : self.min_interval,
+                'max_interval' : self.max_interval,
+                'backoff_factor' : self.backoff_factor,
+                'fast_until' : self.fast_until,
+                'polls' : self.polls,
+                'changes' : self.changes}
 
-        self.chk_ts = time.time()
 
-        page = self.fb.load_fritzbox_page('/data.lua', 'lang=de&no_sidrenew=&page=wSet')
+class FBPresenceSupervisor(object):
+    """Supervision of the presence state of registered devices.
 
-        json_structure = json.loads(page.decode('UTF-8'))
+    A single thread loads the device list from the FritzBox once per poll interval and
+    calls the callbacks of all registered devices whose presence state changed. Each poll also
+    feeds the presence events of the FBPresence object. The poll interval is either a fixed no.
+    of seconds or a FBAdaptivePollInterval object.
+    """
 
-        json_structure_devices = json_structure['data']['net']['devices']
+    def __init__(self, fbpresence, poll_interval=POLL_INTERVAL, debounce_off=0):
+        self.fbpresence = fbpresence
+        self.poll_interval = poll_interval
+        self.debounce_off = debounce_off
 
-        for i in range(len(json_structure_devices)):
-            name = json_structure_devices[i]['name']
-            on_ts = self.chk_ts
+        self.device_states = {}
 
-            self.device_list[name] = {'on_ts' : on_ts}
+        self._handles = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
 
-        return self.device_list, self.chk_ts
 
+    def register(self, device, callback):
+        """Register a callback for presence changes of a device and start the supervision.
 
-#===============================================================================
-# Main program
-#===============================================================================
-def main():
-    """Main function for testing purpose"""
-    fb_p = FBPresence(ip=args.ip, password=args.password)
+        The callback function needs to implement the following signature:
+            callback(device, old_state, new_state):
+                device (str): Device name
+                old_state (bool): True=present, False=absent
+                new_state (bool): True=present, False=absent
 
-    if args.name == None:
-        devices, chk_ts = fb_p.get_wlan_device_information()
+        Args:
+            device (str): Name of a device registered to the Fritz!Box WLAN
+            callback (function): Reference to a function that shall be called
+                everytime the device state changes.
 
-        print(devices)
+        Returns:
+            handle (fritzbox.FBPresence.FBSupervisionHandle): Handle to unregister
+                the callback again
+        """
+
+        handle = FBSupervisionHandle(self, device, callback)
+
+        with self._lock:
+            self._handles[device].append(handle)
+
+        self.start()
+
+        return handle
+
+
+    def unregister(self, handle):
+        """Remove a callback registered with register().
+
+        Args:
+            handle (fritzbox.FBPresence.FBSupervisionHandle): Handle returned by register()
+
+        Returns:
+            Does not return any value.
+        """
+
+        with self._lock:
+            handles = self._handles.get(handle.device, [])
+
+            if handle in handles:
+                handles.remove(handle)
+
+            if not handles:
+                self._handles.pop(handle.device, None)
+                self.device_states.pop(handle.device, None)
+
+
+    def start(self):
+        """Start the supervision thread unless it is already running.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+        self._thread.start()
+
+
+    def stop(self, timeout=None):
+        """Stop the supervision thread.
+
+        Args:
+            timeout (float): Max. time in seconds to wait for the thread to finish
+
+        Returns:
+            Does not return any value.
+        """
+
+        self._stop.set()
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+
+    def _run(self):
+        """Thread method for the presence supervision"""
+
+        while not self._stop.is_set():
+            try:
+                changed = self.poll()
+            except Exception:
+                logger.exception("Presence supervision failed to load the device list")
+
+                changed = False
+
+            if self.fbpresence.state_file is not None:
+                self.fbpresence._save_state_periodically()
+
+            if isinstance(self.poll_interval, FBAdaptivePollInterval):
+                interval = self.poll_interval.update(changed)
+            else:
+                interval = self.poll_interval
+
+            self._stop.wait(interval)
+
+
+    def get_metrics(self):
+        """Return metrics of the supervision.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            metrics (dict): No. of supervised devices and the current poll interval. For an
+                adaptive poll interval the metrics of FBAdaptivePollInterval are included.
+        """
+
+        with self._lock:
+            metrics = {'devices' : len(self._handles)}
+
+        if isinstance(self.poll_interval, FBAdaptivePollInterval):
+            metrics.update(self.poll_interval.get_metrics())
+        else:
+            metrics['interval'] = self.poll_interval
+
+        return metrics
+
+
+    def poll(self):
+        """Load the device list once and notify the callbacks of all changed devices.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            changed (bool): True if the presence state of a supervised device changed or an
+                event was passed to a subscriber of the presence events
+        """
+
+        delivered = self.fbpresence.events.delivered
+
+        return self._notify(self.fbpresence.get_wlan_device_information(), delivered)
+
+
+    def _notify(self, result, delivered):
+        """Evaluate a loaded device list and notify the callbacks of all changed devices.
+
+        Args:
+            result (tuple):  Result of get_wlan_device_information(), None if the load failed
+            delivered (int): No. of presence events delivered before the device list was loaded
+
+        Returns:
+            changed (bool): See poll()
+        """
+
+        if result is None:
+            return False
+
+        devices, chk_ts = result
+
+        changed = self.fbpresence.events.delivered != delivered
+
+        with self._lock:
+            registrations = [(device, list(handles)) for device, handles in self._handles.items()]
+
+        for device, handles in registrations:
+            new_state = self.fbpresence._check_device_presence(devices, chk_ts, device, self.debounce_off)
+
+            with self._lock:
+                if device not in self._handles:
+                    continue
+
+                old_state = self.device_states.get(device, new_state)
+
+                self.device_states[device] = new_state
+
+            if new_state != old_state:
+                changed = True
+
+                for handle in handles:
+                    try:
+                        handle.callback(device,
+                                        old_state,
+                                        new_state)
+                    except Exception:
+                        logger.exception("Presence callback for device " + device + " failed")
+
+        return changed
+
+
+class FBPresence(object):
+    """Interface for communication with a FritzBox.
+
+    This class provides an interface for communication with a FritzBox using LUA pages. The
+    poll_interval of the presence supervision is given in seconds or as FBAdaptivePollInterval.
+
+    With backend BACKEND_TR064 the device list is loaded from the host list file of the TR-064
+    Hosts service on tr064_port instead of the data.lua page, the active WLAN hosts are the
+    present devices. Checks of a single MAC address then only query the entry of this host.
+
+    Device records are evicted once they were not seen for device_ttl seconds or, starting
+    with the least recently seen one, if more than max_devices records are known. Use None
+    to disable either limit. The function on_evict(device) is called for every evicted record.
+
+    Every loaded device list is passed to the FBPresenceDiff object events, which emits the
+    joined, left and changed events of all devices to its subscribers.
+
+    With a state_file the device records and the presence states are loaded at construction if
+    the file is not older than max_state_age seconds. The presence supervision saves the state
+    every STATE_SAVE_INTERVAL seconds and when it is stopped. A restart then continues with the
+    debounce times and presence states from before instead of reporting every device again.
+
+    With transport set to False no FritzBox object is created for the LUA pages, fb is None. This
+    is meant for interfaces that load the device list with their own transport and only use the
+    device records of this class, e.g. fritzbox.FBAsync.AsyncFBPresence.
+    """
+
+    def __init__(self, ip, password, poll_interval=POLL_INTERVAL, device_ttl=DEVICE_TTL,
+                 max_devices=MAX_DEVICES, on_evict=None, state_file=None, max_state_age=STATE_MAX_AGE,
+                 port=fritzbox.FBCore.HTTP_PORT, session_store=None, backend=BACKEND_LUA, user=None,
+                 tr064_port=fritzbox.FBTR064.TR064_PORT, transport=True):
+        if transport:
+            self.fb = fritzbox.FBCore.FritzBox(ip, password, port=port, user=user, session_store=session_store)
+        else:
+            self.fb = None
+
+        if backend == BACKEND_LUA:
+            self.tr064 = None
+        elif backend == BACKEND_TR064:
+            self.tr064 = fritzbox.FBTR064.FBTR064(ip, password, user=user, port=tr064_port, fb=self.fb)
+        else:
+            raise InvalidParameterError()
+
+        self.backend = backend
+
+        self.device_list = {}
+        self.devices_by_mac = {}
+        self.devices_by_ip = {}
+        self.chk_ts = 0
+
+        self.device_ttl = device_ttl
+        self.max_devices = max_devices
+        self.on_evict = on_evict
+
+        # All device records ordered from least to most recently seen
+        self._devices = collections.OrderedDict()
+
+        # Devices of the last loaded device list and the fingerprint of its WLAN page
+        self._seen_devices = {}
+        self._page_digest = None
+
+        self.events = FBPresenceDiff()
+
+        self.supervisor = FBPresenceSupervisor(self, poll_interval)
+
+        self.state_file = state_file
+        self.state_ts = 0
+
+        if state_file is not None and os.path.exists(state_file):
+            self.load_state(state_file, max_state_age)
+
+
+    def __del__(self):
+        pass
+
+
+    def supervise_device(self, device, callback):
+        """Register a callback for presence changes of a device.
+
+        See FBPresenceSupervisor.register() for the signature of the callback.
+
+        Args:
+            device (str): Name of a device registered to the Fritz!Box WLAN
+            callback (function): Reference to a function that shall be called
+                everytime the device state changes.
+
+        Returns:
+            handle (fritzbox.FBPresence.FBSupervisionHandle): Handle to unregister
+                the callback again
+        """
+
+        return self.supervisor.register(device, callback)
+
+
+    def subscribe(self, callback, kinds=None, replay=False):
+        """Register a callback for the presence events of all devices and start the supervision.
+
+        See FBPresenceDiff.subscribe() for the signature of the callback.
+
+        Args:
+            callback (function): Reference to a function that shall be called for every event
+            kinds (tuple):       Kinds of events passed to the callback, None for all kinds
+            replay (bool):       Report the devices that are already present as joined
+
+        Returns:
+            subscription (fritzbox.FBPresence.FBEventSubscription): Handle to unregister the
+                callback again
+        """
+
+        subscription = self.events.subscribe(callback, kinds, replay)
+
+        self.supervisor.start()
+
+        return subscription
+
+
+    def iter_events(self, kinds=None, timeout=None):
+        """Start the supervision and iterate over the presence events of all devices.
+
+        See FBPresenceDiff.iter_events() for the arguments.
+
+        Returns:
+            Generator returning fritzbox.FBPresence.FBPresenceEvent objects.
+        """
+
+        self.supervisor.start()
+
+        return self.events.iter_events(kinds, timeout)
+
+
+    def stop_supervision(self):
+        """Stop the presence supervision of all devices.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Does not return any value.
+        """
+
+        self.supervisor.stop()
+
+        if self.state_file is not None:
+            self.save_state()
+
+
+    def save_state(self, path=None):
+        """Write the device records and the presence states to a file.
+
+        The file is replaced atomically, a crash while saving leaves the previous state intact.
+
+        Args:
+            path (str): Path of the state file, defaults to the state_file of the object
+
+        Returns:
+            True if the state was saved, False otherwise.
+        """
+
+        if path is None:
+            path = self.state_file
+
+        with self.supervisor._lock:
+            device_states = dict(self.supervisor.device_states)
+
+        with self.events._lock:
+            present = dict(self.events.present)
+
+        state = {'version' : STATE_VERSION,
+                 'ts' : time.time(),
+                 'chk_ts' : self.chk_ts,
+                 'devices' : [[device.name, device.mac, device.ip, device.conn_type, device.on_ts]
+                              for device in list(self._devices.values())],
+                 'device_states' : device_states,
+                 'present' : present}
+
+        try:
+            with open(path + '.tmp', 'w') as state_file:
+                json.dump(state, state_file)
+
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.error("Saving of the presence state failed: %s" % (e))
+
+            return False
+
+        self.state_ts = state['ts']
+
+        return True
+
+
+    def load_state(self, path=None, max_age=STATE_MAX_AGE):
+        """Restore the device records and the presence states saved with save_state().
+
+        Args:
+            path (str):      Path of the state file, defaults to the state_file of the object
+            max_age (float): Max. age in seconds of the saved state, None for no limit
+
+        Returns:
+            True if the state was restored, False otherwise.
+        """
+
+        if path is None:
+            path = self.state_file
+
+        try:
+            with open(path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError) as e:
+            logger.error("Loading of the presence state failed: %s" % (e))
+
+            return False
+
+        if state.get('version') != STATE_VERSION:
+            logger.error("Presence state file has an unsupported version: %s" % (state.get('version')))
+
+            return False
+
+        if max_age is not None and time.time() - state['ts'] > max_age:
+            logger.debug("Presence state file is outdated and not loaded")
+
+            return False
+
+        logger.debug("Restore the presence state saved at " + str(state['ts']))
+
+        self._page_digest = None
+
+        for name, mac, ip, conn_type, on_ts in state['devices']:
+            self._update_device(name, mac, ip, conn_type, on_ts)
+
+        self.chk_ts = state['chk_ts']
+
+        with self.supervisor._lock:
+            self.supervisor.device_states.update(state['device_states'])
+
+        with self.events._lock:
+            self.events.present = {key : tuple(value) for key, value in state['present'].items()}
+
+        return True
+
+
+    def _save_state_periodically(self):
+        """Save the state if the last save is older than STATE_SAVE_INTERVAL seconds."""
+
+        if time.time() - self.state_ts >= STATE_SAVE_INTERVAL:
+            self.save_state()
+
+
+    def is_device_present(self, device_name=None, debounce_off=0, mac=None, ip=None):
+        """Check if the given device is currently in WLAN access range -> device is present.
+
+        The method checks if the specified device is currently in WLAN access range of the FritzBox
+        to determine if it is present or not. You can optionally specify a debounce time for the transition
+        to the absent state. This is helpful if you observe sporadic absent detections e.g. for iPhone
+        devices. The device is identified either by its name, its MAC address or its IP address.
+
+        Args:
+            device_name (str): Device that shall be checked.
+            debounce_off (int):  Debounce transition to absent by this no. of minutes
+            mac (str):         MAC address of the device that shall be checked.
+            ip (str):          IP address of the device that shall be checked.
+
+        Returns:
+            If the device is registered with the FritzBox the method will return True if the device is present,
+            False otherwise. If the device list could not be loaded, the last known device records are
+            evaluated, so only devices absent less than the debounce time are present.
+        """
+
+        if mac is not None and self.tr064 is not None:
+            return self._check_host_presence(mac, debounce_off)
+
+        result = self.get_wlan_device_information()
+
+        if result is None:
+            logger.error("Device list not available, the presence is evaluated from the known devices")
+
+            return self._check_device_presence(self.device_list, time.time(), device_name, debounce_off, mac, ip)
+
+        devices, chk_ts = result
+
+        return self._check_device_presence(devices, chk_ts, device_name, debounce_off, mac, ip)
+
+
+    def _check_device_presence(self, devices, chk_ts, device_name, debounce_off, mac=None, ip=None):
+        """Evaluate the presence of a device based on the given device list.
+
+        Args:
+            devices (dict):     Device list as returned by get_wlan_device_information()
+            chk_ts (float):     Timestamp of the presence check the device list belongs to
+            device_name (str):  Device that shall be checked.
+            debounce_off (int): Debounce transition to absent by this no. of minutes
+            mac (str):          MAC address of the device that shall be checked.
+            ip (str):           IP address of the device that shall be checked.
+
+        Returns:
+            True if the device is present, False otherwise.
+        """
+
+        if mac is not None:
+            logger.debug("Check if the device with MAC address " + mac + " is present")
+
+            device = self.devices_by_mac.get(normalize_mac(mac))
+        elif ip is not None:
+            logger.debug("Check if the device with IP address " + ip + " is present")
+
+            device = self.devices_by_ip.get(ip)
+        elif device_name is not None:
+            logger.debug("Check if the device " + device_name + " is present")
+
+            device = devices.get(device_name)
+        else:
+            raise InvalidParameterError()
+
+        if device is None:
+            # Device is not listed and therefore not present
+            return False
+        elif chk_ts - device['on_ts'] == 0:
+            # Device is present
+            return True
+        elif chk_ts - device['on_ts'] <= 60 * debounce_off:
+            # Device is absent less than the defined debounce time
+            return True
+        else:
+            # Device is absent for more than the defined debounce time
+            return False
+
+
+    def _check_host_presence(self, mac, debounce_off):
+        """Evaluate the presence of a device based on its TR-064 host entry.
+
+        Args:
+            mac (str):          MAC address of the device that shall be checked.
+            debounce_off (int): Debounce transition to absent by this no. of minutes
+
+        Returns:
+            True if the device is present, False otherwise.
+        """
+
+        logger.debug("Check the host entry of the device with MAC address " + mac)
+
+        mac = normalize_mac(mac)
+
+        return self._evaluate_host_entry(mac, self.tr064.get_specific_host_entry(mac), debounce_off)
+
+
+    def _evaluate_host_entry(self, mac, host, debounce_off):
+        """Evaluate the presence of a device based on its loaded TR-064 host entry.
+
+        Args:
+            mac (str):          Normalized MAC address of the device
+            host (dict):        Host entry as returned by FBTR064.get_specific_host_entry()
+            debounce_off (int): Debounce transition to absent by this no. of minutes
+
+        Returns:
+            True if the device is present, False otherwise.
+        """
+
+        now = time.time()
+
+        if host is not None and host['active'] and host['interface'] == fritzbox.FBTR064.INTERFACE_WLAN:
+            self._update_device(host['name'], mac, host['ip'], CONN_TYPE_WLAN, now)
+
+            return True
+
+        device = self.devices_by_mac.get(mac)
+
+        # Devices absent less than the defined debounce time are still present
+        return device is not None and now - device.on_ts <= 60 * debounce_off
+
+
+    def get_device(self, device_name=None, mac=None, ip=None):
+        """Look up a device record from the last loaded device list.
+
+        Args:
+            device_name (str): Name of the device
+            mac (str):         MAC address of the device
+            ip (str):          IP address of the device
+
+        Returns:
+            device (fritzbox.FBPresence.FBDevice): Device record, None if the device is unknown
+        """
+
+        if mac is not None:
+            return self.devices_by_mac.get(normalize_mac(mac))
+        elif ip is not None:
+            return self.devices_by_ip.get(ip)
+        elif device_name is not None:
+            return self.device_list.get(device_name)
+        else:
+            raise InvalidParameterError()
+
+
+    def get_wlan_device_information(self):
+        """Query WLAN information for all FritzBox known devices.
+
+        The method queries all WLAN related information for all devices known to the FritzBox.
+
+        Args:
+            None
+
+        Returns:
+            device_list (dict): Dictionary with all devices known so far. The key is the device name
+                                and the value the corresponding FBDevice record.
+
+            chk_ts (float):    Timestamp of the last presence check
+
+            None is returned instead if the device list could not be loaded.
+        """
+
+        logger.debug("Load WLAN device information from the FritzBox for all known devices")
+
+        self.chk_ts = time.time()
+
+        if self.tr064 is not None:
+            hosts = self.tr064.get_host_list()
+
+            if hosts is None:
+                return None
+
+            return self._update_host_list(hosts)
+
+        return self.fb.load_fritzbox_page(WLAN_DEVICE_PAGE, WLAN_DEVICE_PARAM, parse=self._update_device_list)
+
+
+    def _update_device_list(self, page):
+        """Update the device list from the WLAN page loaded from the FritzBox.
+
+        Most polls return the same page as the previous one. Such a page is recognized by its
+        fingerprint and only the timestamps of the devices seen before are updated, without
+        parsing the page again.
+
+        Args:
+            page (bytes): WLAN page as returned by the FritzBox
+
+        Returns:
+            Tuple (device_list, chk_ts) as described for get_wlan_device_information().
+        """
+
+        digest = hashlib.blake2b(page, digest_size=PAGE_DIGEST_SIZE).digest()
+
+        if digest == self._page_digest:
+            return self._touch_devices()
+
+        json_structure = json.loads(page.decode('UTF-8'))
+
+        json_structure_devices = json_structure['data']['net']['devices']
+
+        return self._update_devices(((json_device.get('name', ''),
+                                      normalize_mac(json_device.get('mac', '')),
+                                      json_device.get('ip', ''),
+                                      json_device.get('type', ''))
+                                     for json_device in json_structure_devices),
+                                    digest)
+
+
+    def _update_host_list(self, hosts):
+        """Update the device list from the TR-064 host list, the active WLAN hosts are present.
+
+        Args:
+            hosts (list): Hosts as returned by FBTR064.get_host_list()
+
+        Returns:
+            Tuple (device_list, chk_ts) as described for get_wlan_device_information().
+        """
+
+        return self._update_devices((host['name'], normalize_mac(host['mac']), host['ip'], CONN_TYPE_WLAN)
+                                    for host in hosts
+                                    if host['active'] and host['interface'] == fritzbox.FBTR064.INTERFACE_WLAN)
+
+
+    def _update_devices(self, devices, digest=None):
+        """Update the device list from the devices currently connected to the FritzBox.
+
+        Args:
+            devices (iterable): Tuples (name, mac, ip, conn_type) of the connected devices
+            digest (bytes):     Fingerprint of the page the devices were read from, None if the
+                                device list shall not be reused for an unchanged page
+
+        Returns:
+            Tuple (device_list, chk_ts) as described for get_wlan_device_information().
+        """
+
+        self._page_digest = None
+        self._seen_devices = {}
+
+        for name, mac, ip, conn_type in devices:
+            self._seen_devices[mac if mac else 'name:' + name] = self._update_device(name, mac, ip, conn_type,
+                                                                                     self.chk_ts)
+
+        self._page_digest = digest
+
+        self._evict_devices(self.chk_ts)
+
+        self.events.update(self._devices.items(), self.chk_ts)
+
+        return self.device_list, self.chk_ts
+
+
+    def _touch_devices(self):
+        """Mark the devices of the last loaded device list as seen again.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            Tuple (device_list, chk_ts) as described for get_wlan_device_information().
+        """
+
+        for device in self._seen_devices.values():
+            device.on_ts = self.chk_ts
+
+        self._evict_devices(self.chk_ts)
+
+        # Presence states only change while devices not seen anymore are within their debounce time
+        if len(self.events.present) != len(self._seen_devices):
+            self.events.update(self._devices.items(), self.chk_ts)
+
+        return self.device_list, self.chk_ts
+
+
+    def _update_device(self, name, mac, ip, conn_type, on_ts):
+        """Update the record of a device and the lookup indexes.
+
+        Args:
+            name (str):      Name of the device
+            mac (str):       Normalized MAC address of the device, '' if unknown
+            ip (str):        IP address of the device, '' if unknown
+            conn_type (str): Connection type of the device
+            on_ts (float):   Timestamp the device was seen
+
+        Returns:
+            device (fritzbox.FBPresence.FBDevice): Updated device record
+        """
+
+        key = mac if mac else 'name:' + name
+
+        device = self._devices.get(key)
+
+        if device is None:
+            device = FBDevice(name, mac, ip, conn_type, on_ts)
+
+            self._devices[key] = device
+
+            if mac:
+                self.devices_by_mac[mac] = device
+        else:
+            self._devices.move_to_end(key)
+
+            if device.name != name and self.device_list.get(device.name) is device:
+                del self.device_list[device.name]
+
+            if device.ip != ip and self.devices_by_ip.get(device.ip) is device:
+                del self.devices_by_ip[device.ip]
+
+            device.name = name
+            device.ip = ip
+            device.conn_type = conn_type
+            device.on_ts = on_ts
+
+        self.device_list[name] = device
+
+        if ip:
+            self.devices_by_ip[ip] = device
+
+        return device
+
+
+    def _evict_devices(self, now):
+        """Remove device records exceeding the configured retention.
+
+        Args:
+            now (float): Timestamp the age of the device records is related to
+
+        Returns:
+            Does not return any value.
+        """
+
+        while self._devices:
+            key, device = next(iter(self._devices.items()))
+
+            if self.max_devices is not None and len(self._devices) > self.max_devices:
+                logger.debug("Evict device " + device.name + " exceeding the max. no. of devices")
+            elif self.device_ttl is not None and now - device.on_ts > self.device_ttl:
+                logger.debug("Evict device " + device.name + " not seen since " + str(device.on_ts))
+            else:
+                break
+
+            del self._devices[key]
+
+            # The device records do not match the last loaded device list anymore
+            self._page_digest = None
+
+            if self.device_list.get(device.name) is device:
+                del self.device_list[device.name]
+
+            if self.devices_by_mac.get(device.mac) is device:
+                del self.devices_by_mac[device.mac]
+
+            if self.devices_by_ip.get(device.ip) is device:
+                del self.devices_by_ip[device.ip]
+
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(device)
+                except Exception:
+                    logger.exception("Eviction callback for device " + device.name + " failed")
+
+
+#===============================================================================
+# Main program
+#===============================================================================
+def main():
+    """Main function for testing purpose"""
+    # Imported here as FBDaemon depends on this module
+    import fritzbox.FBDaemon
+
+    path = args.socket or fritzbox.FBDaemon.default_socket_path(args.ip)
+
+    # Answer from a running daemon, otherwise ask the FritzBox directly
+    if args.name == None and args.mac == None and args.device_ip == None:
+        answered, result = fritzbox.FBDaemon.try_query_daemon(path, 'devices')
+
+        if answered:
+            print({device['name'] : FBDevice(**device) for device in result['devices']})
+
+            return
+
+        fb_p = FBPresence(ip=args.ip, password=args.password,
+                          session_store=fritzbox.FBCore.FBSessionStore(), backend=args.backend)
+
+        result = fb_p.get_wlan_device_information()
+
+        if result is None:
+            sys.exit("Loading of the device list failed")
+
+        devices, chk_ts = result
+
+        print(devices)
+
+    else:
+        answered, result = fritzbox.FBDaemon.try_query_daemon(path, 'present', name=args.name, mac=args.mac,
+                                                              ip=args.device_ip)
+
+        if answered:
+            print(result)
+
+            return
+
+        fb_p = FBPresence(ip=args.ip, password=args.password,
+                          session_store=fritzbox.FBCore.FBSessionStore(), backend=args.backend)
 
-    elif args.name != None:
-        print(fb_p.is_device_present(device_name=args.name))
+        print(fb_p.is_device_present(device_name=args.name, mac=args.mac, ip=args.device_ip))
 
 
 if __name__ == '__main__':
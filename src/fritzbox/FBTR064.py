@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""Module for communication with a FritzBox using TR-064.
+
+This module provides an interface for calling the TR-064 SOAP actions of a FritzBox, currently
+the ones of the Hosts service used for the presence detection.
+"""
+
+import fritzbox._info
+
+__author__     = fritzbox._info.__author__
+__copyright__  = fritzbox._info.__copyright__
+__credits__    = fritzbox._info.__credits__
+__license__    = fritzbox._info.__license__
+__maintainer__ = fritzbox._info.__maintainer__
+__email__      = fritzbox._info.__email__
+
+
+#===============================================================================
+# Imports
+#===============================================================================
+import argparse
+import logging
+import hashlib
+import os
+import re
+import threading
+
+from xml.sax.saxutils import escape
+
+import xml.etree.ElementTree as ElementTree
+
+import fritzbox.FBCore
+
+
+#===============================================================================
+# Evaluate parameters
+#===============================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="%(prog)s [options]",
+                                     description="In case no option is selected the script will "
+                                     "return the host table of the FritzBox. If --mac is specified it will "
+                                     "return the host entry of the device.")
+
+    parser.add_argument('--v1',
+                      help='Debug level INFO',
+                      dest='verbose_INFO',
+                      default=False,
+                      action='store_true')
+    parser.add_argument('--v2',
+                        help='Debug level ERROR',
+                        dest='verbose_ERROR',
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--v3',
+                        help='Debug level DEBUG',
+                        dest='verbose_DEBUG',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('-i',
+                        '--ip',
+                        help='IP adress of the FritzBox, eg. "192.168.0.1"',
+                        dest='ip',
+                        default="192.168.0.1",
+                        action='store',
+                        required=True)
+    parser.add_argument('-p',
+                        '--password',
+                        help='Password for accessing the FritzBox, eg. "mysecret123"',
+                        dest='password',
+                        default="password",
+                        action='store',
+                        required=True)
+    parser.add_argument('-m',
+                        '--mac',
+                        help='MAC address of the device, eg. "AA:BB:CC:DD:EE:FF"',
+                        dest='mac',
+                        default=None,
+                        action='store')
+
+    args = parser.parse_args()
+
+
+#===============================================================================
+# Setup logger
+#===============================================================================
+if __name__ == '__main__':
+    log_level = logging.CRITICAL
+
+    if args.verbose_INFO:
+        log_level = logging.INFO
+
+    if args.verbose_ERROR:
+        log_level = logging.ERROR
+
+    if args.verbose_DEBUG:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(level=log_level,
+                        format="[{asctime}] - [{levelname}]: {message}",
+                        datefmt="%Y-%m-%d %H:%M:%S",
+                        style="{")
+
+logger = logging.getLogger(__name__)
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+TR064_PORT = 49000
+
+# User name accepted by FritzBoxes without user accounts
+TR064_DEFAULT_USER = 'dslf-config'
+
+HOSTS_SERVICE     = 'urn:dslforum-org:service:Hosts:1'
+HOSTS_CONTROL_URL = '/upnp/control/hosts'
+
+# Interface type of hosts connected by WLAN
+INTERFACE_WLAN = '802.11'
+
+# UPnP error code for an unknown MAC address
+ERROR_NO_SUCH_ENTRY = '714'
+
+SOAP_ENVELOPE = ('<?xml version="1.0" encoding="utf-8"?>'
+                 '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+                 's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+                 '<s:Body><u:%(action)s xmlns:u="%(service)s">%(arguments)s</u:%(action)s></s:Body>'
+                 '</s:Envelope>')
+
+SOAP_BODY = '{http://schemas.xmlsoap.org/soap/envelope/}Body'
+
+# Parameters of a WWW-Authenticate digest challenge
+DIGEST_PARAM = re.compile(r'(\w+)=(?:"([^"]*)"|([^\s,]*))')
+
+
+#===============================================================================
+# Exceptions
+#===============================================================================
+class FBTR064Fault(Exception):
+    """SOAP fault returned by the FritzBox"""
+
+    def __init__(self, code, description):
+        super().__init__("%s %s" % (code, description))
+
+        self.code = code
+        self.description = description
+
+
+#===============================================================================
+# Method definitions
+#===============================================================================
+def _local_name(tag):
+    """Return the tag of an XML element without its namespace."""
+
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_action_response(page):
+    """Read out the output arguments of a SOAP action response.
+
+    Args:
+        page (bytes): SOAP envelope returned by the FritzBox
+
+    Returns:
+        arguments (dict): Values of the output arguments keyed by their names
+
+    Raises:
+        FBTR064Fault: The envelope contains a SOAP fault
+    """
+
+    body = ElementTree.fromstring(page).find(SOAP_BODY)
+
+    response = body[0]
+
+    if _local_name(response.tag) == 'Fault':
+        code = description = ''
+
+        for element in response.iter():
+            if _local_name(element.tag) == 'errorCode':
+                code = element.text
+            elif _local_name(element.tag) == 'errorDescription':
+                description = element.text
+
+        raise FBTR064Fault(code, description)
+
+    return {_local_name(element.tag) : element.text or '' for element in response}
+
+
+def parse_host_list(page):
+    """Read out the hosts of the host list file.
+
+    Args:
+        page (bytes): <List> XML file referenced by X_AVM-DE_GetHostListPath
+
+    Returns:
+        hosts (list): Dictionaries with the keys mac, ip, name, interface and active
+    """
+
+    return [{'mac' : item.findtext('MACAddress', ''),
+             'ip' : item.findtext('IPAddress', ''),
+             'name' : item.findtext('HostName', ''),
+             'interface' : item.findtext('InterfaceType', ''),
+             'active' : item.findtext('Active') == '1'}
+            for item in ElementTree.fromstring(page).iter('Item')]
+
+
+#===============================================================================
+# Class definitions
+#===============================================================================
+class FBTR064(object):
+    """Interface for communication with a FritzBox using TR-064.
+
+    The SOAP actions are called with HTTP digest authentication on port 49000. Without a user
+    the user name for FritzBoxes without user accounts is used.
+
+    The requests are sent by the transport of a FritzBox object, i.e. on keep-alive connections of
+    the shared pool for the TR-064 port, with its timeouts, retries, circuit breaker, request hooks
+    and statistics. The digest challenge of the FritzBox is kept and answered in advance for the
+    following requests, a new challenge is only requested after the FritzBox rejected the nonce.
+    """
+
+    def __init__(self, ip, password, user=None, port=TR064_PORT, fb=None):
+        self.user = user if user is not None else TR064_DEFAULT_USER
+        self.password = password
+
+        self.fb = fb if fb is not None else fritzbox.FBCore.FritzBox(ip, password, port=port, user=user)
+
+        # Same settings as the pool of the FritzBox object, only the port differs
+        self.pool = fritzbox.FBCore.get_connection_pool(ip, port, self.fb.pool.size, self.fb.pool.idle_timeout,
+                                                        self.fb.pool.connect_timeout, self.fb.pool.read_timeout)
+
+        # Last digest challenge of the FritzBox and the no. of requests sent with its nonce
+        self._challenge = None
+        self._nonce_count = 0
+        self._challenge_lock = threading.Lock()
+
+
+    def _authorization(self, method, uri):
+        """Return the Authorization header answering the current digest challenge."""
+
+        with self._challenge_lock:
+            challenge = self._challenge
+
+            self._nonce_count += 1
+
+            nc = '%08x' % (self._nonce_count)
+
+        cnonce = os.urandom(8).hex()
+
+        ha1 = hashlib.md5(('%s:%s:%s' % (self.user, challenge['realm'], self.password)).encode('utf-8')).hexdigest()
+        ha2 = hashlib.md5(('%s:%s' % (method, uri)).encode('utf-8')).hexdigest()
+
+        if 'qop' in challenge:
+            response = '%s:%s:%s:%s:auth:%s' % (ha1, challenge['nonce'], nc, cnonce, ha2)
+        else:
+            response = '%s:%s:%s' % (ha1, challenge['nonce'], ha2)
+
+        header = ('Digest username="%s", realm="%s", nonce="%s", uri="%s", response="%s", algorithm=MD5'
+                  % (self.user, challenge['realm'], challenge['nonce'], uri,
+                     hashlib.md5(response.encode('utf-8')).hexdigest()))
+
+        if 'qop' in challenge:
+            header += ', qop=auth, nc=%s, cnonce="%s"' % (nc, cnonce)
+
+        if 'opaque' in challenge:
+            header += ', opaque="%s"' % (challenge['opaque'])
+
+        return header
+
+
+    def _set_challenge(self, header):
+        """Keep the digest challenge of a WWW-Authenticate header, return False if it is none."""
+
+        if header is None or not header.lower().startswith('digest '):
+            return False
+
+        challenge = {name.lower() : quoted or plain for name, quoted, plain in DIGEST_PARAM.findall(header[7:])}
+
+        if 'realm' not in challenge or 'nonce' not in challenge:
+            return False
+
+        with self._challenge_lock:
+            self._challenge = challenge
+            self._nonce_count = 0
+
+        return True
+
+
+    def _post(self, url, headers, body):
+        """Send a POST request with digest authentication and return (status, reason, page).
+
+        A cached challenge is answered in advance. If the FritzBox rejects it, the request is
+        repeated once with the new challenge of the rejection.
+        """
+
+        for attempt in range(2):
+            request_headers = dict(headers)
+
+            if self._challenge is not None:
+                request_headers['Authorization'] = self._authorization('POST', url)
+
+            with self.fb.open_url(url, request_headers, method='POST', body=body, pool=self.pool) as response:
+                page = response.read()
+
+                if response.status != 401 or attempt == 1 or not self._set_challenge(response.getheader('WWW-Authenticate')):
+                    return response.status, response.reason, page
+
+
+    def call_action(self, service, control_url, action, **arguments):
+        """Call a SOAP action of a TR-064 service.
+
+        Args:
+            service (str):     Service type, e.g. HOSTS_SERVICE
+            control_url (str): Control URL of the service, e.g. HOSTS_CONTROL_URL
+            action (str):      Name of the action
+            arguments:         Input arguments of the action
+
+        Returns:
+            arguments (dict): Values of the output arguments keyed by their names
+
+        Raises:
+            FBTR064Fault: The FritzBox rejected the action or the authentication
+            fritzbox.FBCore.FritzBoxUnavailableError: The circuit breaker of the FritzBox is open
+            OSError, http.client.HTTPException: The FritzBox could not be reached
+        """
+
+        logger.debug("Call the TR-064 action " + action)
+
+        body = SOAP_ENVELOPE % {'action' : action,
+                                'service' : service,
+                                'arguments' : ''.join('<%s>%s</%s>' % (name, escape(str(value)), name)
+                                                      for name, value in arguments.items())}
+
+        status, reason, page = self._post(control_url,
+                                          {'Content-Type' : 'text/xml; charset="utf-8"',
+                                           'SOAPAction' : '%s#%s' % (service, action)},
+                                          body.encode('utf-8'))
+
+        # SOAP faults are returned with status 500
+        if status not in (200, 500):
+            raise FBTR064Fault(str(status), reason)
+
+        return parse_action_response(page)
+
+
+    def get_host_list(self):
+        """Load the host table of the FritzBox as a single file.
+
+        Args:
+            Does not require any arguments.
+
+        Returns:
+            hosts (list): Hosts as returned by parse_host_list(), None if the host table could
+                          not be loaded
+        """
+
+        try:
+            path = self.call_action(HOSTS_SERVICE, HOSTS_CONTROL_URL,
+                                    'X_AVM-DE_GetHostListPath')['NewX_AVM-DE_HostListPath']
+
+            # The path contains a session id, the file is loaded without digest authentication
+            with self.fb.open_url(path, {}, pool=self.pool) as response:
+                page = response.read()
+
+                if response.status != 200:
+                    raise FBTR064Fault(str(response.status), response.reason)
+
+            return parse_host_list(page)
+        except Exception as e:
+            logger.error("Loading of the host list failed: %s" % (e))
+
+            return None
+
+
+    def get_specific_host_entry(self, mac):
+        """Load the host entry of a single device.
+
+        Args:
+            mac (str): MAC address of the device in the format "AA:BB:CC:DD:EE:FF"
+
+        Returns:
+            host (dict): Host as described for parse_host_list(), unknown devices are reported
+                         as inactive. None if the host entry could not be loaded.
+        """
+
+        try:
+            entry = self.call_action(HOSTS_SERVICE, HOSTS_CONTROL_URL, 'GetSpecificHostEntry', NewMACAddress=mac)
+        except FBTR064Fault as e:
+            if e.code == ERROR_NO_SUCH_ENTRY:
+                return {'mac' : mac, 'ip' : '', 'name' : '', 'interface' : '', 'active' : False}
+
+            logger.error("Loading of the host entry failed: %s" % (e))
+
+            return None
+        except Exception as e:
+            logger.error("Loading of the host entry failed: %s" % (e))
+
+            return None
+
+        return {'mac' : mac,
+                'ip' : entry.get('NewIPAddress', ''),
+                'name' : entry.get('NewHostName', ''),
+                'interface' : entry.get('NewInterfaceType', ''),
+                'active' : entry.get('NewActive') == '1'}
+
+
+#===============================================================================
+# Main program
+#===============================================================================
+def main():
+    """Main function for testing purpose"""
+    tr064 = FBTR064(ip=args.ip, password=args.password)
+
+    if args.mac == None:
+        for host in tr064.get_host_list() or []:
+            print(host)
+    else:
+        print(tr064.get_specific_host_entry(args.mac))
+
+
+if __name__ == '__main__':
+    main()
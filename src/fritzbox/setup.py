@@ -11,5 +11,7 @@ setup(
     url          = _info.__url__,
     description  = _info.__package_desc__,
     package_dir  = {"" : "src"},
-    py_modules   = ["fritzbox._info", "fritzbox.FBCore", "fritzbox.FBPresence", "fritzbox.FBHomeAuto"]
+    py_modules   = ["fritzbox._info", "fritzbox.FBCore", "fritzbox.FBPresence", "fritzbox.FBHomeAuto",
+                    "fritzbox.FBAsync", "fritzbox.FBFleet", "fritzbox.FBHistory",
+                    "fritzbox.FBExporter", "fritzbox.FBDaemon", "fritzbox.FBTR064"]
     )
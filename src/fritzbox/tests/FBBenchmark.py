@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This module benchmarks the modules of this project against the FritzBox emulator. It measures
+the login cost, the presence poll throughput, the switch plug queries and the memory needed
+per 1000 device records. The results can be stored and compared against a baseline.
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up, '..', '..'))
+
+
+#===============================================================================
+# User imports
+#===============================================================================
+import fritzbox.FBCore
+import fritzbox.FBHomeAuto
+import fritzbox.FBPresence
+
+from FBEmulator import FBEmulator
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+PASSWORD = 'secret'
+
+# Default tolerance for the relative deviation from a baseline before a result is a regression
+TOLERANCE = 0.25
+
+
+#===============================================================================
+# Method definitions
+#===============================================================================
+def measure(function, iterations):
+    """Return the average wall clock time of a function in seconds.
+
+    Args:
+        function (function): Function without arguments
+        iterations (int):    No. of calls
+
+    Returns:
+        duration (float): Average duration of one call in seconds
+    """
+
+    start = time.perf_counter()
+
+    for _ in range(iterations):
+        function()
+
+    return (time.perf_counter() - start) / iterations
+
+
+def benchmark_login(iterations, pbkdf2=False):
+    """Measure the time for a complete challenge-response login.
+
+    Returns:
+        results (dict): Benchmark results as described for run_benchmarks()
+    """
+
+    with FBEmulator(PASSWORD, pbkdf2=pbkdf2) as emulator:
+        fb = fritzbox.FBCore.FritzBox('127.0.0.1', PASSWORD, port=emulator.port)
+
+        def login():
+            fb.invalidate_session()
+            fb.login()
+
+        duration = measure(login, iterations)
+
+    return {'login_pbkdf2_ms' if pbkdf2 else 'login_ms' : (duration * 1000, False)}
+
+
+def benchmark_presence_poll(iterations, devices=200):
+    """Measure the no. of device list polls per second.
+
+    Returns:
+        results (dict): Benchmark results as described for run_benchmarks()
+    """
+
+    with FBEmulator(PASSWORD, devices=devices) as emulator:
+        fb_p = fritzbox.FBPresence.FBPresence('127.0.0.1', PASSWORD, port=emulator.port)
+        fb_p.get_wlan_device_information()
+
+        duration = measure(fb_p.get_wlan_device_information, iterations)
+
+    return {'presence_polls_per_s' : (1 / duration, True)}
+
+
+def benchmark_switch_queries(iterations, plugs=20):
+    """Measure the time for querying the state of all switch plugs one by one and at once and
+    for switching all of them with the bulk command.
+
+    Returns:
+        results (dict): Benchmark results as described for run_benchmarks()
+    """
+
+    with FBEmulator(PASSWORD, plugs=plugs) as emulator:
+        fb_h = fritzbox.FBHomeAuto.FBHomeAuto('127.0.0.1', PASSWORD, port=emulator.port)
+        ains = fb_h.get_switch_plugs()
+
+        def query_single():
+            for ain in ains:
+                fb_h.get_switch_plug_state(ain)
+
+        single = measure(query_single, iterations)
+        bulk = measure(fb_h.get_device_list_infos, iterations)
+        scene = measure(lambda: fb_h.set_switch_plugs_state(ains, 'off', use_groups=False), iterations)
+
+    return {'switch_query_single_ms' : (single * 1000, False),
+            'switch_query_bulk_ms' : (bulk * 1000, False),
+            'switch_scene_ms' : (scene * 1000, False)}
+
+
+def benchmark_device_memory(devices=1000):
+    """Measure the memory held by the records of 1000 devices.
+
+    The device list is parsed without emulator, so that only the records of FBPresence are
+    traced.
+
+    Returns:
+        results (dict): Benchmark results as described for run_benchmarks()
+    """
+
+    emulator = FBEmulator(PASSWORD, devices=devices)
+    page = json.dumps({'data' : {'net' : {'devices' : emulator.devices}}}).encode('utf-8')
+
+    fb_p = fritzbox.FBPresence.FBPresence('127.0.0.1', PASSWORD)
+    fb_p.chk_ts = time.time()
+
+    gc.collect()
+    tracemalloc.start()
+
+    before = tracemalloc.get_traced_memory()[0]
+    fb_p._update_device_list(page)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+
+    tracemalloc.stop()
+
+    return {'memory_kib_per_1k_devices' : ((after - before) / 1024 * 1000 / devices, False)}
+
+
+def run_benchmarks(iterations):
+    """Run all benchmarks.
+
+    Args:
+        iterations (int): No. of iterations of the timed benchmarks
+
+    Returns:
+        results (dict): Tuple (value, higher_is_better) keyed by the name of the result
+    """
+
+    results = {}
+
+    results.update(benchmark_login(iterations))
+    results.update(benchmark_login(iterations, pbkdf2=True))
+    results.update(benchmark_presence_poll(iterations))
+    results.update(benchmark_switch_queries(max(1, iterations // 10)))
+    results.update(benchmark_device_memory())
+
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Compare benchmark results against a baseline.
+
+    Args:
+        results (dict):    Results as returned by run_benchmarks()
+        baseline (dict):   Values keyed by the name of the result
+        tolerance (float): Allowed relative deviation in the worse direction
+
+    Returns:
+        regressions (list): Tuples (name, value, baseline value) of all regressions
+    """
+
+    regressions = []
+
+    for name, (value, higher_is_better) in results.items():
+        reference = baseline.get(name)
+
+        if not reference:
+            continue
+
+        if higher_is_better:
+            regression = value < reference * (1 - tolerance)
+        else:
+            regression = value > reference * (1 + tolerance)
+
+        if regression:
+            regressions.append((name, value, reference))
+
+    return regressions
+
+
+#===============================================================================
+# Main program
+#===============================================================================
+def main():
+    """Run the benchmarks and compare them against a baseline"""
+    parser = argparse.ArgumentParser(usage="%(prog)s [options]",
+                                     description="Runs the benchmarks against a local FritzBox emulator. "
+                                     "If --baseline is specified the script returns with exit code 1 if "
+                                     "a result is worse than the baseline by more than the tolerance.")
+
+    parser.add_argument('-n',
+                        '--iterations',
+                        help='No. of iterations of the timed benchmarks',
+                        dest='iterations',
+                        default=200,
+                        type=int,
+                        action='store')
+    parser.add_argument('-j',
+                        '--json',
+                        help='File the results are written to, eg. "benchmark.json"',
+                        dest='json',
+                        default=None,
+                        action='store')
+    parser.add_argument('-b',
+                        '--baseline',
+                        help='File with the results of a previous run, eg. "baseline.json"',
+                        dest='baseline',
+                        default=None,
+                        action='store')
+    parser.add_argument('-t',
+                        '--tolerance',
+                        help='Allowed relative deviation from the baseline',
+                        dest='tolerance',
+                        default=TOLERANCE,
+                        type=float,
+                        action='store')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = run_benchmarks(args.iterations)
+
+    for name, (value, higher_is_better) in sorted(results.items()):
+        print("%-28s %12.3f" % (name, value))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({name : value for name, (value, _) in results.items()}, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+
+        for name, value, reference in regressions:
+            print("Regression of %s: %.3f, baseline %.3f" % (name, value, reference))
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
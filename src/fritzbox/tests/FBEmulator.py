@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This module provides a FritzBox emulator serving the LUA pages used by the modules of this
+project over HTTP on localhost. It is used by the integration tests and the benchmarks.
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import hashlib
+import json
+import re
+import socket
+import random
+import threading
+import time
+import collections
+import http.server
+
+from urllib.parse import urlsplit, parse_qs
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+INVALID_SID = '0000000000000000'
+
+# Iterations of the first and second hash of the PBKDF2 challenge
+PBKDF2_ITERATIONS = (1000, 100)
+
+# Function bitmask of a FRITZ!DECT 200: switch plug, energy meter and temperature sensor
+SWITCH_PLUG_FUNCTIONS = (1 << 9) | (1 << 7) | (1 << 8) | (1 << 11) | (1 << 15)
+
+# Function bitmask of a FRITZ!DECT Repeater 100: DECT repeater and temperature sensor
+REPEATER_FUNCTIONS = (1 << 10) | (1 << 8)
+
+TR064_REALM = 'F!Box SOAP-Auth'
+
+SOAP_RESPONSE = ('<?xml version="1.0"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+                 's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>%s</s:Body></s:Envelope>')
+
+SOAP_FAULT = ('<s:Fault><faultcode>s:Client</faultcode><faultstring>UPnPError</faultstring><detail>'
+              '<UPnPError xmlns="urn:dslforum-org:control-1-0"><errorCode>%s</errorCode>'
+              '<errorDescription>%s</errorDescription></UPnPError></detail></s:Fault>')
+
+
+#===============================================================================
+# Class definitions
+#===============================================================================
+class FBEmulator(object):
+    """FritzBox emulator serving the pages used by this project over HTTP on localhost.
+
+    The emulator implements the challenge-response login of /login_sid.lua, the WLAN device
+    list of /data.lua and the commands of /webservices/homeautoswitch.lua. Every request is
+    delayed by latency seconds and answered with status 503 with the probability fail_rate.
+    The no. of requests per page is counted in counts, the no. of accepted connections in
+    connections.
+
+    With pbkdf2 clients requesting version 2 of the login page receive a PBKDF2 challenge
+    instead of the MD5 one. If a user is given, the login requires it as username.
+
+    The actions X_AVM-DE_GetHostListPath and GetSpecificHostEntry of the TR-064 Hosts service
+    are answered on the same port with HTTP digest authentication, all devices are reported as
+    active WLAN hosts.
+
+    groups is a list with the indexes of the switch plugs of every group. Switch commands for
+    a group switch all of its members. The device list additionally reports the given no. of
+    DECT repeaters, which are no switch plugs.
+
+    Use the emulator as context manager or call start() and stop().
+    """
+
+    def __init__(self, password='secret', devices=10, plugs=3, latency=0.0, fail_rate=0.0, seed=0,
+                 pbkdf2=False, user=None, groups=(), repeaters=0):
+        self.password = password
+        self.user = user
+        self.latency = latency
+        self.fail_rate = fail_rate
+
+        salts = random.Random(seed)
+
+        self.challenge = '%08x' % salts.getrandbits(32)
+        self.pbkdf2_challenge = '2$%d$%016x$%d$%016x' % (PBKDF2_ITERATIONS[0], salts.getrandbits(64),
+                                                          PBKDF2_ITERATIONS[1], salts.getrandbits(64))
+        self.pbkdf2 = pbkdf2
+
+        self.devices = [{'name' : 'device%d' % i,
+                         'mac' : '00:11:22:%02X:%02X:%02X' % (i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff),
+                         'ip' : '192.168.%d.%d' % (178 + i // 250, 2 + i % 250),
+                         'type' : 'wlan'} for i in range(devices)]
+
+        self.plugs = collections.OrderedDict(('08761%07d' % i, False) for i in range(plugs))
+
+        ains = list(self.plugs)
+
+        self.groups = collections.OrderedDict(('65:3A:18-%d' % (900 + i), [ains[member] for member in members])
+                                              for i, members in enumerate(groups))
+
+        self.repeaters = ['08761%07d' % (1000000 + i) for i in range(repeaters)]
+
+        self.sids = set()
+        self.counts = collections.Counter()
+        self.connections = 0
+
+        self._sockets = set()
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+        self.port = None
+
+
+    def __enter__(self):
+        self.start()
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+    def start(self):
+        """Start serving on a free port of localhost, available as attribute port afterwards."""
+
+        emulator = self
+
+        class FBEmulatorRequestHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+
+                with emulator._lock:
+                    emulator.connections += 1
+                    emulator._sockets.add(self.connection)
+
+
+            def finish(self):
+                with emulator._lock:
+                    emulator._sockets.discard(self.connection)
+
+                super().finish()
+
+
+            def do_GET(self):
+                emulator._handle(self)
+
+
+            def do_POST(self):
+                emulator._handle_soap(self)
+
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FBEmulatorRequestHandler)
+        self._server.daemon_threads = True
+
+        self.port = self._server.server_address[1]
+
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+
+
+    def stop(self):
+        """Stop serving and close the listening socket."""
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+    def expire_sessions(self):
+        """Invalidate all session ids, the next request of a client is rejected with status 403."""
+
+        with self._lock:
+            self.sids.clear()
+
+
+    def close_connections(self):
+        """Close all open connections, like a FritzBox dropping idle keep-alive connections."""
+
+        with self._lock:
+            sockets = list(self._sockets)
+
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+    def _send(self, handler, status, body, content_type='text/plain'):
+        """Send a response with the given status and body."""
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+
+        handler.wfile.write(body)
+
+
+    def _handle(self, handler):
+        """Answer a request of a client."""
+
+        url = urlsplit(handler.path)
+        query = {key : value[0] for key, value in parse_qs(url.query, keep_blank_values=True).items()}
+
+        with self._lock:
+            self.counts[url.path] += 1
+
+            failed = self._random.random() < self.fail_rate
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if failed:
+            return self._send(handler, 503, b'Service Unavailable')
+
+        if url.path == '/login_sid.lua':
+            return self._send(handler, 200, self._login(query), 'text/xml')
+
+        with self._lock:
+            valid = query.get('sid') in self.sids
+
+        if not valid:
+            return self._send(handler, 403, b'Forbidden')
+
+        if url.path == '/data.lua' and query.get('page') == 'wSet':
+            page = json.dumps({'data' : {'net' : {'devices' : self.devices}}}).encode('utf-8')
+
+            return self._send(handler, 200, page, 'application/json')
+
+        if url.path == '/devicehostlist.lua':
+            return self._send(handler, 200, self._host_list(), 'text/xml')
+
+        if url.path == '/webservices/homeautoswitch.lua':
+            page = self._homeauto(query.get('switchcmd'), query.get('ain'))
+
+            if page is not None:
+                return self._send(handler, 200, page, 'text/xml' if page.startswith(b'<') else 'text/plain')
+
+        return self._send(handler, 404, b'Not Found')
+
+
+    def _handle_soap(self, handler):
+        """Answer a TR-064 action of a client."""
+
+        body = handler.rfile.read(int(handler.headers.get('Content-Length', 0)))
+        action = handler.headers.get('SOAPAction', '').rpartition('#')[2]
+
+        with self._lock:
+            self.counts[action] += 1
+
+        if not self._authorized(handler):
+            with self._lock:
+                nonce = '%016x' % self._random.getrandbits(64)
+
+            handler.send_response(401)
+            handler.send_header('WWW-Authenticate', 'Digest realm="%s", nonce="%s", algorithm=MD5, qop="auth"'
+                                % (TR064_REALM, nonce))
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+
+            return
+
+        if action == 'X_AVM-DE_GetHostListPath':
+            with self._lock:
+                sid = '%016x' % self._random.getrandbits(64)
+
+                self.sids.add(sid)
+
+            return self._send_soap(handler, action, {'NewX_AVM-DE_HostListPath' : '/devicehostlist.lua?sid=' + sid})
+
+        if action == 'GetSpecificHostEntry':
+            mac = re.search(rb'<NewMACAddress>([^<]*)</NewMACAddress>', body).group(1).decode('utf-8')
+
+            for device in self.devices:
+                if device['mac'] == mac:
+                    return self._send_soap(handler, action, {'NewIPAddress' : device['ip'],
+                                                             'NewAddressSource' : 'DHCP',
+                                                             'NewLeaseTimeRemaining' : '0',
+                                                             'NewInterfaceType' : '802.11',
+                                                             'NewActive' : '1',
+                                                             'NewHostName' : device['name']})
+
+            return self._send(handler, 500, (SOAP_RESPONSE % (SOAP_FAULT % ('714', 'NoSuchEntryInArray'))).encode('utf-8'),
+                              'text/xml')
+
+        return self._send(handler, 500, (SOAP_RESPONSE % (SOAP_FAULT % ('401', 'Invalid Action'))).encode('utf-8'),
+                          'text/xml')
+
+
+    def _authorized(self, handler):
+        """Check the digest authorization of a TR-064 request."""
+
+        fields = dict(re.findall(r'(\w+)="?([^",]*)"?', handler.headers.get('Authorization', '')))
+
+        if not fields or (self.user is not None and fields.get('username') != self.user):
+            return False
+
+        md5 = lambda text: hashlib.md5(text.encode('utf-8')).hexdigest()
+
+        ha1 = md5('%s:%s:%s' % (fields['username'], TR064_REALM, self.password))
+        ha2 = md5('POST:%s' % (fields['uri']))
+
+        return fields['response'] == md5('%s:%s:%s:%s:%s:%s' % (ha1, fields['nonce'], fields['nc'],
+                                                                  fields['cnonce'], fields['qop'], ha2))
+
+
+    def _send_soap(self, handler, action, arguments):
+        """Send the response envelope of a TR-064 action."""
+
+        response = '<u:%sResponse xmlns:u="urn:dslforum-org:service:Hosts:1">%s</u:%sResponse>' \
+                   % (action, ''.join('<%s>%s</%s>' % (name, value, name) for name, value in arguments.items()), action)
+
+        self._send(handler, 200, (SOAP_RESPONSE % response).encode('utf-8'), 'text/xml')
+
+
+    def _host_list(self):
+        """Return the <List> host list file of the TR-064 Hosts service."""
+
+        items = ''.join('<Item><Index>%d</Index><IPAddress>%s</IPAddress><MACAddress>%s</MACAddress>'
+                        '<Active>1</Active><HostName>%s</HostName><InterfaceType>802.11</InterfaceType>'
+                        '<X_AVM-DE_Port>0</X_AVM-DE_Port><X_AVM-DE_Speed>0</X_AVM-DE_Speed></Item>'
+                        % (i + 1, device['ip'], device['mac'], device['name'])
+                        for i, device in enumerate(self.devices))
+
+        return ('<?xml version="1.0" ?><List>' + items + '</List>').encode('utf-8')
+
+
+    def _login(self, query):
+        """Return the SessionInfo page for a login request."""
+
+        sid = INVALID_SID
+
+        challenge = self.pbkdf2_challenge if self.pbkdf2 and query.get('version') == '2' else self.challenge
+
+        with self._lock:
+            if 'response' in query:
+                if query['response'] == self._expected_response(challenge) and \
+                   (self.user is None or query.get('username') == self.user):
+                    sid = '%016x' % self._random.getrandbits(64)
+
+                    self.sids.add(sid)
+            elif query.get('sid') in self.sids:
+                sid = query['sid']
+
+        return ('<?xml version="1.0" encoding="utf-8"?><SessionInfo><SID>%s</SID><Challenge>%s</Challenge>'
+                '<BlockTime>0</BlockTime><Rights></Rights></SessionInfo>' % (sid, challenge)).encode('utf-8')
+
+
+    def _expected_response(self, challenge):
+        """Return the expected response of a client to the given challenge."""
+
+        if challenge.startswith('2$'):
+            _, iter1, salt1, iter2, salt2 = challenge.split('$')
+
+            hash1 = hashlib.pbkdf2_hmac('sha256', self.password.encode('utf-8'), bytes.fromhex(salt1), int(iter1))
+            hash2 = hashlib.pbkdf2_hmac('sha256', hash1, bytes.fromhex(salt2), int(iter2))
+
+            return salt2 + '$' + hash2.hex()
+
+        return challenge + '-' + hashlib.md5((challenge + '-' + self.password).encode('utf-16le')).hexdigest()
+
+
+    def _homeauto(self, command, ain):
+        """Return the answer of a home automation command, None for unknown commands or AINs."""
+
+        if command == 'getswitchlist':
+            return (','.join(self.plugs) + '\n').encode('utf-8')
+
+        if command == 'getdevicelistinfos':
+            return self._device_list()
+
+        if ain in self.groups:
+            members = self.groups[ain]
+        elif ain in self.plugs:
+            members = [ain]
+        else:
+            return None
+
+        with self._lock:
+            if command == 'setswitchon':
+                state = True
+            elif command == 'setswitchoff':
+                state = False
+            elif command == 'setswitchtoggle':
+                state = not self.plugs[members[0]]
+            elif command == 'getswitchstate':
+                state = self.plugs[members[0]]
+            else:
+                return None
+
+            for member in members:
+                self.plugs[member] = state
+
+            return b'1\n' if state else b'0\n'
+
+
+    def _device_list(self):
+        """Return the <devicelist> page of getdevicelistinfos."""
+
+        devices = []
+
+        for i, (ain, state) in enumerate(self.plugs.items()):
+            devices.append('<device identifier="%s %s" id="%d" functionbitmask="%d" fwversion="04.16" '
+                           'manufacturer="AVM" productname="FRITZ!DECT 200"><present>1</present>'
+                           '<name>Plug %d</name><switch><state>%d</state><mode>manuell</mode><lock>0</lock>'
+                           '<devicelock>0</devicelock></switch><powermeter><voltage>230000</voltage>'
+                           '<power>1500</power><energy>42</energy></powermeter><temperature>'
+                           '<celsius>215</celsius><offset>0</offset></temperature></device>'
+                           % (ain[:5], ain[5:], 16 + i, SWITCH_PLUG_FUNCTIONS, i, state))
+
+        for i, ain in enumerate(self.repeaters):
+            devices.append('<device identifier="%s %s" id="%d" functionbitmask="%d" fwversion="04.16" '
+                           'manufacturer="AVM" productname="FRITZ!DECT Repeater 100"><present>1</present>'
+                           '<name>Repeater %d</name><temperature><celsius>215</celsius><offset>0</offset>'
+                           '</temperature></device>'
+                           % (ain[:5], ain[5:], 400 + i, REPEATER_FUNCTIONS, i))
+
+        ids = {ain : 16 + i for i, ain in enumerate(self.plugs)}
+
+        for i, (ain, members) in enumerate(self.groups.items()):
+            devices.append('<group identifier="%s" id="%d" functionbitmask="%d" fwversion="1.0" manufacturer="AVM" '
+                           'productname=""><present>1</present><name>Group %d</name><switch><state>%d</state>'
+                           '</switch><groupinfo><masterdeviceid>0</masterdeviceid><members>%s</members>'
+                           '</groupinfo></group>'
+                           % (ain, 900 + i, 1 << 9, i, self.plugs[members[0]],
+                              ','.join(str(ids[member]) for member in members)))
+
+        return ('<devicelist version="1">' + ''.join(devices) + '</devicelist>').encode('utf-8')
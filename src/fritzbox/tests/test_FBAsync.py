@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This test module will test the functionality of the module FBAsync against the FritzBox emulator
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import sys
+import os
+import asyncio
+import inspect
+import time
+import pytest
+
+from unittest import mock, TestCase
+from unittest.mock import patch, Mock
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up,'..'))
+
+
+#===============================================================================
+# User imports
+#===============================================================================
+from FBEmulator import FBEmulator
+from FBAsync import AsyncFritzBox, AsyncFBPresence, AsyncFBHomeAuto
+from FBCore import SESSION_TIMEOUT
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+IP       = '127.0.0.1'
+PASSWORD = 'secret'
+
+
+#===============================================================================
+# Test class definitions
+#===============================================================================
+class test_CLASS(TestCase):
+    """Test class that contains all test cases"""
+    def setUp(self):
+        self.emulator = FBEmulator(password=PASSWORD, devices=20, plugs=3)
+        self.emulator.start()
+
+
+    def tearDown(self):
+        self.emulator.stop()
+
+
+    def test_no_blocking_methods(self):
+        for cls, name in ((AsyncFritzBox, 'add_hook'), (AsyncFBPresence, '_update_device_list'),
+                          (AsyncFBHomeAuto, '_iter_device_list')):
+            assert not hasattr(cls, name)
+
+        assert asyncio.iscoroutinefunction(AsyncFritzBox.open_fritzbox_page)
+        assert inspect.isasyncgenfunction(AsyncFBHomeAuto.iter_device_list_infos)
+
+
+    def test_single_flight_login(self):
+        async def run():
+            fb_p = AsyncFBPresence(IP, PASSWORD, port=self.emulator.port)
+
+            assert await fb_p.fb.login() == True
+
+            self.emulator.expire_sessions()
+            self.emulator.latency = 0.01
+
+            results = await asyncio.gather(*(fb_p.get_wlan_device_information() for i in range(5)))
+
+            await fb_p.fb.close()
+
+            return results
+
+        results = asyncio.run(run())
+
+        assert None not in results
+        assert self.emulator.counts['/login_sid.lua'] == 4
+
+
+    def test_failed_load(self):
+        async def run():
+            fb_p = AsyncFBPresence(IP, 'wrong', port=self.emulator.port)
+
+            result = await fb_p.get_wlan_device_information()
+
+            await fb_p.fb.close()
+
+            return result
+
+        assert asyncio.run(run()) == None
+
+
+    def test_timeouts(self):
+        async def run():
+            fb = AsyncFritzBox(IP, PASSWORD, port=self.emulator.port, pool_size=1,
+                               connect_timeout=0.05, read_timeout=0.05)
+
+            self.emulator.latency = 0.5
+
+            start = time.time()
+
+            assert await fb.login() == False
+            assert time.time() - start < 0.4
+
+            self.emulator.latency = 0
+
+            assert await fb.login() == True
+
+            response = await fb.pool.open('GET', '/data.lua?page=wSet', {})
+
+            with pytest.raises(asyncio.TimeoutError):
+                await fb.pool.open('GET', '/data.lua?page=wSet', {})
+
+            async with response:
+                await response.read()
+
+            assert await fb.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+
+            await fb.close()
+
+        asyncio.run(run())
+
+
+    def test_presence_outage(self):
+        async def run():
+            fb_p = AsyncFBPresence(IP, PASSWORD, port=self.emulator.port)
+
+            assert await fb_p.is_device_present(device_name='device3') == True
+
+            self.emulator.fail_rate = 1
+
+            assert await fb_p.is_device_present(device_name='device3', debounce_off=1) == True
+            assert await fb_p.is_device_present(ip=self.emulator.devices[3]['ip']) == False
+
+            await fb_p.fb.close()
+
+        asyncio.run(run())
+
+
+    def test_session_refresh(self):
+        async def run():
+            fb = AsyncFritzBox(IP, PASSWORD, port=self.emulator.port)
+
+            assert await fb.login() == True
+
+            sid = fb.sid
+            fb.sid_ts -= SESSION_TIMEOUT
+
+            fb.start_session_refresh()
+
+            await asyncio.sleep(0.1)
+
+            assert fb.sid == sid
+            assert fb.is_session_valid() == True
+
+            await fb.close()
+
+            assert fb._refresh_task is None
+
+        asyncio.run(run())
+
+        assert self.emulator.counts['/login_sid.lua'] == 3
+
+
+    def test_iter_events(self):
+        async def run():
+            fb_p = AsyncFBPresence(IP, PASSWORD, poll_interval=0.05, port=self.emulator.port)
+
+            events = []
+
+            async for event in fb_p.iter_events(timeout=0.5):
+                events.append(event)
+
+                if len(events) == 20:
+                    break
+
+            await fb_p.stop_supervision()
+            await fb_p.fb.close()
+
+            return fb_p, events
+
+        fb_p, events = asyncio.run(run())
+
+        assert [event.kind for event in events] == ['joined'] * 20
+        assert len(fb_p.device_list) == 20
+        assert fb_p.events.has_subscribers() == False
+
+
+    def test_supervise_device(self):
+        changes = []
+
+        async def run():
+            fb_p = AsyncFBPresence(IP, PASSWORD, poll_interval=0.02, port=self.emulator.port)
+
+            handle = fb_p.supervise_device('device3', lambda *change: changes.append(change))
+
+            await asyncio.sleep(0.1)
+
+            del self.emulator.devices[3]
+
+            await asyncio.sleep(0.1)
+
+            handle.unregister()
+
+            await fb_p.stop_supervision()
+            await fb_p.fb.close()
+
+            return fb_p
+
+        fb_p = asyncio.run(run())
+
+        assert changes == [('device3', True, False)]
+        assert fb_p.supervisor.get_metrics()['devices'] == 0
+
+        # The device records are kept without a blocking transport
+        assert fb_p.presence.fb is None
+
+
+    def test_is_device_present(self):
+        async def run():
+            fb_p = AsyncFBPresence(IP, PASSWORD, port=self.emulator.port)
+
+            assert await fb_p.is_device_present(device_name='device3') == True
+            assert await fb_p.is_device_present(mac='00-11-22-00-00-03') == True
+            assert await fb_p.is_device_present(ip=self.emulator.devices[3]['ip']) == True
+            assert await fb_p.is_device_present(mac='00:11:22:FF:FF:FF') == False
+
+            await fb_p.fb.close()
+
+            fb_p = AsyncFBPresence(IP, PASSWORD, port=self.emulator.port, backend='tr064',
+                                   tr064_port=self.emulator.port)
+
+            assert await fb_p.is_device_present(mac='00-11-22-00-00-13') == True
+            assert await fb_p.is_device_present(mac='00:11:22:FF:FF:FF') == False
+            assert await fb_p.is_device_present(device_name='device3') == True
+            assert fb_p.device_list['device3'].conn_type == 'wlan'
+
+            await fb_p.fb.close()
+
+        asyncio.run(run())
+
+        assert self.emulator.counts['/data.lua'] == 4
+        assert self.emulator.counts['/devicehostlist.lua'] == 1
+
+
+    def test_homeauto(self):
+        emulator = FBEmulator(password=PASSWORD, plugs=5, groups=[[0, 1], [3, 4]])
+
+        async def run():
+            fb_h = AsyncFBHomeAuto(IP, PASSWORD, port=emulator.port)
+
+            ains = await fb_h.get_switch_plugs()
+
+            assert await fb_h.get_switch_plug_state(ains[0]) == '0'
+            assert await fb_h.set_switch_plugs_state(ains, 'on') == dict.fromkeys(ains, '1')
+
+            actors = await fb_h.get_device_list_infos()
+
+            connections = emulator.connections
+
+            streamed = [actor async for actor in fb_h.iter_device_list_infos(fields={'switch_state'})]
+
+            # The completely read response gives its connection back to the pool
+            assert emulator.connections == connections
+            assert len(fb_h.fb.pool._idle) > 0
+
+            await fb_h.fb.close()
+
+            return ains, actors, streamed
+
+        with emulator:
+            ains, actors, streamed = asyncio.run(run())
+
+            assert len(ains) == 5
+            assert [actor.ain for actor in actors if not actor.is_group] == ains
+            assert [actor.ain for actor in streamed] == [actor.ain for actor in actors]
+            assert [actor.switch_state for actor in streamed if not actor.is_group] == [True] * 5
+            assert list(emulator.plugs.values()) == [True] * 5
+            assert emulator.counts['/webservices/homeautoswitch.lua'] == 8
+
+
+    def test_homeauto_failed_load(self):
+        async def run():
+            fb_h = AsyncFBHomeAuto(IP, 'wrong', port=self.emulator.port)
+
+            results = (await fb_h.get_switch_plugs(),
+                       await fb_h.get_switch_plug_state('087610000434'),
+                       await fb_h.toggle_switch_plug_state('087610000434'))
+
+            await fb_h.fb.close()
+
+            return results
+
+        assert asyncio.run(run()) == (None, None, None)
+
+
+#===============================================================================
+# Start of program
+#===============================================================================
+if __name__ == '__main__':
+    unittest.main()
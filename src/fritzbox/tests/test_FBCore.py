@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This test module will test the functionality of the module FBCore
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import sys
+import os
+import threading
+import tempfile
+import time
+import pytest
+
+from unittest import mock, TestCase
+from unittest.mock import patch, Mock
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up,'..'))
+
+
+#===============================================================================
+# User imports
+#===============================================================================
+from FBEmulator import FBEmulator
+from FBCore import FritzBox, FBSessionStore, get_runtime_dir, get_connection_pool, connection_pools, HTTP_PORT, parse_session_info, calculate_challenge_response, INVALID_SID, FBCircuitBreaker, FBConnectionPool, FritzBoxUnavailableError, SESSION_TIMEOUT, HOOK_PRE_REQUEST, HOOK_POST_RESPONSE, HOOK_ERROR, BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+IP                = '192.168.0.1'
+PASSWORD          = 'abc'
+SID               = '0123456789abcdef'
+PAGE              = b'page'
+RESPONSE_OK       = (200, 'OK', PAGE)
+RESPONSE_REJECTED = (403, 'Forbidden', b'')
+SESSION_INFO      = (b'<?xml version="1.0" encoding="utf-8"?><SessionInfo><SID>0000000000000000</SID>'
+                     b'<Challenge>2$10000$5A1711$2000$5A1722</Challenge><BlockTime>0</BlockTime>'
+                     b'<Rights></Rights></SessionInfo>')
+
+
+#===============================================================================
+# Test class definitions
+#===============================================================================
+class test_CLASS(TestCase):
+    """Test class that contains all test cases"""
+    def setUp(self):
+        self.fb = FritzBox(ip=IP, password=PASSWORD)
+
+
+    def tearDown(self):
+        pass
+
+
+    def _login(self):
+        self.fb.sid = SID
+        self.fb.sid_ts = 1000
+
+        return True
+
+
+    def test_init(self):
+        assert self.fb.sid == ''
+        assert self.fb.is_session_valid() == False
+
+
+    @patch('FBCore.time.time', autospec=True)
+    def test_session_is_reused(self, time_mock):
+        time_mock.return_value = 1000
+
+        with patch.object(self.fb, 'login', side_effect=self._login) as login_mock, \
+             patch.object(self.fb, '_load_page', return_value=RESPONSE_OK) as load_mock:
+            assert self.fb.load_fritzbox_page('/data.lua', '') == PAGE
+            assert self.fb.load_fritzbox_page('/data.lua', '') == PAGE
+
+            assert login_mock.call_count == 1
+            assert load_mock.call_count == 2
+
+            time_mock.return_value = 1000 + SESSION_TIMEOUT
+
+            assert self.fb.load_fritzbox_page('/data.lua', '') == PAGE
+            assert login_mock.call_count == 2
+
+
+    @patch('FBCore.time.time', autospec=True)
+    def test_ensure_session(self, time_mock):
+        time_mock.return_value = 1000
+
+        with patch.object(self.fb, 'login', side_effect=self._login) as login_mock:
+            assert self.fb.ensure_session() == True
+            assert self.fb.ensure_session() == True
+
+            assert login_mock.call_count == 1
+
+
+    @patch('FBCore.time.time', autospec=True)
+    def test_rejected_session_triggers_login(self, time_mock):
+        time_mock.return_value = 1000
+
+        with patch.object(self.fb, 'login', side_effect=self._login) as login_mock, \
+             patch.object(self.fb, '_load_page', side_effect=[RESPONSE_REJECTED, RESPONSE_OK]) as load_mock:
+            self._login()
+
+            assert self.fb.load_fritzbox_page('/data.lua', '') == PAGE
+
+            assert login_mock.call_count == 1
+            assert load_mock.call_count == 2
+
+
+    @patch('FBCore.time.time', autospec=True)
+    def test_response_cache(self, time_mock):
+        time_mock.return_value = 1000
+
+        self.fb.set_cache_ttl('/webservices/homeautoswitch.lua', 5)
+
+        with patch.object(self.fb, '_load_fritzbox_page', return_value=PAGE) as load_mock:
+            assert self.fb.load_fritzbox_page('/webservices/homeautoswitch.lua', '&switchcmd=getswitchlist') == PAGE
+            assert self.fb.load_fritzbox_page('/webservices/homeautoswitch.lua', '&switchcmd=getswitchlist') == PAGE
+            assert load_mock.call_count == 1
+
+            self.fb.load_fritzbox_page('/data.lua', '')
+            self.fb.load_fritzbox_page('/data.lua', '')
+            assert load_mock.call_count == 3
+
+            time_mock.return_value = 1005
+
+            self.fb.load_fritzbox_page('/webservices/homeautoswitch.lua', '&switchcmd=getswitchlist')
+            assert load_mock.call_count == 4
+
+            self.fb.load_fritzbox_page('/webservices/homeautoswitch.lua', '&switchcmd=setswitchon&ain=1')
+            self.fb.load_fritzbox_page('/webservices/homeautoswitch.lua', '&switchcmd=setswitchon&ain=1')
+            self.fb.load_fritzbox_page('/webservices/homeautoswitch.lua', '&switchcmd=getswitchlist')
+            assert load_mock.call_count == 7
+
+
+    def test_response_cache_coalescing(self):
+        self.fb.set_cache_ttl('/data.lua', 0)
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def load_page(url, param):
+            started.set()
+            release.wait(5)
+
+            return PAGE
+
+        with patch.object(self.fb, '_load_fritzbox_page', side_effect=load_page) as load_mock:
+            results = []
+
+            threads = [threading.Thread(target=lambda: results.append(self.fb.load_fritzbox_page('/data.lua', '')))
+                       for i in range(4)]
+
+            threads[0].start()
+            started.wait(5)
+
+            for thread in threads[1:]:
+                thread.start()
+
+            while self.fb.cache.stats['coalesced'] < 3:
+                release.wait(0.01)
+
+            release.set()
+
+            for thread in threads:
+                thread.join(5)
+
+            assert results == [PAGE] * 4
+            assert load_mock.call_count == 1
+
+
+    @patch('FBCore.time.time', autospec=True)
+    def test_circuit_breaker(self, time_mock):
+        time_mock.return_value = 1000
+
+        breaker = FBCircuitBreaker(failure_threshold=2, reset_timeout=10)
+
+        breaker.record_failure()
+        assert breaker.allow_request() == True
+
+        breaker.record_failure()
+        assert breaker.state == BREAKER_OPEN
+        assert breaker.allow_request() == False
+
+        time_mock.return_value = 1010
+
+        assert breaker.allow_request() == True
+        assert breaker.state == BREAKER_HALF_OPEN
+        assert breaker.allow_request() == False
+
+        breaker.record_failure()
+        assert breaker.state == BREAKER_OPEN
+
+        time_mock.return_value = 1020
+
+        assert breaker.allow_request() == True
+
+        breaker.record_success()
+        assert breaker.state == BREAKER_CLOSED
+        assert breaker.allow_request() == True
+
+
+    @patch('FBCore.time.sleep', autospec=True)
+    def test_read_is_retried(self, sleep_mock):
+        self._login()
+        self.fb.sid_ts = float('inf')
+
+        with patch.object(self.fb.pool, 'request', side_effect=[OSError(), TimeoutError(), RESPONSE_OK]) as request_mock:
+            assert self.fb.load_fritzbox_page('/data.lua', '') == PAGE
+
+            assert request_mock.call_count == 3
+            assert sleep_mock.call_count == 2
+
+        with patch.object(self.fb.pool, 'request', side_effect=OSError()) as request_mock:
+            assert self.fb.load_fritzbox_page('/data.lua', '') == None
+
+            assert request_mock.call_count == self.fb.retries + 1
+
+
+    @patch('FBCore.time.sleep', autospec=True)
+    def test_write_is_not_retried(self, sleep_mock):
+        self._login()
+        self.fb.sid_ts = float('inf')
+
+        with patch.object(self.fb.pool, 'request', side_effect=OSError()) as request_mock:
+            assert self.fb.load_fritzbox_page('/webservices/homeautoswitch.lua', '&switchcmd=setswitchon&ain=1') == None
+
+            assert request_mock.call_count == 1
+            assert sleep_mock.call_count == 0
+
+
+    def test_pool_fails_fast_while_breaker_is_open(self):
+        pool = FBConnectionPool(IP)
+
+        with patch.object(pool, '_open', side_effect=OSError()) as open_mock:
+            for i in range(pool.breaker.failure_threshold):
+                with pytest.raises(OSError):
+                    pool.open('GET', '/data.lua', {})
+
+            with pytest.raises(FritzBoxUnavailableError):
+                pool.open('GET', '/data.lua', {})
+
+            assert open_mock.call_count == pool.breaker.failure_threshold
+
+
+    def test_pool_reuses_connections(self):
+        with FBEmulator(PASSWORD) as emulator:
+            fb1 = FritzBox('127.0.0.1', PASSWORD, port=emulator.port)
+            fb2 = FritzBox('127.0.0.1', PASSWORD, port=emulator.port)
+
+            assert fb1.pool is fb2.pool
+
+            for fb in (fb1, fb2, fb1):
+                assert fb.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+
+            assert emulator.counts['/data.lua'] == 3
+            assert emulator.connections == 1
+
+
+    def test_shared_pool_settings(self):
+        try:
+            pool = get_connection_pool('pool.test', size=2, read_timeout=5)
+
+            with self.assertNoLogs('FBCore', level='WARNING'):
+                assert get_connection_pool('pool.test', size=2, read_timeout=5) is pool
+
+            with self.assertLogs('FBCore', level='WARNING') as logs:
+                assert get_connection_pool('pool.test', size=4, read_timeout=5) is pool
+
+            assert 'size=4 (pool uses 2)' in logs.output[0]
+            assert 'read_timeout' not in logs.output[0]
+        finally:
+            connection_pools.pop(('pool.test', HTTP_PORT), None)
+
+
+    def test_pool_size_limit(self):
+        with FBEmulator(PASSWORD, latency=0.02) as emulator:
+            fb = FritzBox('127.0.0.1', PASSWORD, port=emulator.port, pool_size=2)
+
+            assert fb.login() == True
+
+            threads = [threading.Thread(target=fb.load_fritzbox_page, args=('/data.lua', '&page=wSet'))
+                       for i in range(8)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+            assert emulator.counts['/data.lua'] == 8
+            assert emulator.connections == 2
+            assert len(fb.pool._idle) == 2
+
+
+    def test_pool_slot_timeout(self):
+        with FBEmulator(PASSWORD) as emulator:
+            pool = FBConnectionPool('127.0.0.1', emulator.port, size=1, connect_timeout=0.05)
+
+            with pool.open('GET', '/data.lua?page=wSet', {}) as response:
+                start = time.time()
+
+                with pytest.raises(TimeoutError):
+                    pool.open('GET', '/data.lua?page=wSet', {})
+
+                assert time.time() - start < 1
+
+                response.read()
+
+            assert pool.request('GET', '/data.lua?page=wSet', {})[0] in (200, 403)
+
+            pool.close()
+
+
+    def test_pool_idle_eviction(self):
+        with FBEmulator(PASSWORD) as emulator:
+            fb = FritzBox('127.0.0.1', PASSWORD, port=emulator.port, pool_idle_timeout=0.05)
+
+            assert fb.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+            assert emulator.connections == 1
+
+            time.sleep(0.1)
+
+            assert fb.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+            assert emulator.connections == 2
+            assert len(fb.pool._idle) == 1
+
+
+    @patch('FBCore.time.sleep', autospec=True)
+    def test_pool_reconnects_stale_connection(self, sleep_mock):
+        with FBEmulator(PASSWORD) as emulator:
+            fb = FritzBox('127.0.0.1', PASSWORD, port=emulator.port)
+
+            assert fb.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+
+            emulator.close_connections()
+
+            assert fb.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+            assert emulator.connections == 2
+            assert emulator.counts['/data.lua'] == 2
+            assert fb.pool.breaker.state == BREAKER_CLOSED
+            sleep_mock.assert_not_called()
+
+
+    @patch('FBCore.time.sleep', autospec=True)
+    def test_request_hooks(self, sleep_mock):
+        infos = {HOOK_PRE_REQUEST : [], HOOK_POST_RESPONSE : [], HOOK_ERROR : []}
+
+        for kind, hook_infos in infos.items():
+            self.fb.add_hook(kind, hook_infos.append)
+
+        failures = [OSError()]
+
+        def request(method, url, headers, timings, body=None):
+            if failures:
+                raise failures.pop()
+
+            timings.update({'connect' : 0.0, 'ttfb' : 0.1, 'download' : 0.2})
+
+            return RESPONSE_OK
+
+        with patch.object(self.fb, 'login', side_effect=self._login), \
+             patch.object(self.fb.pool, 'request', side_effect=request):
+            assert self.fb.load_fritzbox_page('/data.lua', '&page=wSet', parse=len) == len(PAGE)
+
+        assert [(info.url, info.attempt) for info in infos[HOOK_PRE_REQUEST]] == [('/data.lua', 0), ('/data.lua', 1)]
+        assert isinstance(infos[HOOK_ERROR][0].error, OSError)
+
+        info = infos[HOOK_POST_RESPONSE][0]
+        assert (info.status, info.size, info.relogin) == (200, len(PAGE), True)
+        assert (info.connect, info.ttfb, info.download) == (0.0, 0.1, 0.2)
+        assert info.parse >= 0
+
+        counters, latencies = self.fb.stats.snapshot()
+        assert (counters['requests'], counters['errors'], counters['retries']) == (1, 1, 1)
+        assert latencies[('/data.lua', 'ttfb')].count == 1
+
+
+    def test_parse_session_info(self):
+        assert parse_session_info(SESSION_INFO) == (INVALID_SID, '2$10000$5A1711$2000$5A1722')
+        assert parse_session_info(b'<SessionInfo><SID>' + SID.encode() + b'</SID></SessionInfo>') == (SID, '')
+        assert parse_session_info(b'') == (INVALID_SID, '')
+
+
+    def test_challenge_response(self):
+        assert calculate_challenge_response('2$10000$5A1711$2000$5A1722', '1example!') == \
+            '5A1722$1798a1672bca7c6463d6b245f82b53703b0f50813401b03e4045a5861e689adb'
+        assert calculate_challenge_response('1234567z', '\u00e4bc') == '1234567z-9e224a41eeefa284df7bb0f26c2913e2'
+
+        with pytest.raises(ValueError):
+            calculate_challenge_response('2$10000$5A1711', PASSWORD)
+
+
+    @patch('FBCore.time.time')
+    def test_session_store(self, time_mock):
+        time_mock.return_value = 1000
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = FBSessionStore(os.path.join(tmpdir, 'sessions.json'))
+
+            assert store.get('box') is None
+
+            store.put('box', SID, 1000)
+
+            assert FBSessionStore(store.path).get('box') == (SID, 1000)
+
+            store.remove('box', 'fedcba9876543210')
+            assert store.get('box') == (SID, 1000)
+
+            time_mock.return_value = 1000 + SESSION_TIMEOUT
+            assert store.get('box') is None
+
+            time_mock.return_value = 1000
+            store.remove('box', SID)
+            assert store.get('box') is None
+
+            # Files accessible by others are not used
+            store.put('box', SID, 1000)
+            os.chmod(store.path, 0o644)
+
+            assert store.get('box') is None
+
+            store.put('box', 'fedcba9876543210', 1000)
+
+            os.chmod(store.path, 0o600)
+            assert store.get('box') == (SID, 1000)
+
+
+    def test_failed_session_refresh(self):
+        self.fb.sid = SID
+        self.fb.sid_ts = time.time() - SESSION_TIMEOUT
+
+        with patch.object(self.fb, 'refresh_session', autospec=True, return_value=False) as refresh_mock:
+            self.fb.start_session_refresh()
+
+            time.sleep(0.2)
+
+            self.fb.stop_session_refresh()
+            self.fb._refresh_thread.join(1)
+
+        # A failed refresh is not repeated immediately
+        assert refresh_mock.call_count == 1
+
+
+    def test_runtime_dir(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+             patch.dict(os.environ, {'XDG_RUNTIME_DIR' : ''}), patch('FBCore.tempfile.tempdir', tmpdir):
+            runtime_dir = get_runtime_dir()
+
+            assert os.path.dirname(runtime_dir) == tmpdir
+            assert os.stat(runtime_dir).st_mode & 0o777 == 0o700
+            assert get_runtime_dir() == runtime_dir
+
+            os.chmod(runtime_dir, 0o755)
+
+            with pytest.raises(PermissionError):
+                get_runtime_dir()
+
+        with patch.dict(os.environ, {'XDG_RUNTIME_DIR' : '/run/user/1000'}):
+            assert get_runtime_dir() == '/run/user/1000'
+
+
+#===============================================================================
+# Start of program
+#===============================================================================
+if __name__ == '__main__':
+    unittest.main()
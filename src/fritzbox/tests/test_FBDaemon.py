@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This test module will test the functionality of the module FBDaemon
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import sys
+import os
+import tempfile
+import pytest
+
+from unittest import mock, TestCase
+from unittest.mock import patch, Mock
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up,'..'))
+
+
+#===============================================================================
+# User imports
+#===============================================================================
+from FBDaemon import FBDaemon, FBDaemonError, query_daemon, try_query_daemon
+from FBPresence import FBDevice
+from FBHomeAuto import FBHomeAuto, FBActor, FUNCTION_SWITCH_PLUG, FUNCTION_DECT_REPEATER
+from FBEmulator import FBEmulator
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+IP = '192.168.0.1'
+AIN = '087610500000'
+
+
+#===============================================================================
+# Test class definitions
+#===============================================================================
+class test_CLASS(TestCase):
+    """Test class that contains all test cases"""
+    def setUp(self):
+        self.fbpresence = Mock()
+        self.fbpresence.fb.ip = IP
+        self.fbpresence.get_wlan_device_information.return_value = (
+            {'Phone' : FBDevice('Phone', 'AA:BB:CC:DD:EE:01', '192.168.0.20', 'wlan', 100),
+             'Laptop' : FBDevice('Laptop', 'AA:BB:CC:DD:EE:02', '192.168.0.21', 'wlan', 50)}, 100)
+
+        self.fbhomeauto = Mock()
+        self.fbhomeauto.get_device_list_infos.return_value = [
+            FBActor(ain=AIN, id=16, functionbitmask=FUNCTION_SWITCH_PLUG, switch_state=True),
+            FBActor(ain='087611048079', id=17, functionbitmask=FUNCTION_DECT_REPEATER)]
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'fritzbox.sock')
+
+        self.daemon = FBDaemon(self.fbpresence, self.fbhomeauto, path=self.path, refresh_interval=3600)
+        self.daemon.start()
+
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.tmpdir.cleanup()
+
+
+    def test_queries(self):
+        assert query_daemon(self.path, 'present', name='Phone') == True
+        assert query_daemon(self.path, 'present', mac='aa-bb-cc-dd-ee-02') == False
+        assert query_daemon(self.path, 'present', ip='192.168.0.21', debounce_off=1) == True
+        assert query_daemon(self.path, 'present', name='unknown') == False
+        assert len(query_daemon(self.path, 'devices')['devices']) == 2
+        assert query_daemon(self.path, 'switch_plugs') == [AIN]
+        assert query_daemon(self.path, 'switch_state', ain=AIN) == '1'
+
+        with pytest.raises(FBDaemonError):
+            query_daemon(self.path, 'present')
+
+        with pytest.raises(FBDaemonError):
+            query_daemon(self.path, 'unknown')
+
+        # Queries are answered from memory
+        assert self.fbpresence.get_wlan_device_information.call_count == 1
+
+
+    def test_switch(self):
+        self.fbhomeauto.set_switch_plug_state.return_value = '0'
+
+        assert query_daemon(self.path, 'set_switch', ain=AIN, state='off') == '0'
+        assert query_daemon(self.path, 'switch_state', ain=AIN) == '0'
+
+        self.fbhomeauto.set_switch_plug_state.assert_called_once_with(AIN, 'off')
+
+
+    def test_socket_permissions(self):
+        assert os.stat(self.path).st_mode & 0o777 == 0o600
+
+
+    def test_switch_plugs_match_fritzbox(self):
+        with FBEmulator(plugs=3, groups=[[0, 1]], repeaters=2) as emulator:
+            fbhomeauto = FBHomeAuto('127.0.0.1', emulator.password, port=emulator.port)
+
+            daemon = FBDaemon(fbhomeauto=fbhomeauto, path=os.path.join(self.tmpdir.name, 'emulator.sock'))
+            daemon.start()
+
+            try:
+                assert query_daemon(daemon.path, 'switch_plugs') == fbhomeauto.get_switch_plugs()
+            finally:
+                daemon.stop()
+
+
+    def test_fallback(self):
+        self.daemon.stop()
+
+        assert os.path.exists(self.path) == False
+        assert try_query_daemon(self.path, 'ping') == (False, None)
+
+
+#===============================================================================
+# Start of program
+#===============================================================================
+if __name__ == '__main__':
+    unittest.main()
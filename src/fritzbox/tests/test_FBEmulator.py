@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This test module will test the functionality of the module FBCore, FBPresence and FBHomeAuto against the FritzBox emulator
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import sys
+import os
+import tempfile
+import threading
+import pytest
+
+from unittest import mock, TestCase
+from unittest.mock import patch, Mock
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up,'..'))
+
+
+#===============================================================================
+#===============================================================================
+# User imports
+#===============================================================================
+from FBEmulator import FBEmulator
+from FBCore import FritzBox, FBSessionStore
+from FBPresence import FBPresence
+from FBHomeAuto import FBHomeAuto
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+IP       = '127.0.0.1'
+PASSWORD = 'secret'
+
+
+#===============================================================================
+# Test class definitions
+#===============================================================================
+class test_CLASS(TestCase):
+    """Test class that contains all test cases"""
+    def setUp(self):
+        self.emulator = FBEmulator(password=PASSWORD, devices=20, plugs=3)
+        self.emulator.start()
+
+
+    def tearDown(self):
+        self.emulator.stop()
+
+
+    def test_session_reuse_and_relogin(self):
+        fb = FritzBox(IP, PASSWORD, port=self.emulator.port)
+
+        assert fb.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+        assert fb.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+        assert self.emulator.counts['/login_sid.lua'] == 2
+
+        self.emulator.expire_sessions()
+
+        assert fb.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+        assert self.emulator.counts['/login_sid.lua'] == 4
+        assert self.emulator.counts['/data.lua'] == 4
+
+
+    def test_single_flight_login(self):
+        fb = FritzBox(IP, PASSWORD, port=self.emulator.port, pool_size=8)
+
+        assert fb.login() == True
+
+        self.emulator.expire_sessions()
+        self.emulator.latency = 0.01
+
+        barrier = threading.Barrier(8)
+        pages = []
+
+        def load():
+            barrier.wait()
+            pages.append(fb.load_fritzbox_page('/data.lua', '&page=wSet'))
+
+        threads = [threading.Thread(target=load) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert len(pages) == 8 and None not in pages
+        assert self.emulator.counts['/login_sid.lua'] == 4
+
+
+    def test_wrong_password(self):
+        fb = FritzBox(IP, 'wrong', port=self.emulator.port)
+
+        assert fb.login() == False
+        assert fb.load_fritzbox_page('/data.lua', '&page=wSet') == None
+
+
+    def test_shared_session(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = FBSessionStore(os.path.join(tmpdir, 'sessions.json'))
+
+            fb1 = FritzBox(IP, PASSWORD, port=self.emulator.port, session_store=store)
+            fb2 = FritzBox(IP, PASSWORD, port=self.emulator.port, session_store=FBSessionStore(store.path))
+
+            assert fb1.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+            assert fb2.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+            assert fb2.sid == fb1.sid
+            assert self.emulator.counts['/login_sid.lua'] == 2
+
+            self.emulator.expire_sessions()
+
+            assert fb1.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+            assert fb2.load_fritzbox_page('/data.lua', '&page=wSet') is not None
+            assert fb2.sid == fb1.sid
+            assert self.emulator.counts['/login_sid.lua'] == 4
+
+
+    def test_pbkdf2_login(self):
+        self.emulator.pbkdf2 = True
+        self.emulator.user = 'admin'
+
+        assert FritzBox(IP, PASSWORD, port=self.emulator.port).login() == False
+        assert FritzBox(IP, PASSWORD, port=self.emulator.port, user='admin').login() == True
+        assert FritzBox(IP, 'wrong', port=self.emulator.port, user='admin').login() == False
+
+
+    def test_presence(self):
+        fb_p = FBPresence(IP, PASSWORD, port=self.emulator.port)
+
+        assert fb_p.is_device_present(device_name='device3') == True
+        assert fb_p.is_device_present(mac='00-11-22-00-00-13') == True
+        assert fb_p.is_device_present(device_name='unknown') == False
+        assert len(fb_p.device_list) == 20
+
+
+    def test_presence_tr064(self):
+        fb_p = FBPresence(IP, PASSWORD, port=self.emulator.port, backend='tr064', tr064_port=self.emulator.port)
+
+        assert fb_p.is_device_present(device_name='device3') == True
+        assert len(fb_p.device_list) == 20
+        assert fb_p.device_list['device3'].conn_type == 'wlan'
+        assert self.emulator.counts['/devicehostlist.lua'] == 1
+        assert self.emulator.counts['/data.lua'] == 0
+
+        # Only the first action is challenged, the digest credentials are reused afterwards
+        assert self.emulator.counts['X_AVM-DE_GetHostListPath'] == 2
+
+        assert fb_p.is_device_present(mac='00-11-22-00-00-13') == True
+        assert fb_p.is_device_present(mac='00:11:22:FF:FF:FF') == False
+        assert self.emulator.counts['GetSpecificHostEntry'] == 2
+        assert self.emulator.counts['/devicehostlist.lua'] == 1
+
+        # Further polls use the keep-alive connection of the pool
+        connections = self.emulator.connections
+
+        assert fb_p.get_wlan_device_information() is not None
+        assert self.emulator.counts['X_AVM-DE_GetHostListPath'] == 3
+        assert self.emulator.connections == connections
+
+        fb_p = FBPresence(IP, 'wrong', port=self.emulator.port, backend='tr064', tr064_port=self.emulator.port)
+
+        assert fb_p.get_wlan_device_information() == None
+        assert fb_p.is_device_present(mac='00-11-22-00-00-13') == False
+
+
+    def test_presence_outage(self):
+        fb_p = FBPresence(IP, PASSWORD, port=self.emulator.port)
+
+        assert fb_p.is_device_present(device_name='device3') == True
+
+        self.emulator.fail_rate = 1
+
+        # The known devices are evaluated while the FritzBox fails
+        assert fb_p.is_device_present(device_name='device3', debounce_off=1) == True
+        assert fb_p.is_device_present(mac='00-11-22-00-00-03') == False
+        assert fb_p.is_device_present(device_name='unknown') == False
+
+
+    def test_homeauto(self):
+        fb_h = FBHomeAuto(IP, PASSWORD, port=self.emulator.port)
+
+        ains = fb_h.get_switch_plugs()
+        assert len(ains) == 3
+        assert fb_h.get_switch_plug_state(ains[1]) == '0'
+
+        actors = fb_h.get_device_list_infos()
+        assert [actor.ain for actor in actors] == ains
+        assert actors[0].power == 1500
+        assert actors[0].temperature == 21.5
+
+
+    def test_set_switch_plugs_state(self):
+        emulator = FBEmulator(password=PASSWORD, plugs=5, groups=[[0, 1], [0, 1, 2], [3, 4]])
+
+        with emulator:
+            fb_h = FBHomeAuto(IP, PASSWORD, port=emulator.port)
+            ains = list(emulator.plugs)
+
+            assert fb_h.set_switch_plugs_state(ains[:4], 'on') == dict.fromkeys(ains[:4], '1')
+            assert list(emulator.plugs.values()) == [True, True, True, True, False]
+            assert emulator.counts['/webservices/homeautoswitch.lua'] == 3
+
+
+    def test_failure_injection(self):
+        self.emulator.fail_rate = 1.0
+
+        fb = FritzBox(IP, PASSWORD, port=self.emulator.port)
+
+        assert fb.load_fritzbox_page('/data.lua', '&page=wSet') == None
+
+
+#===============================================================================
+# Start of program
+#===============================================================================
+if __name__ == '__main__':
+    unittest.main()
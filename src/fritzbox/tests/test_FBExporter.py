@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This test module will test the functionality of the module FBExporter
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import sys
+import os
+import pytest
+
+from unittest import mock, TestCase
+from unittest.mock import patch, Mock
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up,'..'))
+
+
+#===============================================================================
+# User imports
+#===============================================================================
+from FBExporter import FBExporter
+from FBCore import FBRequestStats
+from FBPresence import FBDevice
+from FBHomeAuto import FBActor
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+IP = '192.168.0.1'
+
+
+#===============================================================================
+# Test class definitions
+#===============================================================================
+class test_CLASS(TestCase):
+    """Test class that contains all test cases"""
+    def setUp(self):
+        self.fbpresence = Mock()
+        self.fbpresence.fb.ip = IP
+        self.fbpresence.fb.stats = FBRequestStats()
+
+        self.fbhomeauto = Mock()
+        self.fbhomeauto.fb.ip = IP
+        self.fbhomeauto.fb.stats = FBRequestStats()
+
+        self.exporter = FBExporter(self.fbpresence, self.fbhomeauto)
+
+
+    def tearDown(self):
+        pass
+
+
+    def test_refresh(self):
+        self.fbpresence.get_wlan_device_information.return_value = (
+            {'Phone' : FBDevice('Phone', 'AA:BB:CC:DD:EE:01', '192.168.0.20', 'wlan', 100),
+             'Laptop' : FBDevice('Laptop', 'AA:BB:CC:DD:EE:02', '192.168.0.21', 'wlan', 50)}, 100)
+
+        self.fbhomeauto.get_device_list_infos.return_value = [FBActor(ain='087610500000', id='16', name='Plug "1"',
+                                                                      switch_state=True, power=1500, energy=42)]
+
+        self.fbpresence.fb.stats.count('logins')
+        self.fbpresence.fb.stats.observe('/data.lua', 'total', 0.02)
+        self.fbhomeauto.fb.stats.count('logins')
+        self.fbhomeauto.fb.stats.observe('/data.lua', 'total', 0.2)
+
+        self.exporter.refresh()
+
+        lines = self.exporter.page.decode().splitlines()
+
+        assert 'fritzbox_device_present{box="192.168.0.1",mac="AA:BB:CC:DD:EE:01",name="Phone"} 1.0' in lines
+        assert 'fritzbox_device_present{box="192.168.0.1",mac="AA:BB:CC:DD:EE:02",name="Laptop"} 0.0' in lines
+        assert 'fritzbox_switch_state{box="192.168.0.1",ain="087610500000",name="Plug \\"1\\""} 1.0' in lines
+        assert 'fritzbox_switch_power_watts{box="192.168.0.1",ain="087610500000",name="Plug \\"1\\""} 1.5' in lines
+        assert 'fritzbox_logins_total{box="192.168.0.1"} 2.0' in lines
+        assert 'fritzbox_request_duration_seconds_bucket{box="192.168.0.1",url="/data.lua",phase="total",le="0.025"} 1' in lines
+        assert 'fritzbox_request_duration_seconds_bucket{box="192.168.0.1",url="/data.lua",phase="total",le="+Inf"} 2' in lines
+
+        # Samples of a metric are not interleaved with other metrics
+        names = [line.split('{')[0].split(' ')[0] for line in lines if not line.startswith('#')]
+        assert len(set(names)) == len([name for i, name in enumerate(names) if i == 0 or names[i - 1] != name])
+
+
+    def test_failed_refresh(self):
+        self.fbpresence.get_wlan_device_information.side_effect = AttributeError()
+        self.fbhomeauto.get_device_list_infos.return_value = None
+
+        self.exporter.refresh()
+
+        lines = self.exporter.page.decode().splitlines()
+
+        assert 'fritzbox_presence_up{box="192.168.0.1"} 0.0' in lines
+        assert 'fritzbox_homeauto_up{box="192.168.0.1"} 0.0' in lines
+
+
+#===============================================================================
+# Start of program
+#===============================================================================
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This test module will test the functionality of the module FBFleet
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import sys
+import os
+import time
+import pytest
+
+from unittest import mock, TestCase
+from unittest.mock import patch, Mock
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up,'..'))
+
+
+#===============================================================================
+# User imports
+#===============================================================================
+from FBFleet import FBFleet, FleetPollError
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+BOXES             = [('192.168.0.1', 'abc'), ('192.168.1.1', 'def')]
+DEVICE            = {'box' : '192.168.0.1', 'name' : 'Phone', 'mac' : '', 'ip' : '', 'present' : True}
+SWITCH            = {'box' : '192.168.0.1', 'ain' : '087610000434', 'switch_state' : True}
+
+
+#===============================================================================
+# Test class definitions
+#===============================================================================
+class test_CLASS(TestCase):
+    """Test class that contains all test cases"""
+    @patch('FBFleet.fritzbox.FBHomeAuto.FBHomeAuto', autospec=True)
+    @patch('FBFleet.fritzbox.FBPresence.FBPresence', autospec=True)
+    def setUp(self, presence_mock, homeauto_mock):
+        self.fleet = FBFleet(BOXES, timeout=1)
+
+
+    def tearDown(self):
+        self.fleet.close()
+
+
+    def test_poll(self):
+        box1, box2 = self.fleet.members
+
+        box2.breaker.failure_threshold = 1
+
+        with patch.object(box1, 'poll', return_value=([DEVICE], [SWITCH])), \
+             patch.object(box2, 'poll', side_effect=FleetPollError('failed')) as poll_mock:
+            snapshot = self.fleet.poll()
+
+            assert snapshot['devices'] == [DEVICE]
+            assert snapshot['switches'] == [SWITCH]
+            assert snapshot['errors'] == {'192.168.1.1' : 'failed'}
+
+            snapshot = self.fleet.poll()
+
+            assert snapshot['devices'] == [DEVICE]
+            assert snapshot['errors'] == {'192.168.1.1' : 'Circuit breaker open'}
+            assert poll_mock.call_count == 1
+
+
+    @patch('FBFleet.fritzbox.FBHomeAuto.FBHomeAuto', autospec=True)
+    @patch('FBFleet.fritzbox.FBPresence.FBPresence', autospec=True)
+    def test_more_boxes_than_workers(self, presence_mock, homeauto_mock):
+        def poll():
+            time.sleep(0.1)
+
+            return [DEVICE], []
+
+        boxes = [('192.168.%d.1' % i, 'abc') for i in range(6)]
+
+        fleet = FBFleet(boxes, max_workers=2, timeout=0.15)
+
+        try:
+            for member in fleet.members:
+                member.poll = poll
+
+            # Queued FritzBoxes get their timeout once their poll started
+            for i in range(3):
+                snapshot = fleet.poll()
+
+                assert snapshot['errors'] == {}
+                assert len(snapshot['devices']) == 6
+
+            assert [member.breaker.failures for member in fleet.members] == [0] * 6
+
+            # FritzBoxes that do not answer block the workers, the others are dropped without failure
+            fleet.members[0].poll = fleet.members[1].poll = lambda: time.sleep(0.5)
+
+            snapshot = fleet.poll()
+
+            assert snapshot['errors'] == dict([(box[0], "Timeout") for box in boxes[:2]] +
+                                              [(box[0], "No free worker") for box in boxes[2:]])
+            assert [member.breaker.failures for member in fleet.members] == [1, 1, 0, 0, 0, 0]
+        finally:
+            fleet.close()
+
+
+#===============================================================================
+# Start of program
+#===============================================================================
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This test module will test the functionality of the module FBHistory
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import sys
+import os
+import tempfile
+import json
+import pytest
+
+from unittest import mock, TestCase
+from unittest.mock import patch, Mock
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up,'..'))
+
+
+#===============================================================================
+# User imports
+#===============================================================================
+from FBHistory import FBPresenceHistory
+from FBPresence import FBPresence, FBPresenceEvent, EVENT_JOINED, EVENT_LEFT, EVENT_CHANGED
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+PHONE  = 'AA:BB:CC:DD:EE:01'
+LAPTOP = 'AA:BB:CC:DD:EE:02'
+
+
+#===============================================================================
+# Test class definitions
+#===============================================================================
+class test_CLASS(TestCase):
+    """Test class that contains all test cases"""
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'history.db')
+
+        self.history = FBPresenceHistory(self.path, flush_size=3)
+
+
+    def tearDown(self):
+        if self.history._db is not None:
+            self.history._db.close()
+
+        self.dir.cleanup()
+
+
+    def _record(self, kind, mac, ts):
+        self.history.record(FBPresenceEvent(kind, mac, 'Device', '192.168.0.20', 'wlan', ts))
+
+
+    def test_batched_writes(self):
+        self._record(EVENT_JOINED, PHONE, 100)
+        self._record(EVENT_JOINED, PHONE, 110)
+        self._record(EVENT_CHANGED, PHONE, 120)
+        self._record(EVENT_JOINED, LAPTOP, 130)
+
+        assert len(self.history._pending) == 2
+
+        self._record(EVENT_LEFT, PHONE, 200)
+
+        assert self.history._pending == []
+        assert self.history.transitions() == [(PHONE, 100, True), (LAPTOP, 130, True), (PHONE, 200, False)]
+
+
+    def test_queries(self):
+        self._record(EVENT_JOINED, PHONE, 100)
+        self._record(EVENT_LEFT, PHONE, 200)
+        self._record(EVENT_JOINED, LAPTOP, 150)
+        self._record(EVENT_LEFT, LAPTOP, 300)
+        self._record(EVENT_JOINED, PHONE, 400)
+
+        assert self.history.transitions(mac=PHONE.lower(), start=150) == [(PHONE, 200, False), (PHONE, 400, True)]
+
+        assert self.history.last_seen(LAPTOP) == 300
+        assert self.history.last_seen(PHONE, now=500) == 500
+        assert self.history.last_seen('AA:BB:CC:DD:EE:FF') == None
+
+        assert self.history.occupancy(0, 500) == 300
+        assert self.history.occupancy(120, 450, [PHONE]) == 130
+        assert self.history.occupancy(160, 250, [LAPTOP]) == 90
+
+
+    def test_compaction_and_restart(self):
+        self._record(EVENT_JOINED, PHONE, 100)
+        self._record(EVENT_LEFT, PHONE, 200)
+        self._record(EVENT_JOINED, PHONE, 300)
+        self._record(EVENT_JOINED, LAPTOP, 150)
+
+        assert self.history.compact(250) == 1
+        assert self.history.occupancy(250, 400) == 150
+
+        self.history.close(ts=400)
+
+        self.history = FBPresenceHistory(self.path)
+
+        assert self.history.transitions(start=300) == [(PHONE, 300, True), (PHONE, 400, False), (LAPTOP, 400, False)]
+
+        self._record(EVENT_JOINED, PHONE, 500)
+        self._record(EVENT_LEFT, LAPTOP, 500)
+
+        assert self.history.transitions(start=500) == [(PHONE, 500, True)]
+
+
+    @patch('FBPresence.fritzbox.FBCore.FritzBox', autospec=True)
+    @patch('FBPresence.time.time', autospec=True)
+    def test_restart_with_state_file(self, time_mock, fritzbox_mock):
+        phone = {'name' : 'Phone', 'mac' : PHONE, 'ip' : '192.168.0.20', 'type' : 'wlan'}
+
+        def start(ts):
+            time_mock.return_value = ts
+
+            fbP = FBPresence(ip='192.168.0.1', password='abc', state_file=os.path.join(self.dir.name, 'state.json'))
+            fbP.fb.load_fritzbox_page.return_value = json.dumps({'data' : {'net' : {'devices' : [phone]}}}).encode()
+            fbP.fb.load_fritzbox_page.side_effect = lambda url, param, parse=None: parse(fbP.fb.load_fritzbox_page.return_value)
+
+            history = FBPresenceHistory(self.path)
+
+            with patch.object(fbP.supervisor, 'start', autospec=True):
+                history.attach(fbP)
+
+            return fbP, history
+
+        self.history.close()
+
+        fbP, self.history = start(100)
+        fbP.supervisor.poll()
+        fbP.stop_supervision()
+        self.history.close(ts=110)
+
+        # The phone is restored as present and does not join again with the next poll
+        fbP, self.history = start(120)
+
+        assert self.history.last_seen(PHONE, now=130) == 130
+
+        fbP.supervisor.poll()
+
+        assert self.history.transitions() == [(PHONE, 100, True), (PHONE, 110, False), (PHONE, 120, True)]
+
+
+#===============================================================================
+# Start of program
+#===============================================================================
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This test module will test the functionality of the module FBHomeAuto
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import sys
+import os
+import pytest
+
+from unittest import mock, TestCase
+from unittest.mock import patch, Mock
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up,'..'))
+
+
+#===============================================================================
+# User imports
+#===============================================================================
+from FBHomeAuto import FBHomeAuto, InvalidParameterError, cover_with_groups, FUNCTION_SWITCH_PLUG, FUNCTION_DECT_REPEATER
+from FBCore import HTTP_PORT
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+IP                = '192.168.0.1'
+PASSWORD          = 'abc'
+DEVICE_LIST       = b"""<devicelist version="1">
+  <device identifier="08761 0000434" id="17" functionbitmask="896" fwversion="03.33" manufacturer="AVM" productname="FRITZ!DECT 200">
+    <present>1</present>
+    <name>Steckdose</name>
+    <switch><state>1</state><mode>auto</mode><lock>0</lock><devicelock>0</devicelock></switch>
+    <powermeter><power>0</power><energy>707</energy><voltage>230252</voltage></powermeter>
+    <temperature><celsius>285</celsius><ofset>0</ofset></temperature>
+  </device>
+  <device identifier="08761 1048079" id="16" functionbitmask="1280" fwversion="03.33" manufacturer="AVM" productname="FRITZ!DECT Repeater 100">
+    <present>1</present>
+    <name>FRITZ!DECT Rep 100 #1</name>
+    <temperature><celsius></celsius><ofset>0</ofset></temperature>
+  </device>
+  <group identifier="65:3A:18-900" id="900" functionbitmask="512" fwversion="1.0" manufacturer="AVM" productname="">
+    <present>1</present>
+    <name>Gruppe</name>
+    <switch><state>1</state><mode>auto</mode><lock/><devicelock/></switch>
+    <groupinfo><masterdeviceid>0</masterdeviceid><members>17</members></groupinfo>
+  </group>
+</devicelist>"""
+
+
+#===============================================================================
+# Test class definitions
+#===============================================================================
+class test_CLASS(TestCase):
+    """Test class that contains all test cases"""
+    @patch('FBHomeAuto.fritzbox.FBCore.FritzBox', autospec=True)
+    def setUp(self, fritzbox_mock):
+        self.fbHA = FBHomeAuto(ip=IP, password=PASSWORD)
+        fritzbox_mock.assert_called_once_with(IP, PASSWORD, port=HTTP_PORT, session_store=None)
+
+
+    def tearDown(self):
+        pass
+
+
+    def _stream_device_list(self, chunk_size):
+        response = self.fbHA.fb.open_fritzbox_page.return_value
+
+        response.iter_chunks.return_value = [DEVICE_LIST[i:i + chunk_size]
+                                             for i in range(0, len(DEVICE_LIST), chunk_size)]
+
+        return response
+
+
+    def test_get_device_list_infos(self):
+        response = self._stream_device_list(chunk_size=7)
+
+        plug, repeater, group = self.fbHA.get_device_list_infos()
+
+        assert self.fbHA.fb.open_fritzbox_page.call_count == 1
+        assert response.__exit__.call_count == 1
+
+        assert plug.ain == '087610000434'
+        assert plug.name == 'Steckdose'
+        assert plug.has_function(FUNCTION_SWITCH_PLUG) == True
+        assert plug.present == True
+        assert plug.switch_state == True
+        assert plug.power == 0
+        assert plug.energy == 707
+        assert plug.voltage == 230252
+        assert plug.temperature == 28.5
+
+        assert repeater.has_function(FUNCTION_DECT_REPEATER) == True
+        assert repeater.switch_state is None
+        assert repeater.power is None
+        assert repeater.temperature is None
+
+        assert group.is_group == True
+        assert group.members == [17]
+
+
+    def test_iter_device_list_infos(self):
+        self._stream_device_list(chunk_size=100)
+
+        actors = self.fbHA.iter_device_list_infos(fields={'switch_state'})
+
+        plug = next(actors)
+
+        assert plug.ain == '087610000434'
+        assert plug.switch_state == True
+        assert plug.name == ''
+        assert plug.power is None
+
+        assert [actor.id for actor in actors] == [16, 900]
+
+
+    def test_get_device_list_infos_failed(self):
+        self.fbHA.fb.open_fritzbox_page.return_value = None
+
+        assert self.fbHA.get_device_list_infos() is None
+
+
+    def test_get_switch_groups(self):
+        self._stream_device_list(chunk_size=100)
+
+        assert self.fbHA.get_switch_groups() == {'65:3A:18-900' : ['087610000434']}
+        assert self.fbHA.get_switch_groups() == {'65:3A:18-900' : ['087610000434']}
+        assert self.fbHA.fb.open_fritzbox_page.call_count == 1
+
+
+    def test_cover_with_groups(self):
+        groups = {'g1' : ['a', 'b'], 'g2' : ['a', 'b', 'c'], 'g3' : ['c', 'd'], 'g4' : ['d']}
+
+        assert cover_with_groups(['a', 'b', 'c', 'd'], groups) == [('g2', ['a', 'b', 'c']), ('d', ['d'])]
+        assert cover_with_groups(['d', 'b', 'a'], groups) == [('g1', ['b', 'a']), ('d', ['d'])]
+        assert cover_with_groups(['a'], groups) == [('a', ['a'])]
+
+
+    def test_failed_load(self):
+        self.fbHA.fb.load_fritzbox_page.return_value = None
+
+        assert self.fbHA.get_switch_plugs() is None
+        assert self.fbHA.get_switch_plug_state('087610000434') is None
+        assert self.fbHA.toggle_switch_plug_state('087610000434') is None
+
+
+    def test_set_switch_plugs_state(self):
+        self.fbHA.fb.load_fritzbox_page.side_effect = lambda url, param: None if param.endswith('=b') else b'0\n'
+        self.fbHA.fb.is_session_valid.return_value = False
+
+        assert self.fbHA.set_switch_plugs_state(['a', 'b', 'a', 'c'], 'off', use_groups=False) == \
+            {'a' : '0', 'b' : None, 'c' : '0'}
+        assert self.fbHA.fb.load_fritzbox_page.call_count == 3
+
+        self.fbHA.fb.ensure_session.assert_called_once_with()
+        self.fbHA.fb.login.assert_not_called()
+
+        with pytest.raises(InvalidParameterError):
+            self.fbHA.set_switch_plugs_state(['a'], 'dimmed')
+
+
+#===============================================================================
+# Start of program
+#===============================================================================
+if __name__ == '__main__':
+    unittest.main()
@@ -23,6 +23,7 @@ __email__      = "Dennis.Jung@it-jung.com"
 #===============================================================================
 import sys
 import os
+import tempfile
 import json
 import pytest
 
@@ -40,7 +41,8 @@ sys.path.insert(0, os.path.join(dir_up,'..'))
 #===============================================================================
 # User imports
 #===============================================================================
-from FBPresence import FBPresence, InvalidParameterError
+from FBPresence import FBPresence, FBAdaptivePollInterval, InvalidParameterError, EVENT_JOINED, EVENT_LEFT, EVENT_CHANGED
+from FBCore import HTTP_PORT
 
 
 #===============================================================================
@@ -51,15 +53,30 @@ PASSWORD          = 'abc'
 TIMESTAMP_NOW     = 123
 
 
+#===============================================================================
+# Method definitions
+#===============================================================================
+def load_fritzbox_page(fb):
+    """Let the mocked load_fritzbox_page() pass its return value to the parse function"""
+    def load_page(url, param, parse=None):
+        page = fb.load_fritzbox_page.return_value
+
+        return parse(page) if parse is not None else page
+
+    fb.load_fritzbox_page.side_effect = load_page
+
+
 #===============================================================================
 # Test class definitions
 #===============================================================================
 class test_CLASS(TestCase):
     """Test class that contains all test cases"""
-    @patch('FBPresence.FBCore.FritzBox', autospec=True)
+    @patch('FBPresence.fritzbox.FBCore.FritzBox', autospec=True)
     def setUp(self, fritzbox_mock):
         self.fbP = FBPresence(ip=IP, password=PASSWORD)
-        fritzbox_mock.assert_called_once_with(IP, PASSWORD)
+        fritzbox_mock.assert_called_once_with(IP, PASSWORD, port=HTTP_PORT, user=None, session_store=None)
+
+        load_fritzbox_page(self.fbP.fb)
 
 
     def tearDown(self):
@@ -74,11 +91,47 @@ class test_CLASS(TestCase):
     @patch('FBPresence.time.time', autospec=True)
     def test_get_wlan_device_information(self, time_mock, json_mock):
         time_mock.return_value = TIMESTAMP_NOW
+        self.fbP.fb.load_fritzbox_page.return_value = b'{}'
         self.fbP.get_wlan_device_information()
         assert json_mock.call_count == 1
         assert self.fbP.device_list == {}
 
 
+    @patch('FBPresence.time.time', autospec=True)
+    def test_unchanged_device_list(self, time_mock):
+        events = []
+
+        self.fbP.events.set_debounce('AA:BB:CC:DD:EE:02', 1)
+
+        with patch.object(self.fbP.supervisor, 'start', autospec=True):
+            self.fbP.subscribe(events.append)
+
+        devices = [{'name' : 'Phone', 'mac' : 'AA:BB:CC:DD:EE:01', 'ip' : '192.168.0.20', 'type' : 'wlan'},
+                   {'name' : 'Laptop', 'mac' : 'AA:BB:CC:DD:EE:02', 'ip' : '192.168.0.21', 'type' : 'wlan'}]
+
+        time_mock.return_value = 0
+        self.fbP.fb.load_fritzbox_page.return_value = json.dumps({'data' : {'net' : {'devices' : devices}}}).encode()
+        self.fbP.get_wlan_device_information()
+
+        time_mock.return_value = 10
+        self.fbP.fb.load_fritzbox_page.return_value = json.dumps({'data' : {'net' : {'devices' : devices[:1]}}}).encode()
+        self.fbP.get_wlan_device_information()
+
+        with patch('FBPresence.json.loads', autospec=True) as json_mock:
+            for ts in (20, 80):
+                time_mock.return_value = ts
+                devices_list, chk_ts = self.fbP.get_wlan_device_information()
+
+            json_mock.assert_not_called()
+
+        assert chk_ts == 80
+        assert devices_list['Phone'].on_ts == 80
+        assert devices_list['Laptop'].on_ts == 0
+        assert [(event.kind, event.name, event.ts) for event in events] == [('joined', 'Phone', 0),
+                                                                            ('joined', 'Laptop', 0),
+                                                                            ('left', 'Laptop', 80)]
+
+
     @patch('FBPresence.FBPresence.get_wlan_device_information', autospec=True)
     def test_is_device_present(self, fbpresence_mock):
         debounce_time = 1
@@ -98,6 +151,223 @@ class test_CLASS(TestCase):
             self.fbP.is_device_present(debounce_off=1) == False
 
 
+    @patch('FBPresence.FBPresence.get_wlan_device_information', autospec=True)
+    def test_supervisor_poll(self, fbpresence_mock):
+        callback = Mock()
+
+        fbpresence_mock.return_value = {'Device' : {'on_ts' : TIMESTAMP_NOW}}, TIMESTAMP_NOW
+
+        with patch.object(self.fbP.supervisor, 'start', autospec=True) as start_mock:
+            handle = self.fbP.supervise_device('Device', callback)
+            start_mock.assert_called_once_with()
+
+        self.fbP.supervisor.poll()
+        callback.assert_not_called()
+
+        fbpresence_mock.return_value = {'Device' : {'on_ts' : 0}}, TIMESTAMP_NOW
+
+        self.fbP.supervisor.poll()
+        callback.assert_called_once_with('Device', True, False)
+
+        # A failed load keeps the presence states
+        fbpresence_mock.return_value = None
+
+        assert self.fbP.supervisor.poll() == False
+        assert self.fbP.supervisor.device_states == {'Device' : False}
+
+        handle.unregister()
+        assert self.fbP.supervisor.device_states == {}
+
+        fbpresence_mock.return_value = {'Device' : {'on_ts' : TIMESTAMP_NOW}}, TIMESTAMP_NOW
+
+        self.fbP.supervisor.poll()
+        assert callback.call_count == 1
+        assert fbpresence_mock.call_count == 4
+
+
+    @patch('FBPresence.time.time', autospec=True)
+    def test_device_indexes(self, time_mock):
+        time_mock.return_value = TIMESTAMP_NOW
+
+        devices = [{'name' : 'Phone', 'mac' : 'aa:bb:cc:dd:ee:01', 'ip' : '192.168.0.20', 'type' : 'wlan'},
+                   {'name' : 'Laptop', 'mac' : 'AA:BB:CC:DD:EE:02', 'ip' : '192.168.0.21', 'type' : 'wlan'}]
+
+        self.fbP.fb.load_fritzbox_page.return_value = json.dumps({'data' : {'net' : {'devices' : devices}}}).encode()
+
+        self.fbP.get_wlan_device_information()
+
+        assert self.fbP.get_device(mac='AA-BB-CC-DD-EE-01').name == 'Phone'
+        assert self.fbP.get_device(ip='192.168.0.21').name == 'Laptop'
+        assert self.fbP.is_device_present(mac='aa:bb:cc:dd:ee:02') == True
+        assert self.fbP.is_device_present(ip='192.168.0.22') == False
+
+        devices[0] = {'name' : 'NewPhone', 'mac' : 'AA:BB:CC:DD:EE:01', 'ip' : '192.168.0.22', 'type' : 'wlan'}
+
+        self.fbP.fb.load_fritzbox_page.return_value = json.dumps({'data' : {'net' : {'devices' : devices}}}).encode()
+
+        self.fbP.get_wlan_device_information()
+
+        assert sorted(self.fbP.device_list.keys()) == ['Laptop', 'NewPhone']
+        assert self.fbP.get_device(ip='192.168.0.20') is None
+        assert self.fbP.get_device(ip='192.168.0.22') is self.fbP.get_device(mac='AA:BB:CC:DD:EE:01')
+
+
+    @patch('FBPresence.time.time', autospec=True)
+    def test_device_eviction(self, time_mock):
+        evicted = []
+
+        self.fbP.device_ttl = 100
+        self.fbP.max_devices = 2
+        self.fbP.on_evict = evicted.append
+
+        devices = [{'name' : 'Device%d' % i, 'mac' : 'AA:BB:CC:DD:EE:%02d' % i, 'ip' : '192.168.0.%d' % i}
+                   for i in range(3)]
+
+        for ts, device in enumerate(devices):
+            time_mock.return_value = ts
+
+            self.fbP.fb.load_fritzbox_page.return_value = json.dumps({'data' : {'net' : {'devices' : [device]}}}).encode()
+
+            self.fbP.get_wlan_device_information()
+
+        assert [device.name for device in evicted] == ['Device0']
+        assert sorted(self.fbP.device_list.keys()) == ['Device1', 'Device2']
+        assert self.fbP.get_device(mac='AA:BB:CC:DD:EE:00') is None
+        assert self.fbP.get_device(ip='192.168.0.0') is None
+
+        time_mock.return_value = 102
+
+        self.fbP.get_wlan_device_information()
+
+        assert [device.name for device in evicted] == ['Device0', 'Device1']
+        assert list(self.fbP.device_list.keys()) == ['Device2']
+
+
+    @patch('FBPresence.time.time', autospec=True)
+    def test_presence_events(self, time_mock):
+        def load(devices):
+            self.fbP.fb.load_fritzbox_page.return_value = json.dumps({'data' : {'net' : {'devices' : devices}}}).encode()
+
+            self.fbP.get_wlan_device_information()
+
+        phone = {'name' : 'Phone', 'mac' : 'AA:BB:CC:DD:EE:01', 'ip' : '192.168.0.20', 'type' : 'wlan'}
+        laptop = {'name' : 'Laptop', 'mac' : 'AA:BB:CC:DD:EE:02', 'ip' : '192.168.0.21', 'type' : 'wlan'}
+
+        self.fbP.events.set_debounce(phone['mac'], 1)
+
+        events = []
+        subscription = self.fbP.events.subscribe(events.append)
+        joined = self.fbP.events.iter_events(kinds=(EVENT_JOINED,), timeout=0)
+
+        time_mock.return_value = TIMESTAMP_NOW
+        load([phone, laptop])
+        assert [(event.kind, event.name) for event in events] == [(EVENT_JOINED, 'Phone'), (EVENT_JOINED, 'Laptop')]
+
+        del events[:]
+        time_mock.return_value = TIMESTAMP_NOW + 30
+        load([dict(laptop, ip='192.168.0.22')])
+        assert len(events) == 1
+        assert (events[0].kind, events[0].mac) == (EVENT_CHANGED, laptop['mac'])
+        assert events[0].changes == {'ip' : ('192.168.0.21', '192.168.0.22')}
+
+        del events[:]
+        time_mock.return_value = TIMESTAMP_NOW + 90
+        load([dict(laptop, ip='192.168.0.22')])
+        assert [(event.kind, event.name) for event in events] == [(EVENT_LEFT, 'Phone')]
+
+        del events[:]
+        load([dict(laptop, ip='192.168.0.22')])
+        assert events == []
+
+        subscription.unregister()
+        load([phone])
+        assert events == []
+
+        assert [event.name for event in joined] == ['Phone', 'Laptop', 'Phone']
+
+        # Every event counts once per subscription it was delivered to
+        assert self.fbP.events.delivered == 4 + 3
+
+
+    @patch('FBPresence.fritzbox.FBCore.FritzBox', autospec=True)
+    @patch('FBPresence.time.time', autospec=True)
+    def test_warm_start(self, time_mock, fritzbox_mock):
+        phone = {'name' : 'Phone', 'mac' : 'AA:BB:CC:DD:EE:01', 'ip' : '192.168.0.20', 'type' : 'wlan'}
+
+        def load(fbP, devices):
+            fbP.fb.load_fritzbox_page.return_value = json.dumps({'data' : {'net' : {'devices' : devices}}}).encode()
+
+            fbP.supervisor.poll()
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            state_file = os.path.join(state_dir, 'state.json')
+
+            callback = Mock()
+            events = []
+
+            time_mock.return_value = TIMESTAMP_NOW
+            fbP = FBPresence(ip=IP, password=PASSWORD, state_file=state_file)
+            fbP.supervisor.debounce_off = 1
+            fbP.events.debounce_off = 1
+
+            load_fritzbox_page(fbP.fb)
+
+            with patch.object(fbP.supervisor, 'start', autospec=True):
+                fbP.supervise_device('Phone', callback)
+
+            load(fbP, [phone])
+            fbP.stop_supervision()
+
+            # Restart while the phone is absent shorter than the debounce time
+            time_mock.return_value = TIMESTAMP_NOW + 30
+            fbP = FBPresence(ip=IP, password=PASSWORD, state_file=state_file)
+            fbP.supervisor.debounce_off = 1
+            fbP.events.debounce_off = 1
+            fbP.events.subscribe(events.append)
+
+            assert fbP.get_device(mac=phone['mac']).on_ts == TIMESTAMP_NOW
+
+            with patch.object(fbP.supervisor, 'start', autospec=True):
+                fbP.supervise_device('Phone', callback)
+
+            load(fbP, [])
+            assert callback.call_count == 0
+            assert events == []
+
+            time_mock.return_value = TIMESTAMP_NOW + 90
+            load(fbP, [])
+            callback.assert_called_once_with('Phone', True, False)
+            assert [event.kind for event in events] == [EVENT_LEFT]
+
+            # Outdated state files are ignored
+            fbP.save_state()
+
+            time_mock.return_value = TIMESTAMP_NOW + 90 + 3600
+            fbP = FBPresence(ip=IP, password=PASSWORD, state_file=state_file)
+
+            assert fbP.device_list == {}
+
+
+    def test_adaptive_poll_interval(self):
+        interval = FBAdaptivePollInterval(min_interval=2, max_interval=10, backoff_factor=2, fast_period=5)
+
+        assert interval.update(False, now=0) == 4
+        assert interval.update(False, now=1) == 8
+        assert interval.update(False, now=2) == 10
+
+        assert interval.update(True, now=3) == 2
+        assert interval.update(False, now=7) == 2
+        assert interval.update(False, now=8) == 4
+
+        metrics = interval.get_metrics()
+        assert metrics['interval'] == 4
+        assert metrics['polls'] == 6
+        assert metrics['changes'] == 1
+
+        with pytest.raises(InvalidParameterError):
+            FBAdaptivePollInterval(min_interval=10, max_interval=2)
+
+
 #===============================================================================
 # Start of program
 #===============================================================================
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Short description.
+
+This test module will test the functionality of the module FBTR064
+"""
+
+__author__     = "Dennis Jung"
+__copyright__  = "Copyright 2019, Dennis Jung"
+__credits__    = ["Dennis Jung"]
+__license__    = "GPL Version 3"
+__maintainer__ = "Dennis Jung"
+__email__      = "Dennis.Jung@it-jung.com"
+
+
+#===============================================================================
+# Additional information
+#===============================================================================
+
+
+#===============================================================================
+# System imports
+#===============================================================================
+import sys
+import os
+import pytest
+
+from unittest import mock, TestCase
+from unittest.mock import patch, Mock
+
+
+#===============================================================================
+# Include parent folders
+#===============================================================================
+dir_up = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(dir_up,'..'))
+
+
+#===============================================================================
+# User imports
+#===============================================================================
+from FBTR064 import FBTR064, FBTR064Fault, parse_action_response, parse_host_list
+
+
+#===============================================================================
+# Constant declarations
+#===============================================================================
+IP       = '192.168.0.1'
+PASSWORD = 'secret'
+MAC      = 'AA:BB:CC:DD:EE:FF'
+
+ENVELOPE = ('<?xml version="1.0"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+            's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>%s</s:Body></s:Envelope>')
+
+HOST_ENTRY = ENVELOPE % ('<u:GetSpecificHostEntryResponse xmlns:u="urn:dslforum-org:service:Hosts:1">'
+                         '<NewIPAddress>192.168.0.20</NewIPAddress><NewInterfaceType>802.11</NewInterfaceType>'
+                         '<NewActive>1</NewActive><NewHostName>iphone</NewHostName>'
+                         '</u:GetSpecificHostEntryResponse>')
+
+FAULT = ENVELOPE % ('<s:Fault><faultcode>s:Client</faultcode><faultstring>UPnPError</faultstring><detail>'
+                    '<UPnPError xmlns="urn:dslforum-org:control-1-0"><errorCode>%s</errorCode>'
+                    '<errorDescription>NoSuchEntryInArray</errorDescription></UPnPError></detail></s:Fault>')
+
+HOST_LIST = ('<?xml version="1.0" ?><List><Item><Index>1</Index><IPAddress>192.168.0.20</IPAddress>'
+             '<MACAddress>AA:BB:CC:DD:EE:FF</MACAddress><Active>1</Active><HostName>iphone</HostName>'
+             '<InterfaceType>802.11</InterfaceType></Item><Item><Index>2</Index><IPAddress></IPAddress>'
+             '<MACAddress>AA:BB:CC:DD:EE:00</MACAddress><Active>0</Active><HostName>nas</HostName>'
+             '<InterfaceType>Ethernet</InterfaceType></Item></List>')
+
+
+#===============================================================================
+# Test class definitions
+#===============================================================================
+class test_CLASS(TestCase):
+    """Test class that contains all test cases"""
+    def setUp(self):
+        self.tr064 = FBTR064(IP, PASSWORD)
+
+
+    def tearDown(self):
+        pass
+
+
+    def test_parse_action_response(self):
+        assert parse_action_response(HOST_ENTRY.encode('utf-8')) == {'NewIPAddress' : '192.168.0.20',
+                                                                     'NewInterfaceType' : '802.11',
+                                                                     'NewActive' : '1',
+                                                                     'NewHostName' : 'iphone'}
+
+        with pytest.raises(FBTR064Fault) as e:
+            parse_action_response((FAULT % '714').encode('utf-8'))
+
+        assert e.value.code == '714'
+
+
+    def test_parse_host_list(self):
+        assert parse_host_list(HOST_LIST.encode('utf-8')) == [
+            {'mac' : MAC, 'ip' : '192.168.0.20', 'name' : 'iphone', 'interface' : '802.11', 'active' : True},
+            {'mac' : 'AA:BB:CC:DD:EE:00', 'ip' : '', 'name' : 'nas', 'interface' : 'Ethernet', 'active' : False}]
+
+
+    def test_get_specific_host_entry(self):
+        with patch.object(self.tr064, 'call_action', return_value=parse_action_response(HOST_ENTRY)):
+            assert self.tr064.get_specific_host_entry(MAC) == {'mac' : MAC, 'ip' : '192.168.0.20', 'name' : 'iphone',
+                                                               'interface' : '802.11', 'active' : True}
+
+        with patch.object(self.tr064, 'call_action', side_effect=FBTR064Fault('714', 'NoSuchEntryInArray')):
+            assert self.tr064.get_specific_host_entry(MAC)['active'] == False
+
+        with patch.object(self.tr064, 'call_action', side_effect=FBTR064Fault('606', 'Action not authorized')):
+            assert self.tr064.get_specific_host_entry(MAC) == None
+
+        with patch.object(self.tr064, 'call_action', side_effect=OSError('timed out')):
+            assert self.tr064.get_specific_host_entry(MAC) == None
+
+
+#===============================================================================
+# Start of program
+#===============================================================================
+if __name__ == '__main__':
+    unittest.main()